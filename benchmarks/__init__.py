@@ -0,0 +1 @@
+# LambdaLink Benchmarks
\ No newline at end of file
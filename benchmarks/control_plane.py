@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""控制面负载测试: /api/report、/api/heartbeat及其批量接口
+python -m benchmarks.control_plane [--concurrency N] [--duration S] [--url http://host:port] [--server flask|asyncio]
+
+未指定--url时在进程内启动API服务：--server flask为server.main中的Flask应用（需要安装Flask），
+asyncio为AsyncHTTPServer。
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+from urllib.parse import urlparse
+from .harness import percentile
+
+def start_server(kind: str = 'flask', port: int = 0) -> str:
+    """在后台线程中启动API服务(flask或asyncio)，返回其URL"""
+    # 不写日志文件、不持久化注册表
+    os.environ.setdefault('LAMBDALINK_LOG_FILE', '')
+    os.environ.setdefault('LAMBDALINK_REGISTRY_STATE_DIR', '')
+    if kind == 'asyncio':
+        # 只需要注册表和接口处理逻辑，不依赖Flask
+        from server.api import ControlAPI
+        from server.http_server import AsyncHTTPServer
+        from server.registry import ClientRegistry
+        server = AsyncHTTPServer(ControlAPI(ClientRegistry(), os.environ['LAMBDALINK_API_KEY']), '127.0.0.1', port)
+        server.start()
+        return f"http://127.0.0.1:{server.port}"
+    
+    from werkzeug.serving import make_server
+    from server.main import app
+    
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+class ApiClient:
+    """复用连接的HTTP客户端，服务端关闭连接时自动重连"""
+    
+    def __init__(self, url: str, api_key: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.headers = {'X-API-Key': api_key, 'Content-Type': 'application/json'}
+        self._conn: Optional[http.client.HTTPConnection] = None
+    
+    def post(self, path: str, data: dict) -> int:
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            self._conn.connect()
+            # http.client分开发送请求头和请求体，避免Nagle与延迟确认叠加出40ms延迟
+            self._conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self._conn.request('POST', path, json.dumps(data), self.headers)
+            response = self._conn.getresponse()
+            response.read()
+            if response.will_close:
+                self._conn.close()
+                self._conn = None
+            return response.status
+        except Exception:
+            self._conn.close()
+            self._conn = None
+            raise
+
+def run(url: str, api_key: str, name: str, make_request: Callable[[int, int], tuple],
+        concurrency: int, duration: float) -> dict:
+    """concurrency个线程在duration内循环发送请求"""
+    deadline = time.perf_counter() + duration
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    
+    def worker(index: int):
+        client = ApiClient(url, api_key)
+        sequence = 0
+        while time.perf_counter() < deadline:
+            path, data = make_request(index, sequence)
+            sequence += 1
+            start = time.perf_counter()
+            try:
+                status = client.post(path, data)
+            except Exception:
+                errors[index] += 1
+                continue
+            if status != 200:
+                errors[index] += 1
+                continue
+            latencies[index].append(time.perf_counter() - start)
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    samples = sorted(x for values in latencies for x in values)
+    return {
+        'benchmark': 'control_plane',
+        'endpoint': name,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': sum(errors),
+        'requests_per_s': round(len(samples) / elapsed, 1),
+        'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='已运行的服务端地址，例如 http://127.0.0.1:8000')
+    parser.add_argument('--api-key', default=os.getenv('LAMBDALINK_API_KEY', 'default-api-key-change-me'))
+    parser.add_argument('--server', choices=('flask', 'asyncio'), default='flask', help='未指定--url时启动的API服务')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--batch', type=int, default=10, help='批量接口每次请求的端口数')
+    args = parser.parse_args()
+    
+    url = args.url
+    if not url:
+        os.environ.setdefault('LAMBDALINK_API_KEY', args.api_key)
+        url = start_server(args.server)
+        logging.disable(logging.WARNING)
+    
+    # 每个线程模拟一个客户端，使用各自的IPv6地址和端口段
+    def ipv6(index: int) -> str:
+        return f"2001:db8::{index + 1:x}"
+    
+    def ports(index: int) -> List[int]:
+        base = 10000 + index * args.batch
+        return list(range(base, base + args.batch))
+    
+    requests = {
+        'report': lambda i, n: ('/api/report', {'ipv6': ipv6(i), 'port': ports(i)[n % args.batch]}),
+        'report_batch': lambda i, n: ('/api/report/batch', {'ipv6': ipv6(i), 'ports': ports(i)}),
+        'heartbeat': lambda i, n: ('/api/heartbeat', {'port': ports(i)[n % args.batch], 'ipv6': ipv6(i)}),
+        'heartbeat_batch': lambda i, n: ('/api/heartbeat/batch', {'ports': ports(i), 'ipv6': ipv6(i)})
+    }
+    # 先注册，心跳测试才能命中
+    for name, make_request in requests.items():
+        result = run(url, args.api_key, name, make_request, args.concurrency, args.duration)
+        result['server'] = 'external' if args.url else args.server
+        print(json.dumps(result), flush=True)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
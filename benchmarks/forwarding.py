@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""转发模式吞吐对比: python -m benchmarks.forwarding [--size MB] [--rounds N]"""
+import argparse
+import json
+import socket
+import threading
+import time
+from server.forwarding import BufferPool, get_forwarder, splice_supported, FORWARD_MODES, FORWARD_SPLICE
+
+def tcp_pair():
+    """在回环地址上创建一对已连接的TCP socket"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+def run_once(mode: str, total_bytes: int) -> float:
+    """发送端 -> [转发] -> 接收端，返回吞吐(MB/s)"""
+    forwarder = get_forwarder(mode, BufferPool())
+    sender, proxy_in = tcp_pair()
+    proxy_out, receiver = tcp_pair()
+
+    def send():
+        chunk = b'x' * (256 * 1024)
+        remaining = total_bytes
+        while remaining > 0:
+            n = min(remaining, len(chunk))
+            sender.sendall(chunk[:n])
+            remaining -= n
+        sender.shutdown(socket.SHUT_WR)
+
+    def forward():
+        forwarder(proxy_in, proxy_out)
+        proxy_out.shutdown(socket.SHUT_WR)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=send), threading.Thread(target=forward)]
+    for t in threads:
+        t.start()
+
+    buf = bytearray(1024 * 1024)
+    received = 0
+    while True:
+        n = receiver.recv_into(buf)
+        if not n:
+            break
+        received += n
+    elapsed = time.perf_counter() - start
+
+    for t in threads:
+        t.join()
+    for s in (sender, proxy_in, proxy_out, receiver):
+        s.close()
+
+    assert received == total_bytes, f"expected {total_bytes} bytes, got {received}"
+    return total_bytes / elapsed / (1024 * 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=512, help='每轮传输的数据量(MB)')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    for mode in FORWARD_MODES:
+        if mode == FORWARD_SPLICE and not splice_supported():
+            continue
+        results = [run_once(mode, args.size * 1024 * 1024) for _ in range(args.rounds)]
+        print(json.dumps({
+            'benchmark': 'forwarding',
+            'mode': mode,
+            'size_mb': args.size,
+            'best_mb_s': round(max(results), 1),
+            'mean_mb_s': round(sum(results) / len(results), 1)
+        }))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
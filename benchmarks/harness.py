@@ -0,0 +1,317 @@
+"""基准测试公共组件：进程内启动代理、本地echo/sink服务、负载生成器"""
+import asyncio
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+from server.registry import ClientRegistry
+from server.proxy import TCPProxy
+from server.async_proxy import AsyncTCPProxy
+from server.forwarding import FORWARD_COPY
+from server.admission import AdmissionController
+from server.tunnel import TunnelServer
+from server.tuning import SocketTuner
+from server.utils import create_listener
+from client.tunnel import TunnelClient
+
+# 代理监听的回环地址；本地服务占用127.0.0.1上的同一端口，两者绑定不同地址互不冲突
+PROXY_HOST = '127.0.0.2'
+LOCAL_HOST = '127.0.0.1'
+CLIENT_HOST = '::1'
+
+def free_port() -> int:
+    """找一个在IPv4和IPv6回环地址上都空闲的端口"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        try:
+            with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as sock:
+                sock.bind((CLIENT_HOST, port))
+            return port
+        except OSError:
+            continue
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+class BackendServers:
+    """在独立事件循环中运行的测试服务
+    
+    echo: 回显一条消息后关闭连接（类似HTTP/1.0的一问一答）
+    sink: 读取并丢弃数据，收到EOF后关闭，并记录收到的字节数
+    rpc: 长连接上循环读取一条消息(4字节长度+内容)后原样返回，整条消息到齐才回复
+    """
+    
+    READ_SIZE = 256 * 1024
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.sockets: List[socket.socket] = []
+        self.sink_bytes = 0
+        self._sink_done = threading.Condition()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+    
+    def start_echo(self, host: str, port: int) -> socket.socket:
+        return self._start(self._echo, host, port)
+    
+    def start_sink(self, host: str, port: int) -> socket.socket:
+        return self._start(self._sink, host, port)
+    
+    def start_rpc(self, host: str, port: int) -> socket.socket:
+        return self._start(self._rpc, host, port)
+    
+    def wait_sink(self, total: int, timeout: float) -> bool:
+        """等待sink累计收到total字节"""
+        with self._sink_done:
+            return self._sink_done.wait_for(lambda: self.sink_bytes >= total, timeout)
+    
+    def reset_sink(self):
+        with self._sink_done:
+            self.sink_bytes = 0
+    
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        for sock in self.sockets:
+            sock.close()
+    
+    def _start(self, handler, host: str, port: int) -> socket.socket:
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(4096)
+        self.sockets.append(sock)
+        future = asyncio.run_coroutine_threadsafe(asyncio.start_server(handler, sock=sock), self.loop)
+        future.result()
+        return sock
+    
+    async def _echo(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            data = await reader.read(self.READ_SIZE)
+            if data:
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def _rpc(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readexactly(4)
+                body = await reader.readexactly(int.from_bytes(head, 'big'))
+                writer.write(head + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _sink(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                data = await reader.read(self.READ_SIZE)
+                if not data:
+                    break
+                with self._sink_done:
+                    self.sink_bytes += len(data)
+                    self._sink_done.notify_all()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+class RelayUnderTest:
+    """进程内的代理实例：端口上的假客户端指向::1，本地服务监听127.0.0.1"""
+    
+    def __init__(self, engine: str = 'thread', forward_mode: str = FORWARD_COPY,
+                 max_connections: int = 100000, host: str = PROXY_HOST, backlog: int = 4096,
+                 admission: Optional[AdmissionController] = None):
+        self.host = host
+        self.backlog = backlog
+        # 各端口的socket调优配置由add_port指定
+        self.tuning = SocketTuner()
+        self.registry = ClientRegistry(timeout=3600)
+        # tunnel路径：假客户端通过隧道连接代理，隧道的另一端连接后端
+        self.tunnels = TunnelServer('benchmark', LOCAL_HOST, free_port())
+        if engine == 'asyncio':
+            self.proxy = AsyncTCPProxy(self.registry, max_connections, backlog=backlog, admission=admission,
+                                       tunnels=self.tunnels, tuning=self.tuning)
+        else:
+            self.proxy = TCPProxy(self.registry, max_connections, forward_mode, backlog=backlog, admission=admission,
+                                  tunnels=self.tunnels, tuning=self.tuning)
+        self.backends = BackendServers()
+        self.tunnel_client: Optional[TunnelClient] = None
+        self._sockets: Dict[int, socket.socket] = {}
+        self._tunnel_ports: List[int] = []
+    
+    def add_port(self, path: str, kind: str = 'echo', profile: Optional[str] = None) -> int:
+        """创建一个代理端口；path为local时后端是本地服务，为client/tunnel时后端是注册的假客户端"""
+        port = free_port()
+        start = {'echo': self.backends.start_echo, 'sink': self.backends.start_sink,
+                 'rpc': self.backends.start_rpc}[kind]
+        if profile:
+            self.tuning.assign(port, profile)
+        if path == 'local':
+            start(LOCAL_HOST, port)
+        else:
+            backend = start(CLIENT_HOST, port)
+            # 假客户端与代理在同一主机上，不能被当作本地服务
+            self.proxy.listener_cache.ignore_socket(backend)
+            self.registry.register_client(port, CLIENT_HOST)
+            if path == 'tunnel':
+                self._tunnel_ports.append(port)
+        self._sockets[port] = create_listener(self.host, port, self.backlog)
+        return port
+    
+    def start(self):
+        self.proxy.listener_cache.start()
+        if isinstance(self.proxy, AsyncTCPProxy):
+            self.proxy.start(list(self._sockets), self._sockets)
+        else:
+            self.proxy.serve(self._sockets)
+        self.proxy.listener_cache.refresh()
+        if self._tunnel_ports:
+            self.tunnels.start()
+            time.sleep(0.1)
+            self.tunnel_client = TunnelClient(lambda port: (CLIENT_HOST, port), server_host=LOCAL_HOST,
+                                              server_port=self.tunnels.port, api_key='benchmark')
+            self.tunnel_client.start(CLIENT_HOST, self._tunnel_ports)
+            deadline = time.monotonic() + 5
+            while not self.tunnel_client.connected and time.monotonic() < deadline:
+                time.sleep(0.05)
+        time.sleep(0.2)
+
+def run_connections(host: str, port: int, concurrency: int, duration: float,
+                    payload: bytes = b'x' * 64) -> dict:
+    """concurrency个线程循环执行 连接 -> 发送 -> 收到回显 -> 关闭"""
+    deadline = time.perf_counter() + duration
+    connect_times: List[List[float]] = [[] for _ in range(concurrency)]
+    response_times: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    
+    def worker(index: int):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with socket.create_connection((host, port), timeout=10) as sock:
+                    connected = time.perf_counter()
+                    sock.sendall(payload)
+                    received = 0
+                    while received < len(payload):
+                        data = sock.recv(65536)
+                        if not data:
+                            break
+                        received += len(data)
+                    if received < len(payload):
+                        raise ConnectionError('short response')
+            except OSError:
+                errors[index] += 1
+                continue
+            finished = time.perf_counter()
+            connect_times[index].append(connected - start)
+            response_times[index].append(finished - start)
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    connects = sorted(x for times in connect_times for x in times)
+    responses = sorted(x for times in response_times for x in times)
+    return {
+        'connections': len(responses),
+        'errors': sum(errors),
+        'connections_per_s': round(len(responses) / elapsed, 1),
+        'connect_p50_ms': round(percentile(connects, 0.5) * 1000, 3),
+        'connect_p99_ms': round(percentile(connects, 0.99) * 1000, 3),
+        'response_p50_ms': round(percentile(responses, 0.5) * 1000, 3),
+        'response_p99_ms': round(percentile(responses, 0.99) * 1000, 3)
+    }
+
+def run_round_trips(host: str, port: int, connections: int, duration: float, payload: bytes = b'x' * 64) -> dict:
+    """connections个长连接循环执行 发送长度头 -> 发送内容 -> 收到完整回复
+    
+    每条消息分两次写出，中转一侧开启Nagle时第二次写要等第一段被确认，服务端又要等消息到齐才回复，
+    往返时间会出现延迟确认的等待；负载生成器自身的socket设置了TCP_NODELAY。
+    """
+    deadline = time.perf_counter() + duration
+    round_trips: List[List[float]] = [[] for _ in range(connections)]
+    errors = [0] * connections
+    head = len(payload).to_bytes(4, 'big')
+    expected = len(head) + len(payload)
+    
+    def worker(index: int):
+        try:
+            with socket.create_connection((host, port), timeout=10) as sock:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    sock.sendall(head)
+                    sock.sendall(payload)
+                    received = 0
+                    while received < expected:
+                        data = sock.recv(65536)
+                        if not data:
+                            raise ConnectionError('connection closed')
+                        received += len(data)
+                    round_trips[index].append(time.perf_counter() - start)
+        except OSError:
+            errors[index] += 1
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    times = sorted(x for values in round_trips for x in values)
+    return {
+        'round_trips': len(times),
+        'errors': sum(errors),
+        'round_trips_per_s': round(len(times) / elapsed, 1),
+        'rtt_p50_ms': round(percentile(times, 0.5) * 1000, 3),
+        'rtt_p99_ms': round(percentile(times, 0.99) * 1000, 3)
+    }
+
+def run_bulk(relay: RelayUnderTest, host: str, port: int, size: int, streams: int = 1,
+             timeout: float = 120) -> dict:
+    """streams个连接各发送size字节到sink，按sink实际收到的字节计算吞吐"""
+    relay.backends.reset_sink()
+    chunk = b'x' * (256 * 1024)
+    
+    def send():
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            remaining = size
+            while remaining > 0:
+                n = min(remaining, len(chunk))
+                sock.sendall(chunk[:n])
+                remaining -= n
+            sock.shutdown(socket.SHUT_WR)
+    
+    start = time.perf_counter()
+    threads = [threading.Thread(target=send) for _ in range(streams)]
+    for thread in threads:
+        thread.start()
+    completed = relay.backends.wait_sink(size * streams, timeout)
+    elapsed = time.perf_counter() - start
+    for thread in threads:
+        thread.join(timeout)
+    
+    received = relay.backends.sink_bytes
+    return {
+        'streams': streams,
+        'size_mb': round(size * streams / (1024 * 1024), 1),
+        'completed': completed,
+        'throughput_mb_s': round(received / elapsed / (1024 * 1024), 1)
+    }
\ No newline at end of file
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""心跳吞吐测试: 大量keep-alive连接持续发送/api/heartbeat
+python -m benchmarks.heartbeats [--server asyncio|flask] [--connections N] [--pipeline N] [--duration S]
+
+API服务在子进程中运行（与负载生成器不争用GIL），结果中server_cpu_s为服务进程消耗的CPU时间，
+heartbeats_per_cpu_s即单核每秒可处理的心跳数。--url指定已运行的服务时不统计CPU。
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List, Optional
+from urllib.parse import urlparse
+from .harness import percentile
+
+def serve(kind: str):
+    """子进程入口：启动API服务，输出URL后一直运行"""
+    from .control_plane import start_server
+    import logging
+    logging.disable(logging.WARNING)
+    print(start_server(kind), flush=True)
+    while True:
+        time.sleep(3600)
+
+def process_cpu(pid: int) -> Optional[float]:
+    """进程已消耗的CPU时间(秒)，无法读取时返回None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def encode_request(host: str, path: str, api_key: str, data: dict) -> bytes:
+    body = json.dumps(data).encode('utf-8')
+    return (
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nX-API-Key: {api_key}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    ).encode('ascii') + body
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    """读取一个响应，返回状态码"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        if line[:15].lower() == b'content-length:':
+            length = int(line[15:])
+    await reader.readexactly(length)
+    return status
+
+async def client(host: str, port: int, api_key: str, index: int, ports: int, pipeline: int,
+                 deadline: float, latencies: List[float], errors: List[int]):
+    """一个模拟客户端：注册后在一个连接上持续发送心跳，每轮发送pipeline个请求"""
+    ipv6 = f"2001:db8::{index + 1:x}"
+    port_list = [10000 + (index * ports + n) % 50000 for n in range(ports)]
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_request(host, '/api/report/batch', api_key, {'ipv6': ipv6, 'ports': port_list}))
+    if await read_response(reader) != 200:
+        raise RuntimeError('registration failed')
+    
+    requests = [
+        encode_request(host, '/api/heartbeat', api_key, {'port': port_list[n % ports], 'ipv6': ipv6})
+        for n in range(pipeline)
+    ]
+    batch = b''.join(requests)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        writer.write(batch)
+        for _ in range(pipeline):
+            if await read_response(reader) != 200:
+                errors[0] += 1
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+async def run_load(host: str, port: int, api_key: str, connections: int, ports: int, pipeline: int,
+                   duration: float) -> dict:
+    latencies: List[float] = []
+    errors = [0]
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, api_key, index, ports, pipeline, deadline, latencies, errors)
+        for index in range(connections)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'elapsed': elapsed,
+        'heartbeats': len(latencies) * pipeline,
+        'errors': errors[0],
+        'round_trip_p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'round_trip_p99_ms': round(percentile(latencies, 0.99) * 1000, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='已运行的服务端地址，例如 http://127.0.0.1:8000')
+    parser.add_argument('--server', choices=('flask', 'asyncio'), default='asyncio', help='未指定--url时启动的API服务')
+    parser.add_argument('--api-key', default=os.getenv('LAMBDALINK_API_KEY', 'default-api-key-change-me'))
+    parser.add_argument('--connections', type=int, default=64, help='并发的keep-alive连接(模拟客户端)数')
+    parser.add_argument('--ports', type=int, default=3, help='每个客户端注册的端口数')
+    parser.add_argument('--pipeline', type=int, default=1, help='每个连接每轮发送的请求数')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.serve)
+        return
+    
+    process = None
+    url = args.url
+    if not url:
+        env = dict(os.environ, LAMBDALINK_API_KEY=args.api_key)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.heartbeats', '--serve', args.server],
+            stdout=subprocess.PIPE, text=True, env=env
+        )
+        url = process.stdout.readline().strip()
+        if not url:
+            sys.exit(f"Failed to start {args.server} API server")
+    parsed = urlparse(url)
+    
+    try:
+        cpu_before = process_cpu(process.pid) if process else None
+        result = asyncio.run(run_load(parsed.hostname, parsed.port or 80, args.api_key, args.connections,
+                                      args.ports, args.pipeline, args.duration))
+        cpu_after = process_cpu(process.pid) if process else None
+    finally:
+        if process:
+            process.kill()
+            process.wait()
+    
+    elapsed = result.pop('elapsed')
+    output = {
+        'benchmark': 'heartbeats',
+        'server': 'external' if args.url else args.server,
+        'connections': args.connections,
+        'pipeline': args.pipeline,
+        'heartbeats_per_s': round(result['heartbeats'] / elapsed, 1),
+        **result
+    }
+    if cpu_before is not None and cpu_after is not None:
+        server_cpu = cpu_after - cpu_before
+        output['server_cpu_s'] = round(server_cpu, 2)
+        output['heartbeats_per_cpu_s'] = round(result['heartbeats'] / server_cpu, 1) if server_cpu else None
+    print(json.dumps(output), flush=True)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""日志调用开销: python -m benchmarks.log_overhead [--modes sync,queue] [--threads N]
+
+多个线程同时写每连接日志(控制台输出重定向到/dev/null，文件带轮转)，统计单次调用的延迟，
+对照同步写入和队列写入。每种模式在单独的进程中运行。
+线程数超过CPU核数且--interval为0时，最大延迟主要是等待GIL的时间。
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from .harness import percentile
+from common.logger import setup_logger, dropped_records, CONNECTION_LOGGER
+
+def run_mode(args):
+    log_dir = tempfile.mkdtemp(prefix='lambdalink-log-')
+    sys.stderr = open(os.devnull, 'w')
+    setup_logger('INFO', os.path.join(log_dir, 'bench.log'), args.mode, args.format,
+                 args.sample_rate, args.queue_size)
+    log = logging.getLogger(CONNECTION_LOGGER)
+    latencies = [[] for _ in range(args.threads)]
+    
+    def worker(index: int):
+        samples = latencies[index]
+        client_addr = ('192.0.2.1', 50000 + index)
+        for _ in range(args.records):
+            start = time.perf_counter()
+            log.info('Forwarding to client: %s -> [%s]:%s', client_addr, '2001:db8::1', 9000,
+                     extra={'port': 9000, 'peer': client_addr, 'backend': '2001:db8::1'})
+            samples.append(time.perf_counter() - start)
+            if args.interval:
+                time.sleep(args.interval)
+    
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    values = sorted(value for samples in latencies for value in samples)
+    print(json.dumps({
+        'benchmark': 'log_overhead',
+        'mode': args.mode,
+        'format': args.format,
+        'sample_rate': args.sample_rate,
+        'threads': args.threads,
+        'interval_ms': args.interval * 1000,
+        'records': len(values),
+        'calls_per_s': round(len(values) / elapsed),
+        'call_p50_us': round(percentile(values, 0.5) * 1e6, 2),
+        'call_p99_us': round(percentile(values, 0.99) * 1e6, 2),
+        'call_p999_us': round(percentile(values, 0.999) * 1e6, 2),
+        'call_max_us': round(values[-1] * 1e6, 2),
+        'dropped': dropped_records()
+    }), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,queue', help='要对照的日志模式，逗号分隔')
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--format', choices=('text', 'json'), default='text')
+    parser.add_argument('--sample-rate', type=float, default=1.0)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--records', type=int, default=20000, help='每个线程写入的日志数')
+    parser.add_argument('--interval', type=float, default=0.0002,
+                        help='每个线程两次调用之间的间隔(秒)，模拟处理连接的时间；0表示连续调用')
+    args = parser.parse_args()
+    
+    if args.mode:
+        run_mode(args)
+        return
+    for mode in args.modes.split(','):
+        command = [sys.executable, '-m', 'benchmarks.log_overhead', '--mode', mode] + sys.argv[1:]
+        subprocess.run(command, check=True)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
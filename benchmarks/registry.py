@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""注册表微基准: python -m benchmarks.registry [--entries N]
+
+端口号最大为65535，这里用合成的整数键模拟更大的注册表。
+"""
+import argparse
+import json
+import time
+from server.registry import ClientRegistry
+
+def timed(func, count: int) -> float:
+    """执行func并返回每次操作的耗时(微秒)"""
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) / count * 1e6
+
+def full_scan(registry: ClientRegistry, now: float) -> int:
+    """旧实现的每分钟全表扫描，作为对照"""
+    return len([
+        port for port, backends in registry._clients.items()
+        for client in backends.values()
+        if now - client.last_seen >= registry._timeout
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--expire-ratio', type=float, default=0.01, help='一次清理中到期的比例')
+    args = parser.parse_args()
+    
+    n = args.entries
+    registry = ClientRegistry(timeout=300)
+    keys = list(range(1, n + 1))
+    results = {'benchmark': 'registry', 'entries': n}
+    
+    def register():
+        with registry._lock:
+            for key in keys:
+                registry._add_client(key, '2001:db8::1', time.time())
+            registry._publish()
+    results['register_us'] = round(timed(register, n), 3)
+    
+    results['heartbeat_us'] = round(timed(lambda: registry.update_heartbeats(keys), n), 3)
+    results['get_client_us'] = round(timed(lambda: [registry.get_client(key) for key in keys], n), 3)
+    
+    # get_all_clients直接返回已发布的快照
+    results['get_all_clients_us'] = round(timed(lambda: [registry.get_all_clients() for _ in range(1000)], 1000), 3)
+    
+    now = time.time()
+    results['full_scan_ms'] = round(timed(lambda: full_scan(registry, now + 300), 1) / 1000, 3)
+    
+    # 无到期时的清理开销
+    with registry._lock:
+        results['expire_none_us'] = round(timed(lambda: registry._expire_due(now), 1), 3)
+    
+    # 到期清理：expire_ratio比例的记录在300秒前注册且没有心跳
+    expiring = int(n * args.expire_ratio)
+    aged = ClientRegistry(timeout=300)
+    with aged._lock:
+        for key in keys[:expiring]:
+            aged._add_client(key, '2001:db8::1', now - 300)
+        for key in keys[expiring:]:
+            aged._add_client(key, '2001:db8::1', now)
+        expired = []
+        results['expire_due_ms'] = round(timed(lambda: expired.extend(aged._expire_due(now)), 1) / 1000, 3)
+    results['expired'] = len(expired)
+    
+    print(json.dumps(results))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""注册表并发压力测试: 心跳写入线程与代理查找线程同时运行
+python -m benchmarks.registry_contention [--readers N] [--writers N] [--duration S]
+"""
+import argparse
+import json
+import threading
+import time
+from server.registry import ClientRegistry
+
+def locked_get_client(registry: ClientRegistry, port: int):
+    """加锁查找，作为旧实现的对照"""
+    with registry._lock:
+        for client in registry._clients.get(port, {}).values():
+            if time.time() - client.last_seen < registry._timeout:
+                return client
+        return None
+
+def run(mode: str, args) -> dict:
+    registry = ClientRegistry(timeout=300)
+    ports = list(range(1, args.ports + 1))
+    registry.register_clients(ports, '2001:db8::1')
+    
+    lookup = registry.get_client if mode == 'snapshot' else (lambda port: locked_get_client(registry, port))
+    stop = threading.Event()
+    lookups = [0] * args.readers
+    samples = [[] for _ in range(args.readers)]
+    heartbeats = [0]
+    
+    def reader(index: int):
+        count = 0
+        n = len(ports)
+        while not stop.is_set():
+            port = ports[count % n]
+            if count % 100 == 0:
+                start = time.perf_counter()
+                lookup(port)
+                samples[index].append(time.perf_counter() - start)
+            else:
+                lookup(port)
+            count += 1
+        lookups[index] = count
+    
+    def writer():
+        batch = ports[:args.batch]
+        while not stop.is_set():
+            registry.update_heartbeats(batch)
+            heartbeats[0] += 1
+            # 偶尔有客户端重新注册，触发快照发布
+            if heartbeats[0] % 50 == 0:
+                registry.register_client(ports[heartbeats[0] % len(ports)], '2001:db8::2')
+    
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    
+    latencies = sorted(x for s in samples for x in s)
+    return {
+        'benchmark': 'registry_contention',
+        'mode': mode,
+        'readers': args.readers,
+        'writers': args.writers,
+        'lookups_per_s': round(sum(lookups) / args.duration),
+        'heartbeat_batches_per_s': round(heartbeats[0] / args.duration),
+        'lookup_p50_us': round(latencies[len(latencies) // 2] * 1e6, 2),
+        'lookup_p99_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ports', type=int, default=10000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=50, help='每次批量心跳的端口数')
+    parser.add_argument('--duration', type=float, default=3)
+    args = parser.parse_args()
+    
+    for mode in ('locked', 'snapshot'):
+        print(json.dumps(run(mode, args)))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""代理数据面负载测试
+python -m benchmarks.relay [--engine thread|asyncio] [--forward-mode MODE] [--concurrency N] [--duration S]
+                          [--backlog N] [--max-connections N] [--queue-size N]
+                          [--socket-profiles default,interactive,bulk,fastopen]
+
+进程内启动代理，分别测试本地服务路径(127.0.0.1)和客户端转发路径(::1上的假客户端)：
+- connections: 短连接 连接->发送->回显->关闭，输出连接/秒和p50/p99延迟
+- round_trips: 长连接上分两次写出的请求->完整回复，输出往返延迟（对Nagle/延迟确认敏感）
+- bulk: 单连接/多连接大块传输到sink，输出吞吐
+每个socket调优配置使用各自的一组代理端口，结果中的socket_profile为该组端口的配置。
+"""
+import argparse
+import json
+import logging
+from .harness import RelayUnderTest, run_connections, run_round_trips, run_bulk
+from server.forwarding import FORWARD_MODES, FORWARD_COPY
+from server.admission import AdmissionController
+from server.tuning import PROFILES, PROFILE_DEFAULT
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--forward-mode', choices=FORWARD_MODES, default=FORWARD_COPY)
+    parser.add_argument('--paths', default='local,client', help='要测试的路径(local/client/tunnel)，逗号分隔')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--payload', type=int, default=64, help='短连接每次发送的字节数')
+    parser.add_argument('--bulk-size', type=int, default=256, help='大块传输每个连接的数据量(MB)')
+    parser.add_argument('--bulk-streams', type=int, default=1)
+    parser.add_argument('--backlog', type=int, default=4096, help='代理端口的监听队列长度')
+    parser.add_argument('--max-connections', type=int, default=100000)
+    parser.add_argument('--queue-size', type=int, default=0, help='达到连接上限时的等待队列长度')
+    parser.add_argument('--queue-timeout', type=float, default=5)
+    parser.add_argument('--socket-profiles', default=PROFILE_DEFAULT,
+                        help=f"要测试的socket调优配置({'/'.join(PROFILES)})，逗号分隔")
+    parser.add_argument('--rpc-connections', type=int, default=8, help='round_trips测试的长连接数')
+    args = parser.parse_args()
+    
+    # 每个连接都会打日志，避免日志输出影响结果
+    logging.disable(logging.WARNING)
+    
+    admission = AdmissionController(args.max_connections, queue_size=args.queue_size,
+                                    queue_timeout=args.queue_timeout)
+    relay = RelayUnderTest(args.engine, args.forward_mode, args.max_connections, backlog=args.backlog,
+                           admission=admission)
+    paths = args.paths.split(',')
+    profiles = args.socket_profiles.split(',')
+    for profile in profiles:
+        if profile not in PROFILES:
+            parser.error(f"unknown socket profile: {profile}")
+    runs = [(profile, path) for profile in profiles for path in paths]
+    echo_ports = {run: relay.add_port(run[1], 'echo', run[0]) for run in runs}
+    rpc_ports = {run: relay.add_port(run[1], 'rpc', run[0]) for run in runs}
+    sink_ports = {run: relay.add_port(run[1], 'sink', run[0]) for run in runs}
+    relay.start()
+    
+    common = {
+        'engine': args.engine,
+        'forward_mode': args.forward_mode if args.engine == 'thread' else None,
+        'backlog': args.backlog,
+        'max_connections': args.max_connections,
+        'queue_size': args.queue_size
+    }
+    for run in runs:
+        profile, path = run
+        result = run_connections(relay.host, echo_ports[run], args.concurrency, args.duration,
+                                 b'x' * args.payload)
+        print(json.dumps(dict(benchmark='relay_connections', path=path, socket_profile=profile,
+                              concurrency=args.concurrency, **common, **result)), flush=True)
+    
+    for run in runs:
+        profile, path = run
+        result = run_round_trips(relay.host, rpc_ports[run], args.rpc_connections, args.duration,
+                                 b'x' * args.payload)
+        print(json.dumps(dict(benchmark='relay_round_trips', path=path, socket_profile=profile,
+                              connections=args.rpc_connections, **common, **result)), flush=True)
+    
+    for run in runs:
+        profile, path = run
+        result = run_bulk(relay, relay.host, sink_ports[run], args.bulk_size * 1024 * 1024, args.bulk_streams)
+        print(json.dumps(dict(benchmark='relay_bulk', path=path, socket_profile=profile, **common, **result)),
+              flush=True)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""运行全部负载测试，并为每条结果加上提交号和时间，便于追踪回归
+python -m benchmarks.suite [--output results.jsonl] [--quick]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from server.tuning import PROFILES
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='追加写入的结果文件(JSON lines)，默认只输出到stdout')
+    parser.add_argument('--quick', action='store_true', help='缩短每项测试的时间')
+    args = parser.parse_args()
+    
+    duration = ['--duration', '2'] if args.quick else []
+    bulk = ['--bulk-size', '64'] if args.quick else []
+    profiles = ['--socket-profiles', ','.join(PROFILES)]
+    runs = [
+        ['benchmarks.relay', '--engine', 'thread'] + profiles + duration + bulk,
+        ['benchmarks.relay', '--engine', 'asyncio'] + profiles + duration + bulk,
+        ['benchmarks.control_plane'] + duration,
+        ['benchmarks.heartbeats'] + duration,
+        ['benchmarks.udp'] + duration,
+        ['benchmarks.log_overhead'] + (['--records', '5000'] if args.quick else []),
+    ]
+    
+    tags = {'revision': git_revision(), 'timestamp': int(time.time())}
+    output = open(args.output, 'a') if args.output else None
+    failed = False
+    try:
+        for command in runs:
+            process = subprocess.run([sys.executable, '-m'] + command, stdout=subprocess.PIPE, text=True)
+            if process.returncode != 0:
+                failed = True
+                print(json.dumps(dict(tags, benchmark=command[0], error=f"exit code {process.returncode}")))
+                continue
+            for line in process.stdout.splitlines():
+                if not line.startswith('{'):
+                    continue
+                record = json.dumps(dict(tags, **json.loads(line)))
+                print(record, flush=True)
+                if output:
+                    output.write(record + '\n')
+    finally:
+        if output:
+            output.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
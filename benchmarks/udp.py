@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""UDP转发延迟测试: python -m benchmarks.udp [--flows N] [--duration S] [--payload BYTES]
+
+进程内启动UDP转发引擎，假客户端为::1上的UDP echo服务。每个流(独立的访问者端口)循环
+发送一个数据报并等待回显，输出往返延迟p50/p99和每秒数据报数；direct为不经代理直接访问echo的基线。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import List
+from .harness import PROXY_HOST, CLIENT_HOST, free_port, percentile
+from server.registry import ClientRegistry
+from server.udp_proxy import UDPProxy
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+class PingProtocol(asyncio.DatagramProtocol):
+    """一个访问者流：发送后等待回显，记录往返时间"""
+    
+    def __init__(self, payload: bytes, deadline: float, latencies: List[float], done: asyncio.Future):
+        self.payload = payload
+        self.deadline = deadline
+        self.latencies = latencies
+        self.done = done
+        self.sent = 0.0
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self._send()
+    
+    def datagram_received(self, data, addr):
+        now = time.perf_counter()
+        self.latencies.append(now - self.sent)
+        if now < self.deadline:
+            self._send()
+        elif not self.done.done():
+            self.done.set_result(None)
+    
+    def _send(self):
+        self.sent = time.perf_counter()
+        self.transport.sendto(self.payload)
+
+async def run_flows(host: str, port: int, flows: int, duration: float, payload: bytes) -> dict:
+    loop = asyncio.get_running_loop()
+    latencies: List[float] = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    protocols = []
+    waits = []
+    for _ in range(flows):
+        done = loop.create_future()
+        _, protocol = await loop.create_datagram_endpoint(
+            lambda done=done: PingProtocol(payload, deadline, latencies, done), remote_addr=(host, port)
+        )
+        protocols.append(protocol)
+        waits.append(done)
+    # 丢失的数据报不会重发，对应的流在截止时间后视为结束
+    _, pending = await asyncio.wait(waits, timeout=duration + 1)
+    elapsed = time.perf_counter() - started
+    for protocol in protocols:
+        protocol.transport.close()
+    latencies.sort()
+    return {
+        'datagrams': len(latencies),
+        'stalled_flows': len(pending),
+        'datagrams_per_s': round(len(latencies) / elapsed, 1),
+        'rtt_p50_us': round(percentile(latencies, 0.5) * 1e6, 1),
+        'rtt_p99_us': round(percentile(latencies, 0.99) * 1e6, 1)
+    }
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    port = free_port()
+    await loop.create_datagram_endpoint(EchoProtocol, local_addr=(CLIENT_HOST, port))
+    
+    registry = ClientRegistry()
+    registry.register_client(port, CLIENT_HOST)
+    proxy = UDPProxy(registry, idle_timeout=args.flow_timeout, host=PROXY_HOST)
+    proxy.start([port])
+    
+    payload = b'x' * args.payload
+    targets = {'direct': (CLIENT_HOST, port), 'relay': (PROXY_HOST, port)}
+    for path in args.paths.split(','):
+        host, target_port = targets[path]
+        result = await run_flows(host, target_port, args.flows, args.duration, payload)
+        print(json.dumps(dict(benchmark='udp', path=path, flows=args.flows, payload=args.payload, **result)),
+              flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paths', default='direct,relay', help='要测试的路径(direct/relay)，逗号分隔')
+    parser.add_argument('--flows', type=int, default=16, help='并发的访问者流数')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--payload', type=int, default=64, help='每个数据报的字节数')
+    parser.add_argument('--flow-timeout', type=float, default=60)
+    args = parser.parse_args()
+    
+    # 每个新流都会打日志，避免日志输出影响结果
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
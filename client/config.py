@@ -7,10 +7,31 @@ class ClientConfig:
     SERVER_PORT = int(os.getenv('LAMBDALINK_SERVER_PORT', '8000'))
     API_KEY = os.getenv('LAMBDALINK_API_KEY', 'default-api-key-change-me')
     
+    # 控制通道（长连接，断开时服务端立即注销；不可用时回退到HTTP）
+    CONTROL_ENABLED = os.getenv('LAMBDALINK_CONTROL_ENABLED', 'true').lower() == 'true'
+    CONTROL_PORT = int(os.getenv('LAMBDALINK_CONTROL_PORT', '8001'))
+    CONTROL_HEARTBEAT_INTERVAL = int(os.getenv('LAMBDALINK_CONTROL_HEARTBEAT_INTERVAL', '5'))
+    
+    # 隧道（主动连接服务端的多路复用长连接，服务端经隧道转发访问者连接，无需入站连接）
+    TUNNEL_ENABLED = os.getenv('LAMBDALINK_TUNNEL_ENABLED', 'false').lower() == 'true'
+    TUNNEL_PORT = int(os.getenv('LAMBDALINK_TUNNEL_PORT', '8002'))
+    TUNNEL_CONNECTIONS = int(os.getenv('LAMBDALINK_TUNNEL_CONNECTIONS', '1'))
+    
     # 客户端配置
     LISTEN_PORTS = list(map(int, os.getenv('LAMBDALINK_LISTEN_PORTS', '9000,9001,9002').split(',')))
+    # UDP服务端口（逗号分隔，默认没有），服务直接监听本机IPv6地址，由服务端的UDP转发访问
+    UDP_PORTS = [int(port) for port in os.getenv('LAMBDALINK_UDP_PORTS', '').split(',') if port]
     REPORT_INTERVAL = int(os.getenv('LAMBDALINK_REPORT_INTERVAL', '60'))  # 1分钟
     HEARTBEAT_INTERVAL = int(os.getenv('LAMBDALINK_HEARTBEAT_INTERVAL', '30'))  # 30秒
+    # 多个客户端提供同一端口时的负载均衡权重(1-100)
+    WEIGHT = int(os.getenv('LAMBDALINK_WEIGHT', '1'))
+    
+    # 转发配置：在LISTEN_HOST上监听，连接转发到本地服务
+    LISTEN_HOST = os.getenv('LAMBDALINK_LISTEN_HOST', '::')
+    # 端口映射，如 9000=8080,9001=192.168.1.10:80；未配置的端口转发到127.0.0.1上的同一端口
+    PORT_MAP = os.getenv('LAMBDALINK_PORT_MAP', '')
+    MAX_CONNECTIONS = int(os.getenv('LAMBDALINK_MAX_CONNECTIONS', '1000'))
+    LISTEN_BACKLOG = int(os.getenv('LAMBDALINK_LISTEN_BACKLOG', '1024'))
     
     # 网络配置
     IPV6_INTERFACE = os.getenv('LAMBDALINK_IPV6_INTERFACE', None)  # None表示自动检测
@@ -18,4 +39,12 @@ class ClientConfig:
     
     # 日志配置
     LOG_LEVEL = os.getenv('LAMBDALINK_LOG_LEVEL', 'INFO')
-    LOG_FILE = os.getenv('LAMBDALINK_LOG_FILE', '/var/log/lambdalink-client.log')
\ No newline at end of file
+    LOG_FILE = os.getenv('LAMBDALINK_LOG_FILE', '/var/log/lambdalink-client.log')
+    # queue: 日志由后台线程写入，不阻塞调用线程；sync: 直接写入
+    LOG_MODE = os.getenv('LAMBDALINK_LOG_MODE', 'queue').lower()
+    # text 或 json(每行一条JSON)
+    LOG_FORMAT = os.getenv('LAMBDALINK_LOG_FORMAT', 'text').lower()
+    # 每连接INFO/DEBUG日志的采样比例(0-1)，WARNING及以上不采样
+    LOG_CONNECTION_SAMPLE_RATE = float(os.getenv('LAMBDALINK_LOG_CONNECTION_SAMPLE_RATE', '1'))
+    # 日志队列长度，写入跟不上时丢弃新日志而不是阻塞
+    LOG_QUEUE_SIZE = int(os.getenv('LAMBDALINK_LOG_QUEUE_SIZE', '10000'))
\ No newline at end of file
@@ -0,0 +1,134 @@
+import socket
+import threading
+import logging
+import time
+from typing import List, Optional
+from common.protocol import ControlMessage, ControlMessageType, read_control_message
+from .config import ClientConfig
+
+class ControlChannel:
+    """到服务端的长连接控制通道，负责注册和心跳，断开后自动重连"""
+
+    def __init__(self):
+        self.connected = False
+        self.running = False
+        self._sock: Optional[socket.socket] = None
+        self._send_lock = threading.Lock()
+        self._ipv6: Optional[str] = None
+        self._ports: List[int] = []
+
+    def start(self, ipv6: str, ports: List[int]):
+        """启动控制通道"""
+        self._ipv6 = ipv6
+        self._ports = list(ports)
+        self.running = True
+
+        thread = threading.Thread(target=self._connect_loop, daemon=True)
+        thread.start()
+
+        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat_thread.start()
+
+    def stop(self):
+        """关闭控制通道（服务端会立即注销本客户端）"""
+        self.running = False
+        self._disconnect()
+
+    def register(self, ipv6: str, ports: List[int]) -> bool:
+        """通过控制通道注册（IPv6变化时调用）"""
+        self._ipv6 = ipv6
+        self._ports = list(ports)
+        return self._send(ControlMessage(ControlMessageType.REGISTER, {
+            'api_key': ClientConfig.API_KEY,
+            'ipv6': ipv6,
+            'ports': self._ports,
+            'weight': ClientConfig.WEIGHT
+        }))
+
+    def _connect_loop(self):
+        """连接并读取服务端消息，断开后按退避重连"""
+        backoff = 1
+        while self.running:
+            try:
+                sock = socket.create_connection(
+                    (ClientConfig.SERVER_HOST, ClientConfig.CONTROL_PORT),
+                    timeout=ClientConfig.CONNECT_TIMEOUT
+                )
+                sock.settimeout(None)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                self._sock = sock
+
+                if not self.register(self._ipv6, self._ports):
+                    raise ConnectionError("Failed to send register message")
+
+                message = read_control_message(sock)
+                if message is None or message.type != ControlMessageType.ACK:
+                    error = message.data.get('message') if message else 'connection closed'
+                    raise ConnectionError(f"Registration rejected: {error}")
+
+                self.connected = True
+                backoff = 1
+                logging.info(f"Control channel connected: {ClientConfig.SERVER_HOST}:{ClientConfig.CONTROL_PORT}")
+
+                self._read_loop(sock)
+
+            except Exception as e:
+                logging.warning(f"Control channel error: {e}")
+            finally:
+                self._disconnect()
+
+            if self.running:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _read_loop(self, sock: socket.socket):
+        """处理服务端推送的消息"""
+        while self.running:
+            message = read_control_message(sock)
+            if message is None:
+                if self.running:
+                    logging.warning("Control channel closed by server")
+                return
+
+            if message.type == ControlMessageType.REREGISTER:
+                logging.info(f"Server requested re-registration: {message.data}")
+                self.register(self._ipv6, self._ports)
+            elif message.type == ControlMessageType.PING:
+                self._send(ControlMessage(ControlMessageType.PONG))
+            elif message.type == ControlMessageType.ERROR:
+                logging.error(f"Control channel error from server: {message.data.get('message')}")
+                return
+            elif message.type not in (ControlMessageType.ACK, ControlMessageType.PONG):
+                logging.debug(f"Unknown control message type: {message.type}")
+
+    def _heartbeat_loop(self):
+        """定期发送心跳，服务端据此判断连接存活"""
+        while self.running:
+            time.sleep(ClientConfig.CONTROL_HEARTBEAT_INTERVAL)
+            if self.connected:
+                self._send(ControlMessage(ControlMessageType.HEARTBEAT))
+
+    def _send(self, message: ControlMessage) -> bool:
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            with self._send_lock:
+                sock.sendall(message.encode())
+            return True
+        except OSError as e:
+            logging.debug(f"Failed to send control message: {e}")
+            return False
+
+    def _disconnect(self):
+        self.connected = False
+        sock, self._sock = self._sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                sock.close()
+            except:
+                pass
\ No newline at end of file
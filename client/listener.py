@@ -1,134 +1,154 @@
-import requests
-import time
+import asyncio
+import socket
 import threading
 import logging
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from .config import ClientConfig
-from .utils import get_public_ipv6
+from .utils import create_ipv6_listener, parse_port_map
 
-class ClientReporter:
-    def __init__(self):
-        self.server_url = f"http://{ClientConfig.SERVER_HOST}:{ClientConfig.SERVER_PORT}"
-        self.headers = {
-            'X-API-Key': ClientConfig.API_KEY,
-            'Content-Type': 'application/json'
-        }
-        self.current_ipv6: Optional[str] = None
+class PortListener:
+    """在IPv6地址上监听LISTEN_PORTS，把服务端转发来的连接转发到本地服务
+    
+    单个asyncio事件循环服务所有端口；一个方向收到EOF时只关闭对端的写方向(半关闭)，
+    两个方向都结束后才关闭连接。
+    """
+    
+    # 单次读取的最大字节数，同时也是每个流的缓冲上限
+    READ_SIZE = 64 * 1024
+    
+    def __init__(self, ports: Optional[List[int]] = None, host: str = ClientConfig.LISTEN_HOST,
+                 port_map: Optional[Dict[int, Tuple[str, int]]] = None,
+                 max_connections: int = ClientConfig.MAX_CONNECTIONS,
+                 backlog: int = ClientConfig.LISTEN_BACKLOG,
+                 connect_timeout: float = ClientConfig.CONNECT_TIMEOUT):
+        self.ports = list(ports if ports is not None else ClientConfig.LISTEN_PORTS)
+        self.host = host
+        # 监听端口 -> 本地服务地址，未配置的端口转发到127.0.0.1上的同一端口
+        self.port_map = port_map if port_map is not None else parse_port_map(ClientConfig.PORT_MAP)
+        self.max_connections = max_connections
+        self.backlog = backlog
+        self.connect_timeout = connect_timeout
+        self.active_connections = 0
         self.running = False
-        
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._servers: List[asyncio.AbstractServer] = []
+        self._thread: Optional[threading.Thread] = None
+    
+    def target(self, port: int) -> Tuple[str, int]:
+        """监听端口对应的本地服务地址"""
+        return self.port_map.get(port, ('127.0.0.1', port))
+    
     def start(self):
-        """启动上报服务"""
-        self.running = True
-        
-        # 启动初始注册
-        self._initial_report()
-        
-        # 启动定期上报线程
-        report_thread = threading.Thread(target=self._report_loop, daemon=True)
-        report_thread.start()
-        
-        # 启动心跳线程
-        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
-        heartbeat_thread.start()
+        """创建监听socket并在后台线程中运行事件循环；任一端口绑定失败时抛出异常"""
+        sockets = {}
+        try:
+            for port in self.ports:
+                sockets[port] = create_ipv6_listener(self.host, port, self.backlog)
+        except Exception:
+            for sock in sockets.values():
+                sock.close()
+            raise
         
-        logging.info("Client reporter started")
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(sockets, ready), daemon=True)
+        self._thread.start()
+        ready.wait()
+        self.running = True
     
     def stop(self):
-        """停止上报服务"""
+        """停止监听，已建立的连接随事件循环一起关闭"""
         self.running = False
-        logging.info("Client reporter stopped")
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+    
+    def _run(self, sockets: Dict[int, socket.socket], ready: threading.Event):
+        """运行事件循环（阻塞）"""
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._start_servers(sockets))
+            ready.set()
+            self._loop.run_forever()
+        finally:
+            ready.set()
+            for server in self._servers:
+                server.close()
+            self._servers = []
+            # 取消进行中的连接，让它们关闭两端的socket
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+    
+    async def _start_servers(self, sockets: Dict[int, socket.socket]):
+        """为所有端口启动服务"""
+        for port, sock in sockets.items():
+            handler = lambda reader, writer, port=port: self._handle_connection(reader, writer, port)
+            server = await asyncio.start_server(handler, sock=sock, backlog=self.backlog, limit=self.READ_SIZE)
+            self._servers.append(server)
+            host, target_port = self.target(port)
+            logging.info(f"Listening on [{self.host}]:{port} -> {host}:{target_port}")
     
-    def _initial_report(self):
-        """初始注册"""
-        ipv6 = get_public_ipv6(ClientConfig.IPV6_INTERFACE)
-        if not ipv6:
-            logging.error("Failed to get IPv6 address")
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, port: int):
+        """处理单个转发连接"""
+        peer = writer.get_extra_info('peername')
+        if self.active_connections >= self.max_connections:
+            logging.warning(f"Max connections reached, rejected {peer}")
+            writer.close()
             return
+        self.active_connections += 1
         
-        self.current_ipv6 = ipv6
-        logging.info(f"Detected IPv6 address: {ipv6}")
-        
-        # 注册所有端口
-        for port in ClientConfig.LISTEN_PORTS:
-            self._report_client(ipv6, port)
-    
-    def _report_client(self, ipv6: str, port: int) -> bool:
-        """上报客户端信息"""
         try:
-            data = {
-                'ipv6': ipv6,
-                'port': port
-            }
-            
-            response = requests.post(
-                f"{self.server_url}/api/report",
-                json=data,
-                headers=self.headers,
-                timeout=ClientConfig.CONNECT_TIMEOUT
-            )
+            host, target_port = self.target(port)
+            try:
+                target_reader, target_writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, target_port, limit=self.READ_SIZE), self.connect_timeout
+                )
+            except Exception as e:
+                logging.error(f"Failed to connect to local service {host}:{target_port}: {e!r}")
+                writer.close()
+                return
             
-            if response.status_code == 200:
-                logging.info(f"Successfully reported: port={port}, ipv6={ipv6}")
-                return True
-            else:
-                logging.error(f"Failed to report port {port}: {response.status_code} {response.text}")
-                return False
-                
+            logging.debug(f"Forwarding {peer} -> {host}:{target_port}")
+            await self._forward(reader, writer, target_reader, target_writer)
+        except asyncio.CancelledError:
+            # 停止时取消，正常结束任务（streams在任务被取消时会记录错误）
+            writer.close()
         except Exception as e:
-            logging.error(f"Error reporting port {port}: {e}")
-            return False
+            logging.error(f"Error handling connection from {peer}: {e}")
+            writer.close()
+        finally:
+            self.active_connections -= 1
     
-    def _send_heartbeat(self, port: int) -> bool:
-        """发送心跳"""
+    async def _forward(self, reader1: asyncio.StreamReader, writer1: asyncio.StreamWriter,
+                       reader2: asyncio.StreamReader, writer2: asyncio.StreamWriter):
+        """双向转发，两个方向都结束（或任一方向出错）后关闭两端"""
+        tasks = [
+            asyncio.ensure_future(self._pipe(reader1, writer2)),
+            asyncio.ensure_future(self._pipe(reader2, writer1))
+        ]
         try:
-            data = {'port': port}
-            response = requests.post(
-                f"{self.server_url}/api/heartbeat",
-                json=data,
-                headers=self.headers,
-                timeout=ClientConfig.CONNECT_TIMEOUT
-            )
-            
-            if response.status_code == 200:
-                logging.debug(f"Heartbeat sent for port {port}")
-                return True
-            else:
-                logging.warning(f"Heartbeat failed for port {port}: {response.status_code}")
-                return False
-                
+            await asyncio.gather(*tasks)
         except Exception as e:
-            logging.error(f"Error sending heartbeat for port {port}: {e}")
-            return False
-    
-    def _report_loop(self):
-        """定期上报循环"""
-        while self.running:
-            try:
-                # 检查IPv6地址是否变化
-                new_ipv6 = get_public_ipv6(ClientConfig.IPV6_INTERFACE)
-                if new_ipv6 and new_ipv6 != self.current_ipv6:
-                    logging.info(f"IPv6 address changed: {self.current_ipv6} -> {new_ipv6}")
-                    self.current_ipv6 = new_ipv6
-                    
-                    # 重新注册所有端口
-                    for port in ClientConfig.LISTEN_PORTS:
-                        self._report_client(new_ipv6, port)
-                
-                time.sleep(ClientConfig.REPORT_INTERVAL)
-                
-            except Exception as e:
-                logging.error(f"Error in report loop: {e}")
-                time.sleep(ClientConfig.REPORT_INTERVAL)
+            logging.debug(f"Forwarding ended: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer1.close()
+            writer2.close()
     
-    def _heartbeat_loop(self):
-        """心跳循环"""
-        while self.running:
-            try:
-                for port in ClientConfig.LISTEN_PORTS:
-                    self._send_heartbeat(port)
-                
-                time.sleep(ClientConfig.HEARTBEAT_INTERVAL)
-                
-            except Exception as e:
-                logging.error(f"Error in heartbeat loop: {e}")
-                time.sleep(ClientConfig.HEARTBEAT_INTERVAL)
\ No newline at end of file
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """单向转发，收到EOF时半关闭对端；drain保证对端慢时不会无限缓冲"""
+        while True:
+            data = await reader.read(self.READ_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof() and not writer.is_closing():
+            writer.write_eof()
\ No newline at end of file
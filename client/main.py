@@ -6,16 +6,25 @@ import time
 from .config import ClientConfig
 from .reporter import ClientReporter
 from .listener import PortListener
+from .tunnel import TunnelClient
 from .utils import get_public_ipv6, is_port_available
 from common.logger import setup_logger
 
 # 初始化日志
-setup_logger(ClientConfig.LOG_LEVEL, ClientConfig.LOG_FILE)
+setup_logger(
+    ClientConfig.LOG_LEVEL,
+    ClientConfig.LOG_FILE,
+    ClientConfig.LOG_MODE,
+    ClientConfig.LOG_FORMAT,
+    ClientConfig.LOG_CONNECTION_SAMPLE_RATE,
+    ClientConfig.LOG_QUEUE_SIZE
+)
 
 class LambdaLinkClient:
     def __init__(self):
         self.reporter = ClientReporter()
         self.listener = PortListener()
+        self.tunnel = TunnelClient(self.listener.target) if ClientConfig.TUNNEL_ENABLED else None
         self.running = False
     
     def start(self):
@@ -30,12 +39,14 @@ class LambdaLinkClient:
         
         # 检查端口可用性
         for port in ClientConfig.LISTEN_PORTS:
-            if not is_port_available(port):
+            if not is_port_available(port, ClientConfig.LISTEN_HOST):
                 logging.error(f"Port {port} is not available")
                 return False
         
         logging.info(f"Client IPv6: {ipv6}")
         logging.info(f"Listen ports: {ClientConfig.LISTEN_PORTS}")
+        if ClientConfig.UDP_PORTS:
+            logging.info(f"UDP ports: {ClientConfig.UDP_PORTS}")
         logging.info(f"Server: {ClientConfig.SERVER_HOST}:{ClientConfig.SERVER_PORT}")
         
         # 启动组件
@@ -48,6 +59,11 @@ class LambdaLinkClient:
             # 启动上报服务
             self.reporter.start()
             
+            # 启动隧道（使用上报时检测到的地址，地址变化时重建）
+            if self.tunnel:
+                self.tunnel.start(self.reporter.current_ipv6 or ipv6, ClientConfig.LISTEN_PORTS)
+                self.reporter.on_address_change = self.tunnel.update
+            
             logging.info("Client started successfully")
             return True
             
@@ -63,6 +79,8 @@ class LambdaLinkClient:
             self.running = False
             
             self.reporter.stop()
+            if self.tunnel:
+                self.tunnel.stop()
             self.listener.stop()
             
             logging.info("Client stopped")
@@ -2,11 +2,16 @@ import requests
 import time
 import threading
 import logging
-from typing import Optional
+from typing import Callable, Optional, List
 from .config import ClientConfig
-from .utils import get_public_ipv6
+from .utils import get_public_ipv6, IPv6AddressWatcher
+from .control import ControlChannel
+from common.protocol import PROTOCOL_TCP, PROTOCOL_UDP
 
 class ClientReporter:
+    # 收到地址变更通知后等待的时间，合并一次前缀更换产生的多条通知（新地址、DAD完成、旧地址弃用）
+    ADDRESS_SETTLE_DELAY = 0.5
+    
     def __init__(self):
         self.server_url = f"http://{ClientConfig.SERVER_HOST}:{ClientConfig.SERVER_PORT}"
         self.headers = {
@@ -15,6 +20,15 @@ class ClientReporter:
         }
         self.current_ipv6: Optional[str] = None
         self.running = False
+        # 服务端不支持批量接口时回退到逐端口请求
+        self.batch_supported = True
+        # 控制通道连接时通过它注册和心跳，否则使用HTTP
+        self.control: Optional[ControlChannel] = ControlChannel() if ClientConfig.CONTROL_ENABLED else None
+        # 地址变更通知(netlink)到达时立即重新检查地址，定期轮询作为后备
+        self._address_changed = threading.Event()
+        self.watcher = IPv6AddressWatcher(self._address_changed.set)
+        # 地址变化后调用（例如重建隧道）
+        self.on_address_change: Optional[Callable[[str], None]] = None
         
     def start(self):
         """启动上报服务"""
@@ -23,7 +37,8 @@ class ClientReporter:
         # 启动初始注册
         self._initial_report()
         
-        # 启动定期上报线程
+        # 启动地址变更监听和定期上报线程
+        self.watcher.start()
         report_thread = threading.Thread(target=self._report_loop, daemon=True)
         report_thread.start()
         
@@ -36,6 +51,10 @@ class ClientReporter:
     def stop(self):
         """停止上报服务"""
         self.running = False
+        self.watcher.stop()
+        self._address_changed.set()
+        if self.control:
+            self.control.stop()
         logging.info("Client reporter stopped")
     
     def _initial_report(self):
@@ -49,16 +68,58 @@ class ClientReporter:
         logging.info(f"Detected IPv6 address: {ipv6}")
         
         # 注册所有端口
-        for port in ClientConfig.LISTEN_PORTS:
-            self._report_client(ipv6, port)
+        self._report_ports(ipv6, ClientConfig.LISTEN_PORTS)
+        
+        if ClientConfig.UDP_PORTS:
+            self._report_ports(ipv6, ClientConfig.UDP_PORTS, protocol=PROTOCOL_UDP)
+        
+        if self.control:
+            self.control.start(ipv6, ClientConfig.LISTEN_PORTS)
+    
+    def _report_ports(self, ipv6: str, ports: List[int], previous_ipv6: Optional[str] = None,
+                      protocol: str = PROTOCOL_TCP) -> bool:
+        """批量上报所有端口，previous_ipv6为变化前的地址，服务端会移除旧地址的后端"""
+        if self.batch_supported:
+            try:
+                data = {'ipv6': ipv6, 'ports': ports, 'weight': ClientConfig.WEIGHT}
+                if previous_ipv6:
+                    data['previous_ipv6'] = previous_ipv6
+                if protocol != PROTOCOL_TCP:
+                    data['protocol'] = protocol
+                response = requests.post(
+                    f"{self.server_url}/api/report/batch",
+                    json=data,
+                    headers=self.headers,
+                    timeout=ClientConfig.CONNECT_TIMEOUT
+                )
+                
+                if response.status_code == 200:
+                    logging.info(f"Successfully reported: ports={ports}, ipv6={ipv6}")
+                    return True
+                elif response.status_code == 404:
+                    logging.info("Server does not support batch API, falling back to per-port requests")
+                    self.batch_supported = False
+                else:
+                    logging.error(f"Failed to report ports {ports}: {response.status_code} {response.text}")
+                    return False
+                    
+            except Exception as e:
+                logging.error(f"Error reporting ports {ports}: {e}")
+                return False
+        
+        results = [self._report_client(ipv6, port, protocol) for port in ports]
+        return all(results)
     
-    def _report_client(self, ipv6: str, port: int) -> bool:
+    def _report_client(self, ipv6: str, port: int, protocol: str = PROTOCOL_TCP) -> bool:
         """上报客户端信息"""
         try:
             data = {
                 'ipv6': ipv6,
-                'port': port
+                'port': port,
+                'weight': ClientConfig.WEIGHT
             }
+            if protocol != PROTOCOL_TCP:
+                data['protocol'] = protocol
             
             response = requests.post(
                 f"{self.server_url}/api/report",
@@ -78,10 +139,12 @@ class ClientReporter:
             logging.error(f"Error reporting port {port}: {e}")
             return False
     
-    def _send_heartbeat(self, port: int) -> bool:
+    def _send_heartbeat(self, port: int, protocol: str = PROTOCOL_TCP) -> bool:
         """发送心跳"""
         try:
-            data = {'port': port}
+            data = {'port': port, 'ipv6': self.current_ipv6}
+            if protocol != PROTOCOL_TCP:
+                data['protocol'] = protocol
             response = requests.post(
                 f"{self.server_url}/api/heartbeat",
                 json=data,
@@ -100,32 +163,83 @@ class ClientReporter:
             logging.error(f"Error sending heartbeat for port {port}: {e}")
             return False
     
+    def _send_heartbeats(self, ports: List[int], protocol: str = PROTOCOL_TCP) -> bool:
+        """批量发送心跳，服务端已丢失的端口重新上报"""
+        if self.batch_supported:
+            try:
+                data = {'ports': ports, 'ipv6': self.current_ipv6}
+                if protocol != PROTOCOL_TCP:
+                    data['protocol'] = protocol
+                response = requests.post(
+                    f"{self.server_url}/api/heartbeat/batch",
+                    json=data,
+                    headers=self.headers,
+                    timeout=ClientConfig.CONNECT_TIMEOUT
+                )
+                
+                if response.status_code == 200:
+                    missing = response.json().get('missing', [])
+                    logging.debug(f"Heartbeat sent for ports {ports}")
+                    if missing and self.current_ipv6:
+                        logging.warning(f"Server lost registration for ports {missing}, re-reporting")
+                        self._report_ports(self.current_ipv6, missing, protocol=protocol)
+                    return True
+                elif response.status_code == 404:
+                    logging.info("Server does not support batch API, falling back to per-port requests")
+                    self.batch_supported = False
+                else:
+                    logging.warning(f"Heartbeat failed for ports {ports}: {response.status_code}")
+                    return False
+                    
+            except Exception as e:
+                logging.error(f"Error sending heartbeat for ports {ports}: {e}")
+                return False
+        
+        results = [self._send_heartbeat(port, protocol) for port in ports]
+        return all(results)
+    
     def _report_loop(self):
-        """定期上报循环"""
+        """地址检查循环：收到地址变更通知时立即检查，否则每REPORT_INTERVAL检查一次"""
         while self.running:
             try:
-                # 检查IPv6地址是否变化
-                new_ipv6 = get_public_ipv6(ClientConfig.IPV6_INTERFACE)
-                if new_ipv6 and new_ipv6 != self.current_ipv6:
-                    logging.info(f"IPv6 address changed: {self.current_ipv6} -> {new_ipv6}")
-                    self.current_ipv6 = new_ipv6
-                    
-                    # 重新注册所有端口
-                    for port in ClientConfig.LISTEN_PORTS:
-                        self._report_client(new_ipv6, port)
-                
-                time.sleep(ClientConfig.REPORT_INTERVAL)
-                
+                self._check_address()
             except Exception as e:
                 logging.error(f"Error in report loop: {e}")
-                time.sleep(ClientConfig.REPORT_INTERVAL)
+            
+            if self._address_changed.wait(ClientConfig.REPORT_INTERVAL):
+                time.sleep(self.ADDRESS_SETTLE_DELAY)
+                self._address_changed.clear()
+    
+    def _check_address(self):
+        """检查IPv6地址是否变化，变化时重新注册所有端口"""
+        new_ipv6 = get_public_ipv6(ClientConfig.IPV6_INTERFACE, self.current_ipv6)
+        if not new_ipv6 or new_ipv6 == self.current_ipv6:
+            return
+        logging.info(f"IPv6 address changed: {self.current_ipv6} -> {new_ipv6}")
+        previous_ipv6 = self.current_ipv6
+        self.current_ipv6 = new_ipv6
+        
+        registered = False
+        if self.control:
+            # 同时更新控制通道重连时使用的地址
+            registered = self.control.register(new_ipv6, ClientConfig.LISTEN_PORTS)
+        if not registered:
+            self._report_ports(new_ipv6, ClientConfig.LISTEN_PORTS, previous_ipv6)
+        if ClientConfig.UDP_PORTS:
+            self._report_ports(new_ipv6, ClientConfig.UDP_PORTS, previous_ipv6, PROTOCOL_UDP)
+        if self.on_address_change:
+            self.on_address_change(new_ipv6)
     
     def _heartbeat_loop(self):
         """心跳循环"""
         while self.running:
             try:
-                for port in ClientConfig.LISTEN_PORTS:
-                    self._send_heartbeat(port)
+                # 控制通道在线时由其负责心跳
+                if not (self.control and self.control.connected):
+                    self._send_heartbeats(ClientConfig.LISTEN_PORTS)
+                # 控制通道只注册TCP端口，UDP端口始终通过HTTP心跳
+                if ClientConfig.UDP_PORTS:
+                    self._send_heartbeats(ClientConfig.UDP_PORTS, PROTOCOL_UDP)
                 
                 time.sleep(ClientConfig.HEARTBEAT_INTERVAL)
                 
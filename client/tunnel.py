@@ -0,0 +1,120 @@
+import json
+import socket
+import threading
+import logging
+import time
+from typing import Callable, List, Optional, Tuple
+from common.mux import MuxSession
+from common.protocol import TunnelFrameType, encode_tunnel_frame, read_tunnel_frame
+from .config import ClientConfig
+
+class TunnelClient:
+    """到服务端的多路复用隧道，服务端通过隧道中的流把访问者连接转发到本地服务
+    
+    每条隧道断开后按退避自动重连；服务端按IPv6地址查找隧道，地址变化时需调用update。
+    """
+    
+    def __init__(self, target: Callable[[int], Tuple[str, int]],
+                 connections: int = ClientConfig.TUNNEL_CONNECTIONS,
+                 connect_timeout: float = ClientConfig.CONNECT_TIMEOUT,
+                 server_host: str = ClientConfig.SERVER_HOST,
+                 server_port: int = ClientConfig.TUNNEL_PORT,
+                 api_key: str = ClientConfig.API_KEY):
+        # target(port) -> 本地服务地址
+        self.target = target
+        self.server_host = server_host
+        self.server_port = server_port
+        self.api_key = api_key
+        self.connections = max(connections, 1)
+        self.connect_timeout = connect_timeout
+        self.running = False
+        self._ipv6: Optional[str] = None
+        self._ports: List[int] = []
+        self._sessions: List[Optional[MuxSession]] = [None] * self.connections
+    
+    @property
+    def connected(self) -> int:
+        """已建立的隧道数"""
+        return sum(1 for session in self._sessions if session and not session.closed)
+    
+    def start(self, ipv6: str, ports: List[int]):
+        """启动隧道"""
+        self._ipv6 = ipv6
+        self._ports = list(ports)
+        self.running = True
+        for index in range(self.connections):
+            thread = threading.Thread(target=self._connect_loop, args=(index,), daemon=True)
+            thread.start()
+    
+    def update(self, ipv6: str):
+        """IPv6地址变化，以新地址重建所有隧道"""
+        self._ipv6 = ipv6
+        self._close_sessions()
+    
+    def stop(self):
+        """关闭所有隧道"""
+        self.running = False
+        self._close_sessions()
+    
+    def _close_sessions(self):
+        for session in self._sessions:
+            if session:
+                session.close()
+    
+    def _connect_loop(self, index: int):
+        """建立隧道并等待它断开，断开后按退避重连"""
+        backoff = 1
+        while self.running:
+            closed = threading.Event()
+            try:
+                session = self._connect(index, closed)
+                self._sessions[index] = session
+                session.start()
+                backoff = 1
+                logging.info(f"Tunnel {index} connected: {self.server_host}:{self.server_port}")
+                if not self.running:
+                    session.close()
+                closed.wait()
+                self._sessions[index] = None
+            except Exception as e:
+                logging.warning(f"Tunnel {index} error: {e}")
+            
+            if self.running:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+    
+    def _connect(self, index: int, closed: threading.Event) -> MuxSession:
+        """连接服务端并完成HELLO握手"""
+        sock = socket.create_connection((self.server_host, self.server_port), timeout=self.connect_timeout)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # open_ack: 连接本地服务后回复OPEN_ACK，服务端据此判断连接结果并切换客户端
+            hello = {'api_key': self.api_key, 'ipv6': self._ipv6, 'ports': self._ports, 'open_ack': True}
+            sock.sendall(encode_tunnel_frame(TunnelFrameType.HELLO, 0, json.dumps(hello).encode('utf-8')))
+            frame = read_tunnel_frame(sock)
+            if frame is None or frame[0] != TunnelFrameType.HELLO_ACK:
+                error = json.loads(frame[2].decode('utf-8')).get('message') if frame else 'connection closed'
+                raise ConnectionError(f"Tunnel rejected: {error}")
+        except Exception:
+            sock.close()
+            raise
+        return MuxSession(sock, on_open=self._on_open, on_close=lambda session: closed.set(), name=str(index))
+    
+    def _on_open(self, session: MuxSession, stream_id: int, port: int):
+        """服务端打开流：在单独的线程中连接本地服务，不阻塞隧道"""
+        if port not in self._ports:
+            session.reset(stream_id)
+            return
+        thread = threading.Thread(target=self._connect_local, args=(session, stream_id, port), daemon=True)
+        thread.start()
+    
+    def _connect_local(self, session: MuxSession, stream_id: int, port: int):
+        host, target_port = self.target(port)
+        try:
+            sock = socket.create_connection((host, target_port), timeout=self.connect_timeout)
+        except Exception as e:
+            logging.error(f"Failed to connect to local service {host}:{target_port}: {e}")
+            session.reset(stream_id)
+            return
+        sock.settimeout(None)
+        session.attach(stream_id, sock)
\ No newline at end of file
@@ -1,47 +1,241 @@
+import errno
 import socket
+import struct
+import threading
+import ipaddress
 import netifaces
 import subprocess
 import logging
-from typing import Optional, List
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, List, Tuple
 
-def get_ipv6_addresses() -> List[str]:
-    """获取所有IPv6地址"""
+# rtnetlink常量（linux/rtnetlink.h、linux/if_addr.h）
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+RTMGRP_IPV6_IFADDR = 0x100
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_CACHEINFO = 6
+IFA_FLAGS = 8
+IFA_F_TEMPORARY = 0x01
+IFA_F_DADFAILED = 0x08
+IFA_F_DEPRECATED = 0x20
+IFA_F_TENTATIVE = 0x40
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_RTATTR = struct.Struct('=HH')
+
+@dataclass
+class IPv6Address:
+    address: str
+    interface: str
+    flags: int = 0
+    # 首选生存期(秒)，0xffffffff表示永久；为0时地址已弃用
+    preferred_lifetime: int = 0xffffffff
+    
+    @property
+    def usable(self) -> bool:
+        """排除链路本地、回环和尚未完成/未通过重复地址检测的地址"""
+        ip = ipaddress.IPv6Address(self.address)
+        return not (ip.is_link_local or ip.is_loopback or self.flags & (IFA_F_TENTATIVE | IFA_F_DADFAILED))
+    
+    @property
+    def deprecated(self) -> bool:
+        return bool(self.flags & IFA_F_DEPRECATED) or self.preferred_lifetime == 0
+    
+    @property
+    def temporary(self) -> bool:
+        """隐私扩展生成的临时地址，会定期更换"""
+        return bool(self.flags & IFA_F_TEMPORARY)
+
+def _parse_addr_message(data: bytes, offset: int, length: int) -> Optional[IPv6Address]:
+    """解析一条RTM_NEWADDR/RTM_DELADDR消息中的IPv6地址"""
+    family, _, flags, _, index = _IFADDRMSG.unpack_from(data, offset + _NLMSGHDR.size)
+    if family != socket.AF_INET6:
+        return None
+    address = None
+    preferred = 0xffffffff
+    pos = offset + _NLMSGHDR.size + _IFADDRMSG.size
+    end = offset + length
+    while pos + _RTATTR.size <= end:
+        attr_len, attr_type = _RTATTR.unpack_from(data, pos)
+        if attr_len < _RTATTR.size:
+            break
+        value = data[pos + _RTATTR.size:pos + attr_len]
+        if attr_type in (IFA_ADDRESS, IFA_LOCAL) and len(value) == 16:
+            address = socket.inet_ntop(socket.AF_INET6, value)
+        elif attr_type == IFA_FLAGS and len(value) >= 4:
+            # 32位标志，ifaddrmsg中的8位标志放不下的部分
+            flags = struct.unpack_from('=I', value)[0]
+        elif attr_type == IFA_CACHEINFO and len(value) >= 8:
+            preferred = struct.unpack_from('=I', value)[0]
+        pos += (attr_len + 3) & ~3
+    if address is None:
+        return None
+    try:
+        interface = socket.if_indextoname(index)
+    except OSError:
+        interface = str(index)
+    return IPv6Address(address, interface, flags, preferred)
+
+def _netlink_ipv6_addresses() -> List[IPv6Address]:
+    """通过rtnetlink获取所有IPv6地址及其标志（仅Linux）"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        request = _NLMSGHDR.pack(_NLMSGHDR.size + _IFADDRMSG.size, RTM_GETADDR,
+                                 NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + _IFADDRMSG.pack(socket.AF_INET6, 0, 0, 0, 0)
+        sock.send(request)
+        addresses = []
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if length < _NLMSGHDR.size or msg_type == NLMSG_DONE:
+                    return addresses
+                if msg_type == NLMSG_ERROR:
+                    raise OSError('netlink address dump failed')
+                if msg_type == RTM_NEWADDR:
+                    record = _parse_addr_message(data, offset, length)
+                    if record:
+                        addresses.append(record)
+                offset += (length + 3) & ~3
+    finally:
+        sock.close()
+
+def _netifaces_ipv6_addresses() -> List[IPv6Address]:
+    """通过netifaces获取IPv6地址（没有地址标志）"""
     addresses = []
+    for interface in netifaces.interfaces():
+        for addr in netifaces.ifaddresses(interface).get(netifaces.AF_INET6, []):
+            addresses.append(IPv6Address(addr['addr'].split('%')[0], interface))  # 移除接口后缀
+    return addresses
+
+def list_ipv6_addresses() -> List[IPv6Address]:
+    """获取所有可用的IPv6地址，优先使用netlink（带弃用/临时地址标志）"""
     try:
-        for interface in netifaces.interfaces():
-            addrs = netifaces.ifaddresses(interface).get(netifaces.AF_INET6, [])
-            for addr in addrs:
-                ip = addr['addr'].split('%')[0]  # 移除接口后缀
-                if not ip.startswith('fe80') and not ip.startswith('::1'):
-                    addresses.append(ip)
+        addresses = _netlink_ipv6_addresses()
     except Exception as e:
-        logging.error(f"Failed to get IPv6 addresses: {e}")
-    return addresses
+        logging.debug(f"Netlink unavailable, using netifaces: {e}")
+        try:
+            addresses = _netifaces_ipv6_addresses()
+        except Exception as e:
+            logging.error(f"Failed to get IPv6 addresses: {e}")
+            return []
+    return [record for record in addresses if record.usable]
 
-def get_public_ipv6(interface: Optional[str] = None) -> Optional[str]:
+def get_ipv6_addresses() -> List[str]:
+    """获取所有IPv6地址"""
+    return [record.address for record in list_ipv6_addresses()]
+
+def select_ipv6(addresses: List[IPv6Address], interface: Optional[str] = None,
+                current: Optional[str] = None) -> Optional[str]:
+    """按固定规则选择地址：指定接口 > 未弃用 > 非临时 > 全局(非ULA) > 当前地址 > 地址排序
+    
+    同等条件下保持当前地址，避免在多个等价地址之间来回切换。
+    """
+    if not addresses:
+        return None
+    
+    def rank(record: IPv6Address):
+        return (
+            bool(interface) and record.interface != interface,
+            record.deprecated,
+            record.temporary,
+            ipaddress.IPv6Address(record.address).is_private,
+            record.address != current,
+            ipaddress.IPv6Address(record.address)
+        )
+    
+    return min(addresses, key=rank).address
+
+def get_public_ipv6(interface: Optional[str] = None, current: Optional[str] = None) -> Optional[str]:
     """获取公网IPv6地址"""
     try:
-        addresses = get_ipv6_addresses()
-        if not addresses:
-            return None
-        
-        # 如果指定了接口，尝试获取该接口的地址
-        if interface:
-            try:
-                addrs = netifaces.ifaddresses(interface).get(netifaces.AF_INET6, [])
-                for addr in addrs:
-                    ip = addr['addr'].split('%')[0]
-                    if not ip.startswith('fe80') and not ip.startswith('::1'):
-                        return ip
-            except:
-                pass
-        
-        # 返回第一个可用的IPv6地址
-        return addresses[0]
+        return select_ipv6(list_ipv6_addresses(), interface, current)
     except Exception as e:
         logging.error(f"Failed to get public IPv6: {e}")
         return None
 
+class IPv6AddressWatcher:
+    """订阅rtnetlink的IPv6地址变更(RTM_NEWADDR/RTM_DELADDR)，地址增删或状态变化时调用回调
+    
+    非Linux或无法创建netlink socket时start()返回False，由调用方继续轮询。
+    """
+    
+    def __init__(self, callback: Callable[[], None]):
+        self.callback = callback
+        self.running = False
+        self._sock: Optional[socket.socket] = None
+    
+    def start(self) -> bool:
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_IPV6_IFADDR))
+            # 定期醒来检查是否已停止
+            sock.settimeout(1)
+        except (AttributeError, OSError) as e:
+            logging.warning(f"IPv6 address watcher unavailable, falling back to polling: {e}")
+            return False
+        self._sock = sock
+        self.running = True
+        thread = threading.Thread(target=self._watch_loop, args=(sock,), daemon=True)
+        thread.start()
+        return True
+    
+    def stop(self):
+        self.running = False
+        # 只关闭socket，监听线程中的recv随之抛出OSError退出
+        if self._sock:
+            self._sock.close()
+    
+    def _watch_loop(self, sock: socket.socket):
+        """读取地址变更通知"""
+        while self.running:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self.running or sock is not self._sock:
+                    return
+                if e.errno == errno.ENOBUFS:
+                    # 接收缓冲区溢出丢失了通知，按有变化处理
+                    logging.warning("IPv6 address watcher overrun, rechecking addresses")
+                    self._notify()
+                    continue
+                logging.error(f"IPv6 address watcher stopped, falling back to polling: {e}")
+                self.running = False
+                return
+            offset = 0
+            changed = False
+            while offset + _NLMSGHDR.size <= len(data):
+                length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if length < _NLMSGHDR.size:
+                    break
+                if msg_type in (RTM_NEWADDR, RTM_DELADDR):
+                    record = _parse_addr_message(data, offset, length)
+                    if record:
+                        logging.debug(f"IPv6 address {'added/updated' if msg_type == RTM_NEWADDR else 'removed'}: "
+                                      f"{record.address} on {record.interface}")
+                        changed = True
+                offset += (length + 3) & ~3
+            if changed:
+                self._notify()
+    
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception as e:
+            logging.error(f"IPv6 address watcher callback error: {e}")
+
 def test_ipv6_connectivity(ipv6: str, port: int = 80) -> bool:
     """测试IPv6连接性"""
     try:
@@ -53,13 +247,38 @@ def test_ipv6_connectivity(ipv6: str, port: int = 80) -> bool:
     except:
         return False
 
-def is_port_available(port: int) -> bool:
-    """检查端口是否可用"""
+def create_ipv6_listener(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """创建只接受IPv6的TCP监听socket，不占用同一端口的IPv4地址（本地服务可能正监听0.0.0.0）"""
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
     try:
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind(('::', port))
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except Exception:
         sock.close()
+        raise
+    return sock
+
+def parse_port_map(value: str) -> Dict[int, Tuple[str, int]]:
+    """解析端口映射 "9000=8080,9001=192.168.1.10:80,9002=[::1]:22"，目标省略地址时为127.0.0.1"""
+    port_map = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            port, target = item.split('=', 1)
+            host, _, target_port = target.rpartition(':')
+            port_map[int(port)] = (host.strip('[]') or '127.0.0.1', int(target_port))
+        except ValueError:
+            logging.error(f"Invalid port mapping: {item}")
+    return port_map
+
+def is_port_available(port: int, host: str = '::') -> bool:
+    """检查IPv6端口是否可用（与PortListener相同的绑定方式）"""
+    try:
+        create_ipv6_listener(host, port, 1).close()
         return True
-    except:
+    except OSError:
         return False
\ No newline at end of file
@@ -1,25 +1,102 @@
+import atexit
+import json
 import logging
 import logging.handlers
 import os
-from typing import Optional
+import queue
+import random
+import time
+from typing import List, Optional
 
-def setup_logger(level: str = 'INFO', log_file: Optional[str] = None):
-    """设置日志配置"""
+# 每个连接的日志（建立、拒绝、转发目标）使用该日志器，可单独采样
+CONNECTION_LOGGER = 'lambdalink.connection'
+
+# LogRecord的标准属性，其余属性(extra)作为结构化字段输出
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行JSON，extra传入的字段原样输出"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+    
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}'
+
+class SamplingFilter(logging.Filter):
+    """按比例保留INFO及以下的日志，WARNING及以上全部保留"""
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录放入有界队列后立即返回，格式化和写入由后台线程完成；队列满时丢弃"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 不在调用线程中格式化，由QueueListener的处理器格式化（同一进程内无需序列化参数）
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+def setup_logger(level: str = 'INFO', log_file: Optional[str] = None, mode: str = 'queue',
+                 log_format: str = 'text', connection_sample_rate: float = 1.0, queue_size: int = 10000):
+    """设置日志配置
+    
+    mode为queue时日志调用只把记录放入队列，由后台线程写控制台和文件（含轮转），
+    不会在代理线程中阻塞；sync为直接写入。
+    """
+    global _listener, _queue_handler
+    
     # 创建日志格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        if log_format != 'text':
+            logging.warning(f"Unknown log format: {log_format}, using text")
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
     
     # 设置日志级别
     log_level = getattr(logging, level.upper(), logging.INFO)
-    logging.getLogger().setLevel(log_level)
+    root = logging.getLogger()
+    root.setLevel(log_level)
+    
+    handlers: List[logging.Handler] = []
     
     # 控制台处理器
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    logging.getLogger().addHandler(console_handler)
+    handlers.append(console_handler)
     
     # 文件处理器
+    file_error = None
     if log_file:
         try:
             # 确保日志目录存在
@@ -31,9 +108,47 @@ def setup_logger(level: str = 'INFO', log_file: Optional[str] = None):
                 backupCount=5
             )
             file_handler.setFormatter(formatter)
-            logging.getLogger().addHandler(file_handler)
+            handlers.append(file_handler)
         except Exception as e:
-            logging.warning(f"Failed to setup file logging: {e}")
+            file_error = e
+    
+    # 每连接日志采样
+    if connection_sample_rate < 1:
+        logging.getLogger(CONNECTION_LOGGER).addFilter(SamplingFilter(max(connection_sample_rate, 0)))
+    
+    if mode == 'queue':
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        root.addHandler(_queue_handler)
+        # 退出时写完队列中剩余的日志
+        atexit.register(_stop_listener)
+        # fork出的子进程中没有写日志的线程，需要重新创建
+        os.register_at_fork(after_in_child=_restart_listener)
+    else:
+        if mode != 'sync':
+            logging.warning(f"Unknown log mode: {mode}, using sync")
+        for handler in handlers:
+            root.addHandler(handler)
+    
+    if file_error:
+        logging.warning(f"Failed to setup file logging: {file_error}")
+
+def dropped_records() -> int:
+    """队列已满而丢弃的日志数"""
+    return _queue_handler.dropped if _queue_handler else 0
+
+def _stop_listener():
+    if _listener and _listener._thread:
+        _listener.stop()
+
+def _restart_listener():
+    global _listener
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(_queue_handler.queue.maxsize)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
 
 def get_logger(name: str) -> logging.Logger:
     """获取指定名称的日志器"""
@@ -0,0 +1,435 @@
+import selectors
+import socket
+import struct
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Set
+from .protocol import (
+    TUNNEL_FRAME_HEADER, MAX_TUNNEL_FRAME_SIZE, TUNNEL_STREAM_WINDOW, TunnelFrameType, encode_tunnel_frame
+)
+
+_PORT = struct.Struct('!H')
+_WINDOW = struct.Struct('!I')
+
+class MuxStream:
+    """隧道中的一个流，数据在隧道和本地socket之间转发"""
+    
+    __slots__ = ('id', 'sock', 'send_window', 'pending', 'consumed',
+                 'read_closed', 'write_closed', 'eof_written', 'events', 'on_open')
+    
+    def __init__(self, stream_id: int, sock: Optional[socket.socket], window: int,
+                 on_open: Optional[Callable[[bool], None]] = None):
+        self.id = stream_id
+        self.sock = sock
+        # 本端打开的流等待对端确认时的回调 on_open(是否已连接)，调用后置为None
+        self.on_open = on_open
+        # 还能发往对端的字节数
+        self.send_window = window
+        # 已从隧道收到、尚未写入本地socket的数据，长度不超过窗口
+        self.pending = bytearray()
+        # 已写入本地socket、尚未通过WINDOW归还的字节数
+        self.consumed = 0
+        # 本地socket已读到EOF并发送了FIN
+        self.read_closed = False
+        # 已收到对端的FIN
+        self.write_closed = False
+        # 已对本地socket执行shutdown(SHUT_WR)
+        self.eof_written = False
+        # 当前在selector中注册的事件
+        self.events = 0
+
+class MuxSession:
+    """在一条TCP连接上多路复用多个流，由一个selectors线程处理隧道和所有流的socket
+    
+    - 每个流有独立的发送窗口，接收方把数据写入本地socket后才归还，慢的流不会阻塞其他流
+    - 隧道发送缓冲超过MAX_OUTBUF时暂停读取所有流
+    - 流的一个方向结束时发送FIN，对端只半关闭本地socket；两个方向都结束后关闭
+    - open_ack时对端连接本地socket成功后回复OPEN_ACK，失败时回复RST，打开流的一方据此判断连接结果
+    - open_stream/attach/reset/close可在任意线程调用
+    """
+    
+    READ_SIZE = 64 * 1024
+    # 隧道发送缓冲上限
+    MAX_OUTBUF = 1024 * 1024
+    # 空闲时发送PING的间隔，超过3倍间隔没有收到任何数据则认为隧道已断开
+    KEEPALIVE_INTERVAL = 15
+    
+    def __init__(self, sock: socket.socket,
+                 on_open: Optional[Callable[['MuxSession', int, int], None]] = None,
+                 on_close: Optional[Callable[['MuxSession'], None]] = None,
+                 window: int = TUNNEL_STREAM_WINDOW, name: str = '', open_ack: bool = False):
+        self.sock = sock
+        # 对端打开流时调用 on_open(session, stream_id, port)（在会话线程中，必须快速返回），
+        # 之后调用attach连接本地socket或reset拒绝
+        self.on_open = on_open
+        self.on_close = on_close
+        self.window = window
+        self.name = name
+        # 对端是否会确认本端打开的流；否则open_stream的回调在发出OPEN时即以True调用
+        self.open_ack = open_ack
+        self.closed = False
+        self._streams: Dict[int, MuxStream] = {}
+        self._next_id = 1
+        self._outbuf = bytearray()
+        self._inbuf = bytearray()
+        self._throttled = False
+        self._dirty: Set[MuxStream] = set()
+        self._last_recv = self._last_send = time.monotonic()
+        self._selector = selectors.DefaultSelector()
+        self._commands: List[tuple] = []
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+    
+    @property
+    def stream_count(self) -> int:
+        return len(self._streams)
+    
+    def start(self):
+        """启动会话线程"""
+        self.sock.setblocking(False)
+        if self.sock.family in (socket.AF_INET, socket.AF_INET6):
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._selector.register(self.sock, selectors.EVENT_READ, self)
+        thread = threading.Thread(target=self._run, name=f'mux-{self.name}', daemon=True)
+        thread.start()
+        return thread
+    
+    def open_stream(self, port: int, on_open: Optional[Callable[[bool], None]] = None) -> socket.socket:
+        """打开到对端端口的流，返回本端socket，隧道已关闭时抛出ConnectionError
+        
+        on_open(ok)在对端确认连接(True)或拒绝、流中止、隧道断开(False)时于会话线程中调用，必须快速返回
+        """
+        local, remote = socket.socketpair()
+        with self._lock:
+            if self.closed:
+                local.close()
+                remote.close()
+                raise ConnectionError('tunnel closed')
+            stream_id = self._next_id
+            self._next_id += 1
+            self._commands.append(('open', stream_id, port, local, on_open))
+        self._wake()
+        return remote
+    
+    def attach(self, stream_id: int, sock: socket.socket):
+        """对端打开的流已连接到本地socket"""
+        self._command(('attach', stream_id, sock))
+    
+    def reset(self, stream_id: int):
+        """中止流"""
+        self._command(('reset', stream_id))
+    
+    def close(self):
+        """关闭隧道和所有流"""
+        self._command(('close',))
+    
+    def _command(self, command: tuple):
+        with self._lock:
+            if self.closed:
+                if command[0] == 'attach':
+                    command[2].close()
+                return
+            self._commands.append(command)
+        self._wake()
+    
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass
+    
+    def _run(self):
+        """会话循环（阻塞）"""
+        try:
+            while not self.closed:
+                for key, mask in self._selector.select(self.KEEPALIVE_INTERVAL / 3):
+                    if key.data is None:
+                        self._apply_commands()
+                    elif key.data is self:
+                        if mask & selectors.EVENT_READ:
+                            self._read_tunnel()
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush_tunnel()
+                    else:
+                        stream = key.data
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush_stream(stream)
+                        if mask & selectors.EVENT_READ and stream.id in self._streams:
+                            self._read_stream(stream)
+                    if self.closed:
+                        break
+                self._keepalive()
+                self._flush_tunnel()
+                self._update_events()
+        except Exception as e:
+            logging.error(f"Tunnel {self.name} error: {e}")
+        finally:
+            self._shutdown()
+    
+    def _apply_commands(self):
+        """在会话线程中执行其他线程提交的操作"""
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self._lock:
+            commands, self._commands = self._commands, []
+        for command in commands:
+            action = command[0]
+            if action == 'open':
+                _, stream_id, port, sock, on_open = command
+                sock.setblocking(False)
+                stream = self._streams[stream_id] = MuxStream(stream_id, sock, self.window, on_open)
+                self._send_frame(TunnelFrameType.OPEN, stream_id, _PORT.pack(port))
+                if not self.open_ack:
+                    self._opened(stream, True)
+                self._dirty.add(stream)
+            elif action == 'attach':
+                _, stream_id, sock = command
+                stream = self._streams.get(stream_id)
+                if stream is None or stream.sock is not None:
+                    # 等待连接期间流已被对端中止
+                    sock.close()
+                    continue
+                sock.setblocking(False)
+                stream.sock = sock
+                self._send_frame(TunnelFrameType.OPEN_ACK, stream_id)
+                self._flush_stream(stream)
+                self._dirty.add(stream)
+            elif action == 'reset':
+                stream = self._streams.get(command[1])
+                if stream:
+                    self._close_stream(stream, send_rst=True)
+            elif action == 'close':
+                self.closed = True
+    
+    def _send_frame(self, frame_type: int, stream_id: int = 0, payload: bytes = b''):
+        """加入隧道发送缓冲，在本轮循环结束时统一发送"""
+        self._outbuf += encode_tunnel_frame(frame_type, stream_id, payload)
+    
+    def _flush_tunnel(self):
+        if not self._outbuf:
+            return
+        try:
+            sent = self.sock.send(self._outbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logging.info(f"Tunnel {self.name} closed: {e}")
+            self.closed = True
+            return
+        del self._outbuf[:sent]
+        self._last_send = time.monotonic()
+    
+    def _read_tunnel(self):
+        try:
+            data = self.sock.recv(256 * 1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logging.info(f"Tunnel {self.name} closed: {e}")
+            self.closed = True
+            return
+        if not data:
+            logging.info(f"Tunnel {self.name} closed by peer")
+            self.closed = True
+            return
+        self._last_recv = time.monotonic()
+        
+        buf = self._inbuf
+        buf += data
+        offset = 0
+        header_size = TUNNEL_FRAME_HEADER.size
+        while len(buf) - offset >= header_size:
+            frame_type, stream_id, length = TUNNEL_FRAME_HEADER.unpack_from(buf, offset)
+            if length > MAX_TUNNEL_FRAME_SIZE:
+                raise ValueError(f"Tunnel frame too large: {length}")
+            end = offset + header_size + length
+            if end > len(buf):
+                break
+            self._handle_frame(frame_type, stream_id, bytes(buf[offset + header_size:end]))
+            offset = end
+        del buf[:offset]
+    
+    def _handle_frame(self, frame_type: int, stream_id: int, payload: bytes):
+        """处理对端发来的一帧"""
+        if frame_type == TunnelFrameType.PING:
+            self._send_frame(TunnelFrameType.PONG)
+            return
+        if frame_type == TunnelFrameType.PONG:
+            return
+        if frame_type == TunnelFrameType.OPEN:
+            if stream_id in self._streams or not self.on_open:
+                self._send_frame(TunnelFrameType.RST, stream_id)
+                return
+            (port,) = _PORT.unpack(payload)
+            self._streams[stream_id] = MuxStream(stream_id, None, self.window)
+            self.on_open(self, stream_id, port)
+            return
+        
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            # 已关闭的流的迟到帧
+            return
+        if frame_type == TunnelFrameType.DATA:
+            if stream.write_closed:
+                return
+            stream.pending += payload
+            if len(stream.pending) > self.window:
+                logging.warning(f"Tunnel {self.name} stream {stream_id} exceeded its window")
+                self._close_stream(stream, send_rst=True)
+                return
+            if stream.sock is not None:
+                self._flush_stream(stream)
+        elif frame_type == TunnelFrameType.WINDOW:
+            (increment,) = _WINDOW.unpack(payload)
+            stream.send_window += increment
+        elif frame_type == TunnelFrameType.FIN:
+            stream.write_closed = True
+            if stream.sock is not None:
+                self._flush_stream(stream)
+        elif frame_type == TunnelFrameType.OPEN_ACK:
+            self._opened(stream, True)
+        elif frame_type == TunnelFrameType.RST:
+            self._close_stream(stream, send_rst=False)
+            return
+        self._dirty.add(stream)
+    
+    def _opened(self, stream: MuxStream, ok: bool):
+        """通知打开流的一方连接结果（只通知一次）"""
+        on_open, stream.on_open = stream.on_open, None
+        if on_open is None:
+            return
+        try:
+            on_open(ok)
+        except Exception as e:
+            logging.error(f"Tunnel {self.name} stream {stream.id} open callback error: {e}")
+    
+    def _read_stream(self, stream: MuxStream):
+        """从本地socket读取一块数据发往对端，每次就绪只读一次以保证各流公平"""
+        size = min(self.READ_SIZE, stream.send_window)
+        if size <= 0:
+            return
+        try:
+            data = stream.sock.recv(size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close_stream(stream, send_rst=True)
+            return
+        if data:
+            stream.send_window -= len(data)
+            self._send_frame(TunnelFrameType.DATA, stream.id, data)
+        else:
+            stream.read_closed = True
+            self._send_frame(TunnelFrameType.FIN, stream.id)
+            self._finish_if_done(stream)
+        self._dirty.add(stream)
+    
+    def _flush_stream(self, stream: MuxStream):
+        """把收到的数据写入本地socket，归还窗口；对端已FIN且数据写完时半关闭"""
+        if stream.pending:
+            try:
+                sent = stream.sock.send(stream.pending)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self._close_stream(stream, send_rst=True)
+                return
+            if sent:
+                del stream.pending[:sent]
+                stream.consumed += sent
+                if stream.consumed >= self.window // 2 or not stream.pending:
+                    self._send_frame(TunnelFrameType.WINDOW, stream.id, _WINDOW.pack(stream.consumed))
+                    stream.consumed = 0
+        if stream.write_closed and not stream.pending and not stream.eof_written:
+            stream.eof_written = True
+            try:
+                stream.sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            self._finish_if_done(stream)
+    
+    def _finish_if_done(self, stream: MuxStream):
+        if stream.read_closed and stream.eof_written:
+            self._close_stream(stream, send_rst=False)
+    
+    def _close_stream(self, stream: MuxStream, send_rst: bool):
+        if self._streams.pop(stream.id, None) is None:
+            return
+        self._opened(stream, False)
+        if send_rst:
+            self._send_frame(TunnelFrameType.RST, stream.id)
+        if stream.sock is not None:
+            if stream.events:
+                self._selector.unregister(stream.sock)
+            stream.sock.close()
+        stream.events = 0
+        self._dirty.discard(stream)
+    
+    def _update_events(self):
+        """按流的状态更新selector中注册的事件"""
+        throttled = len(self._outbuf) >= self.MAX_OUTBUF
+        if throttled != self._throttled:
+            self._throttled = throttled
+            self._dirty.update(self._streams.values())
+        self._selector.modify(
+            self.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if self._outbuf else 0), self
+        )
+        for stream in self._dirty:
+            if stream.sock is None or stream.id not in self._streams:
+                continue
+            events = 0
+            if not stream.read_closed and stream.send_window > 0 and not throttled:
+                events |= selectors.EVENT_READ
+            if stream.pending:
+                events |= selectors.EVENT_WRITE
+            if events == stream.events:
+                continue
+            if not stream.events:
+                self._selector.register(stream.sock, events, stream)
+            elif not events:
+                self._selector.unregister(stream.sock)
+            else:
+                self._selector.modify(stream.sock, events, stream)
+            stream.events = events
+        self._dirty.clear()
+    
+    def _keepalive(self):
+        now = time.monotonic()
+        if now - self._last_recv > self.KEEPALIVE_INTERVAL * 3:
+            logging.warning(f"Tunnel {self.name} timed out")
+            self.closed = True
+        elif now - self._last_send > self.KEEPALIVE_INTERVAL and not self._outbuf:
+            self._send_frame(TunnelFrameType.PING)
+    
+    def _shutdown(self):
+        """关闭所有流和隧道"""
+        with self._lock:
+            self.closed = True
+            commands, self._commands = self._commands, []
+        for command in commands:
+            if command[0] == 'open':
+                command[3].close()
+                if command[4]:
+                    command[4](False)
+            elif command[0] == 'attach':
+                command[2].close()
+        for stream in list(self._streams.values()):
+            self._close_stream(stream, send_rst=False)
+        self._selector.close()
+        for sock in (self.sock, self._wakeup_r, self._wakeup_w):
+            try:
+                sock.close()
+            except OSError:
+                pass
+        if self.on_close:
+            try:
+                self.on_close(self)
+            except Exception as e:
+                logging.error(f"Tunnel {self.name} close callback error: {e}")
\ No newline at end of file
@@ -1,35 +1,97 @@
-from typing import Dict, Any
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+from dataclasses import dataclass, field
 import json
+import socket
+import struct
+
+# 上报/心跳请求中的protocol字段，缺省为tcp
+PROTOCOL_TCP = 'tcp'
+PROTOCOL_UDP = 'udp'
 
 @dataclass
 class ReportRequest:
     ipv6: str
     port: int
+    weight: int = 1
+    protocol: str = PROTOCOL_TCP
     
     def to_dict(self) -> Dict[str, Any]:
         return {
             'ipv6': self.ipv6,
-            'port': self.port
+            'port': self.port,
+            'weight': self.weight,
+            'protocol': self.protocol
         }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'ReportRequest':
         return cls(
             ipv6=data['ipv6'],
-            port=data['port']
+            port=data['port'],
+            weight=data.get('weight', 1),
+            protocol=data.get('protocol', PROTOCOL_TCP)
         )
 
 @dataclass
 class HeartbeatRequest:
     port: int
+    ipv6: Optional[str] = None
+    protocol: str = PROTOCOL_TCP
     
     def to_dict(self) -> Dict[str, Any]:
-        return {'port': self.port}
+        result = {'port': self.port, 'protocol': self.protocol}
+        if self.ipv6:
+            result['ipv6'] = self.ipv6
+        return result
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'HeartbeatRequest':
-        return cls(port=data['port'])
+        return cls(port=data['port'], ipv6=data.get('ipv6'), protocol=data.get('protocol', PROTOCOL_TCP))
+
+@dataclass
+class BatchReportRequest:
+    ipv6: str
+    ports: List[int]
+    weight: int = 1
+    previous_ipv6: Optional[str] = None
+    protocol: str = PROTOCOL_TCP
+    
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            'ipv6': self.ipv6,
+            'ports': list(self.ports),
+            'weight': self.weight,
+            'protocol': self.protocol
+        }
+        if self.previous_ipv6:
+            result['previous_ipv6'] = self.previous_ipv6
+        return result
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'BatchReportRequest':
+        return cls(
+            ipv6=data['ipv6'],
+            ports=list(data['ports']),
+            weight=data.get('weight', 1),
+            previous_ipv6=data.get('previous_ipv6'),
+            protocol=data.get('protocol', PROTOCOL_TCP)
+        )
+
+@dataclass
+class BatchHeartbeatRequest:
+    ports: List[int]
+    ipv6: Optional[str] = None
+    protocol: str = PROTOCOL_TCP
+    
+    def to_dict(self) -> Dict[str, Any]:
+        result = {'ports': list(self.ports), 'protocol': self.protocol}
+        if self.ipv6:
+            result['ipv6'] = self.ipv6
+        return result
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'BatchHeartbeatRequest':
+        return cls(ports=list(data['ports']), ipv6=data.get('ipv6'), protocol=data.get('protocol', PROTOCOL_TCP))
 
 @dataclass
 class ApiResponse:
@@ -47,4 +109,100 @@ class ApiResponse:
             result['message'] = self.message
         if self.data:
             result['data'] = self.data
-        return result
\ No newline at end of file
+        return result
+
+# 控制通道：单条TCP连接上的长度前缀JSON帧（4字节大端长度 + UTF-8 JSON）
+CONTROL_FRAME_HEADER = struct.Struct('!I')
+MAX_CONTROL_FRAME_SIZE = 1024 * 1024
+
+class ControlMessageType:
+    REGISTER = 'register'      # 客户端 -> 服务端: api_key, ipv6, ports
+    HEARTBEAT = 'heartbeat'    # 客户端 -> 服务端
+    ACK = 'ack'                # 服务端 -> 客户端: 对register/heartbeat的确认
+    ERROR = 'error'            # 服务端 -> 客户端: message，随后关闭连接
+    REREGISTER = 'reregister'  # 服务端 -> 客户端: 要求重新注册
+    PING = 'ping'              # 双向
+    PONG = 'pong'              # 双向
+
+@dataclass
+class ControlMessage:
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'type': self.type,
+            'data': self.data
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ControlMessage':
+        return cls(
+            type=data['type'],
+            data=data.get('data') or {}
+        )
+    
+    def encode(self) -> bytes:
+        """编码为一个完整的帧"""
+        payload = json.dumps(self.to_dict()).encode('utf-8')
+        return CONTROL_FRAME_HEADER.pack(len(payload)) + payload
+
+def recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """读取指定长度的数据，对端关闭时返回None"""
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+def read_control_message(sock: socket.socket) -> Optional[ControlMessage]:
+    """从socket读取一个控制帧，对端关闭时返回None"""
+    header = recv_exact(sock, CONTROL_FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = CONTROL_FRAME_HEADER.unpack(header)
+    if length > MAX_CONTROL_FRAME_SIZE:
+        raise ValueError(f"Control frame too large: {length}")
+    payload = recv_exact(sock, length)
+    if payload is None:
+        return None
+    return ControlMessage.from_dict(json.loads(payload.decode('utf-8')))
+
+# 隧道：客户端主动建立到服务端的长连接，服务端在其中多路复用多个流访问客户端的服务
+# 帧格式: 1字节类型 + 4字节流ID + 4字节负载长度（大端） + 负载；流0用于握手
+TUNNEL_FRAME_HEADER = struct.Struct('!BII')
+MAX_TUNNEL_FRAME_SIZE = 1024 * 1024
+# 每个流的初始发送窗口(字节)，接收方把数据写入本地socket后通过WINDOW帧归还
+TUNNEL_STREAM_WINDOW = 256 * 1024
+
+class TunnelFrameType:
+    HELLO = 1      # 客户端 -> 服务端: JSON {api_key, ipv6, ports, open_ack}
+    HELLO_ACK = 2  # 服务端 -> 客户端: JSON {}
+    ERROR = 3      # 服务端 -> 客户端: JSON {message}，随后关闭连接
+    OPEN = 4       # 服务端 -> 客户端: 2字节目标端口，客户端连接本地服务
+    DATA = 5       # 双向: 流数据
+    WINDOW = 6     # 双向: 4字节窗口增量
+    FIN = 7        # 双向: 发送方向结束（半关闭）
+    RST = 8        # 双向: 中止流
+    PING = 9       # 双向
+    PONG = 10      # 双向
+    OPEN_ACK = 11  # 客户端 -> 服务端: 已连接到本地服务（HELLO中open_ack为true的客户端才发送）
+
+def encode_tunnel_frame(frame_type: int, stream_id: int = 0, payload: bytes = b'') -> bytes:
+    """编码一个隧道帧"""
+    return TUNNEL_FRAME_HEADER.pack(frame_type, stream_id, len(payload)) + payload
+
+def read_tunnel_frame(sock: socket.socket) -> Optional[Tuple[int, int, bytes]]:
+    """阻塞读取一个隧道帧(握手阶段使用)，返回 (类型, 流ID, 负载)，对端关闭时返回None"""
+    header = recv_exact(sock, TUNNEL_FRAME_HEADER.size)
+    if header is None:
+        return None
+    frame_type, stream_id, length = TUNNEL_FRAME_HEADER.unpack(header)
+    if length > MAX_TUNNEL_FRAME_SIZE:
+        raise ValueError(f"Tunnel frame too large: {length}")
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        return None
+    return frame_type, stream_id, payload
\ No newline at end of file
@@ -12,6 +12,7 @@ fi
 # 创建目录
 mkdir -p /opt/lambdalink/server
 mkdir -p /var/log/lambdalink
+mkdir -p /var/lib/lambdalink
 mkdir -p /etc/lambdalink
 
 # 复制文件
@@ -0,0 +1,117 @@
+import selectors
+import socket
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+class Acceptor:
+    """单线程通过selectors(Linux上为epoll)接受所有代理端口的连接
+    
+    每次就绪最多连续accept ACCEPT_BATCH个连接再轮到其他端口，突发时尽快清空accept队列。
+    add/remove可在任意线程调用，由接受线程在下一轮循环中生效。
+    """
+    
+    ACCEPT_BATCH = 64
+    
+    def __init__(self, handler: Callable[[socket.socket, Any, int], None], batch: int = ACCEPT_BATCH):
+        # handler(client_socket, client_addr, port)在接受线程中调用，必须快速返回
+        self.handler = handler
+        self.batch = batch
+        self._selector = selectors.DefaultSelector()
+        self._sockets: Dict[int, socket.socket] = {}
+        self._pending: List[Tuple[str, int, Any]] = []
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+    
+    @property
+    def ports(self) -> List[int]:
+        """当前监听的端口"""
+        with self._lock:
+            return list(self._sockets)
+    
+    def add(self, port: int, sock: socket.socket):
+        """加入一个监听socket"""
+        sock.setblocking(False)
+        with self._lock:
+            self._sockets[port] = sock
+            self._pending.append(('add', port, sock))
+        self._wake()
+    
+    def remove(self, port: int) -> bool:
+        """停止接受该端口的连接并关闭监听socket"""
+        with self._lock:
+            sock = self._sockets.pop(port, None)
+            if sock is None:
+                return False
+            self._pending.append(('remove', port, sock))
+        self._wake()
+        return True
+    
+    def start(self):
+        """启动接受线程"""
+        thread = threading.Thread(target=self.run, name='lambdalink-acceptor', daemon=True)
+        thread.start()
+        return thread
+    
+    def run(self):
+        """接受循环（阻塞）"""
+        while True:
+            try:
+                events = self._selector.select()
+            except Exception as e:
+                logging.error(f"Acceptor select error: {e}")
+                continue
+            for key, _ in events:
+                if key.data is None:
+                    self._apply_pending()
+                else:
+                    self._accept_batch(key.fileobj, key.data)
+    
+    def _accept_batch(self, sock: socket.socket, port: int):
+        """连续accept直到队列为空或达到批量上限"""
+        for _ in range(self.batch):
+            try:
+                client_socket, client_addr = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # 例如文件描述符耗尽，留在队列中等下一轮
+                logging.error(f"Error accepting connection on port {port}: {e}")
+                return
+            client_socket.setblocking(True)
+            try:
+                self.handler(client_socket, client_addr, port)
+            except Exception as e:
+                logging.error(f"Error dispatching connection on port {port}: {e}")
+                client_socket.close()
+    
+    def _apply_pending(self):
+        """在接受线程中执行add/remove"""
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for action, port, sock in pending:
+            try:
+                if action == 'add':
+                    self._selector.register(sock, selectors.EVENT_READ, port)
+                    logging.info(f"Proxy server started on port {port}")
+                else:
+                    self._selector.unregister(sock)
+                    sock.close()
+                    logging.info(f"Proxy server stopped on port {port}")
+            except Exception as e:
+                logging.error(f"Failed to {action} listener for port {port}: {e}")
+    
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # 缓冲区已满说明已有未处理的唤醒
+            pass
\ No newline at end of file
@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+from .metrics import RESULT_ACCEPTED, RESULT_REJECTED, RESULT_RATE_LIMITED
+
+# 达到并发上限、进入等待队列
+ADMIT_QUEUED = 'queued'
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多积累burst个"""
+    
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+    
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+    
+    def refill(self, now: float) -> float:
+        """补充令牌，返回当前令牌数"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+class Waiter:
+    """等待队列中的一个连接"""
+    
+    __slots__ = ('port', 'notify', 'granted')
+    
+    def __init__(self, port: int, notify: Callable[[], None]):
+        self.port = port
+        # 获得名额时调用（不持有锁）
+        self.notify = notify
+        self.granted = False
+
+class AdmissionController:
+    """新连接的准入控制
+    
+    - 速率：每个代理端口、每个来源IP各一个令牌桶，超出速率的连接直接拒绝
+    - 并发：总连接数和每端口连接数上限，达到上限时进入有界等待队列，
+      有连接结束时按到达顺序放行，队列已满或等待超时才关闭连接
+    """
+    
+    # 来源IP令牌桶超过该数量时清理已回满（长时间没有新连接）的桶
+    MAX_SOURCES = 65536
+    
+    def __init__(self, max_connections: int = 1000, max_per_port: int = 0,
+                 port_limits: Optional[Dict[int, int]] = None,
+                 queue_size: int = 0, queue_timeout: float = 5.0,
+                 port_rate: float = 0, port_burst: float = 0,
+                 source_rate: float = 0, source_burst: float = 0):
+        self.max_connections = max_connections
+        # 每端口并发上限，0表示不限制；port_limits按端口覆盖
+        self.max_per_port = max_per_port
+        self.port_limits = port_limits or {}
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        # 速率为每秒新连接数，0表示不限制；突发量默认等于速率
+        self.port_rate = port_rate
+        self.port_burst = max(port_burst or port_rate, 1)
+        self.source_rate = source_rate
+        self.source_burst = max(source_burst or source_rate, 1)
+        self.active = 0
+        self._port_active: Dict[int, int] = {}
+        self._queue: Deque[Waiter] = deque()
+        self._port_buckets: Dict[int, TokenBucket] = {}
+        self._source_buckets: Dict[str, TokenBucket] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+    
+    def port_limit(self, port: int) -> int:
+        """端口的并发上限，0表示不限制"""
+        return self.port_limits.get(port, self.max_per_port)
+    
+    def admit(self, port: int, source: str,
+              notify: Optional[Callable[[], None]] = None) -> Tuple[str, Optional[Waiter]]:
+        """检查新连接
+        
+        返回 (RESULT_ACCEPTED, None) 已占用名额；(ADMIT_QUEUED, waiter) 已排队，
+        获得名额时调用notify，之后必须调用finish_wait；其他为拒绝原因。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._take_token(port, source, now):
+                return RESULT_RATE_LIMITED, None
+            if self._has_capacity(port):
+                self._occupy(port)
+                return RESULT_ACCEPTED, None
+            if notify is None or len(self._queue) >= self.queue_size:
+                return RESULT_REJECTED, None
+            waiter = Waiter(port, notify)
+            self._queue.append(waiter)
+            return ADMIT_QUEUED, waiter
+    
+    def finish_wait(self, waiter: Waiter) -> bool:
+        """被唤醒或等待超时后调用，返回是否获得了名额；未获得时移出队列"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                pass
+            return False
+    
+    def release(self, port: int):
+        """连接结束，释放名额并放行排队的连接"""
+        with self._lock:
+            self.active -= 1
+            count = self._port_active.get(port, 0) - 1
+            if count > 0:
+                self._port_active[port] = count
+            else:
+                self._port_active.pop(port, None)
+            granted = self._grant() if self._queue else []
+        for waiter in granted:
+            waiter.notify()
+    
+    def _has_capacity(self, port: int) -> bool:
+        if self.active >= self.max_connections:
+            return False
+        limit = self.port_limit(port)
+        return not limit or self._port_active.get(port, 0) < limit
+    
+    def _occupy(self, port: int):
+        self.active += 1
+        self._port_active[port] = self._port_active.get(port, 0) + 1
+    
+    def _grant(self):
+        """按到达顺序放行有名额的等待者；端口已满的等待者保持原有顺序"""
+        granted = []
+        remaining: Deque[Waiter] = deque()
+        while self._queue and self.active < self.max_connections:
+            waiter = self._queue.popleft()
+            if self._has_capacity(waiter.port):
+                self._occupy(waiter.port)
+                waiter.granted = True
+                granted.append(waiter)
+            else:
+                remaining.append(waiter)
+        remaining.extend(self._queue)
+        self._queue = remaining
+        return granted
+    
+    def _take_token(self, port: int, source: str, now: float) -> bool:
+        """两个令牌桶都有令牌时才各消耗一个"""
+        port_bucket = source_bucket = None
+        if self.port_rate > 0:
+            port_bucket = self._port_buckets.get(port)
+            if port_bucket is None:
+                port_bucket = self._port_buckets[port] = TokenBucket(self.port_rate, self.port_burst, now)
+            if port_bucket.refill(now) < 1:
+                return False
+        if self.source_rate > 0:
+            source_bucket = self._source_buckets.get(source)
+            if source_bucket is None:
+                if len(self._source_buckets) >= self.MAX_SOURCES and now >= self._next_sweep:
+                    self._sweep_sources(now)
+                source_bucket = self._source_buckets[source] = TokenBucket(self.source_rate, self.source_burst, now)
+            if source_bucket.refill(now) < 1:
+                return False
+        if port_bucket:
+            port_bucket.tokens -= 1
+        if source_bucket:
+            source_bucket.tokens -= 1
+        return True
+    
+    def _sweep_sources(self, now: float):
+        """删除已回满的来源令牌桶，它们与新建的桶没有区别；最多每秒一次"""
+        self._next_sweep = now + 1
+        for source in [s for s, bucket in self._source_buckets.items() if bucket.refill(now) >= bucket.burst]:
+            del self._source_buckets[source]
\ No newline at end of file
@@ -0,0 +1,250 @@
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+from common.protocol import PROTOCOL_TCP, PROTOCOL_UDP
+from .registry import ClientRegistry
+from .listeners import ListenerManager
+from .utils import validate_ipv6
+
+# (状态码, 响应体)：dict以JSON返回，str以纯文本返回
+ApiResponse = Tuple[int, Any]
+
+def validate_weight(weight) -> bool:
+    """验证负载均衡权重"""
+    return isinstance(weight, int) and 1 <= weight <= 100
+
+class ControlAPI:
+    """控制面HTTP接口的处理逻辑，与HTTP框架无关，Flask应用和asyncio服务共用"""
+    
+    def __init__(self, registry: ClientRegistry, api_key: str,
+                 status: Optional[Callable[[], Dict[str, Any]]] = None,
+                 metrics: Optional[Callable[[], str]] = None,
+                 listeners: Optional[ListenerManager] = None,
+                 udp_registry: Optional[ClientRegistry] = None,
+                 connection_counts: Optional[Callable[[], Dict[Tuple[int, str], int]]] = None):
+        self.registry = registry
+        # UDP端口的注册表，为None时不接受protocol为udp的上报
+        self.udp_registry = udp_registry
+        self.api_key = api_key
+        # 代理端口的监听管理，为None时（多worker模式）不提供/api/ports
+        self.listeners = listeners
+        # 服务状态中除注册表以外的字段、Prometheus指标文本，由调用方提供
+        self.status_provider = status
+        self.metrics_provider = metrics
+        # 多worker模式下连接由worker进程的注册表副本计数，由调用方提供 (端口, 客户端地址) -> 连接数
+        self.connection_counts = connection_counts
+        # (方法, 路径) -> (处理函数, 是否需要API密钥)
+        self.routes: Dict[Tuple[str, str], Tuple[Callable[[Any], ApiResponse], bool]] = {
+            ('POST', '/api/report'): (self.report, True),
+            ('POST', '/api/report/batch'): (self.report_batch, True),
+            ('POST', '/api/heartbeat'): (self.heartbeat, True),
+            ('POST', '/api/heartbeat/batch'): (self.heartbeat_batch, True),
+            ('GET', '/api/clients'): (self.clients, True),
+            ('GET', '/api/status'): (self.status, False),
+            # 指标的client标签包含客户端IPv6地址，与/api/clients一样需要密钥；
+            # Prometheus抓取时在scrape配置中设置请求头 X-API-Key: <API_KEY>
+            ('GET', '/metrics'): (self.metrics, True)
+        }
+        if listeners:
+            self.routes.update({
+                ('GET', '/api/ports'): (self.list_ports, True),
+                ('POST', '/api/ports'): (self.add_port, True),
+                ('DELETE', '/api/ports'): (self.remove_port, True)
+            })
+    
+    def dispatch(self, method: str, path: str, api_key: Optional[str], body: bytes) -> ApiResponse:
+        """处理一个请求"""
+        route = self.routes.get((method, path))
+        if route is None:
+            if any(route_path == path for _, route_path in self.routes):
+                return 405, {'error': 'Method not allowed'}
+            return 404, {'error': 'Not found'}
+        handler, authenticated = route
+        if authenticated and api_key != self.api_key:
+            return 401, {'error': 'Invalid API key'}
+        data = None
+        if method in ('POST', 'DELETE'):
+            try:
+                data = json.loads(body) if body else None
+            except ValueError:
+                return 400, {'error': 'Invalid JSON'}
+        try:
+            return handler(data)
+        except Exception as e:
+            logging.error(f"API error on {path}: {e}")
+            return 500, {'error': 'Internal server error'}
+    
+    def report(self, data) -> ApiResponse:
+        """客户端上报接口"""
+        if not isinstance(data, dict) or not data:
+            return 400, {'error': 'Invalid JSON'}
+        
+        ipv6 = data.get('ipv6')
+        port = data.get('port')
+        weight = data.get('weight', 1)
+        
+        if not ipv6 or not port:
+            return 400, {'error': 'Missing ipv6 or port'}
+        
+        if not validate_ipv6(ipv6):
+            return 400, {'error': 'Invalid IPv6 address'}
+        
+        if not isinstance(port, int) or not 1 <= port <= 65535:
+            return 400, {'error': 'Invalid port number'}
+        
+        if not validate_weight(weight):
+            return 400, {'error': 'Invalid weight'}
+        
+        registry = self._registry_for(data)
+        if registry is None:
+            return 400, {'error': 'Unsupported protocol'}
+        
+        if registry is self.registry and self.listeners and not self.listeners.allows(port):
+            return 403, {'error': 'Port not allowed', 'ports': [port]}
+        
+        # 注册客户端（作为该端口的一个后端）
+        if registry.register_client(port, ipv6, weight):
+            return 200, {'status': 'registered', 'timestamp': time.time()}
+        return 500, {'error': 'Registration failed'}
+    
+    def report_batch(self, data) -> ApiResponse:
+        """客户端批量上报接口"""
+        if not isinstance(data, dict) or not data:
+            return 400, {'error': 'Invalid JSON'}
+        
+        ipv6 = data.get('ipv6')
+        ports = data.get('ports')
+        weight = data.get('weight', 1)
+        previous_ipv6 = data.get('previous_ipv6')
+        
+        if not ipv6 or not ports or not isinstance(ports, list):
+            return 400, {'error': 'Missing ipv6 or ports'}
+        
+        if not validate_ipv6(ipv6):
+            return 400, {'error': 'Invalid IPv6 address'}
+        
+        if not all(isinstance(port, int) and 1 <= port <= 65535 for port in ports):
+            return 400, {'error': 'Invalid port number'}
+        
+        if not validate_weight(weight):
+            return 400, {'error': 'Invalid weight'}
+        
+        registry = self._registry_for(data)
+        if registry is None:
+            return 400, {'error': 'Unsupported protocol'}
+        
+        if registry is self.registry and self.listeners:
+            rejected = [port for port in ports if not self.listeners.allows(port)]
+            if rejected:
+                return 403, {'error': 'Port not allowed', 'ports': rejected}
+        
+        # 地址变化时移除旧地址的后端，否则它会一直参与负载均衡直到过期
+        if previous_ipv6 and previous_ipv6 != ipv6:
+            registry.unregister_clients(ports, previous_ipv6)
+        
+        # 一次性注册所有端口
+        if registry.register_clients(ports, ipv6, weight):
+            return 200, {'status': 'registered', 'ports': ports, 'timestamp': time.time()}
+        return 500, {'error': 'Registration failed'}
+    
+    def heartbeat(self, data) -> ApiResponse:
+        """心跳接口"""
+        port = data.get('port') if isinstance(data, dict) else None
+        if not port:
+            return 400, {'error': 'Missing port'}
+        
+        registry = self._registry_for(data)
+        if registry is None:
+            return 400, {'error': 'Unsupported protocol'}
+        
+        # 未携带ipv6的旧客户端刷新该端口的所有后端
+        if registry.update_heartbeat(port, data.get('ipv6')):
+            return 200, {'status': 'ok', 'timestamp': time.time()}
+        return 404, {'error': 'Client not found'}
+    
+    def heartbeat_batch(self, data) -> ApiResponse:
+        """批量心跳接口，返回未注册的端口以便客户端重新上报"""
+        ports = data.get('ports') if isinstance(data, dict) else None
+        if not ports or not isinstance(ports, list):
+            return 400, {'error': 'Missing ports'}
+        
+        registry = self._registry_for(data)
+        if registry is None:
+            return 400, {'error': 'Unsupported protocol'}
+        
+        missing = registry.update_heartbeats(ports, data.get('ipv6'))
+        return 200, {'status': 'ok', 'missing': missing, 'timestamp': time.time()}
+    
+    def _registry_for(self, data: dict) -> Optional[ClientRegistry]:
+        """按protocol字段（缺省为tcp）选择注册表，不支持的协议返回None"""
+        protocol = data.get('protocol', PROTOCOL_TCP)
+        if protocol == PROTOCOL_TCP:
+            return self.registry
+        if protocol == PROTOCOL_UDP:
+            return self.udp_registry
+        return None
+    
+    def clients(self, _=None) -> ApiResponse:
+        """获取客户端列表"""
+        result = {}
+        counts = self.connection_counts() if self.connection_counts else None
+        for port, backends in self.registry.get_all_clients().items():
+            backend_list = [
+                {
+                    'ipv6': client.ipv6,
+                    'last_seen': client.last_seen,
+                    'connection_count': counts.get((port, client.ipv6), 0) if counts is not None
+                                        else client.connection_count,
+                    'weight': client.weight
+                }
+                for client in backends
+            ]
+            # 顶层字段保持单后端时的格式（取第一个后端），完整列表见backends
+            result[port] = {
+                'ipv6': backends[0].ipv6,
+                'port': port,
+                'last_seen': max(client.last_seen for client in backends),
+                'connection_count': sum(backend['connection_count'] for backend in backend_list),
+                'backends': backend_list
+            }
+        return 200, result
+    
+    def list_ports(self, _=None) -> ApiResponse:
+        """代理端口及其监听状态"""
+        return 200, {'mode': self.listeners.mode, 'ports': self.listeners.list()}
+    
+    def add_port(self, data) -> ApiResponse:
+        """添加代理端口并立即监听（不依赖客户端注册）"""
+        port = data.get('port') if isinstance(data, dict) else None
+        if not isinstance(port, int) or not 1 <= port <= 65535:
+            return 400, {'error': 'Invalid port number'}
+        if not self.listeners.add(port):
+            return 500, {'error': 'Failed to listen on port', 'port': port}
+        return 200, {'status': 'listening', 'port': port}
+    
+    def remove_port(self, data) -> ApiResponse:
+        """移除代理端口并停止监听，已建立的连接不受影响"""
+        port = data.get('port') if isinstance(data, dict) else None
+        if not isinstance(port, int) or not 1 <= port <= 65535:
+            return 400, {'error': 'Invalid port number'}
+        if not self.listeners.remove(port):
+            return 404, {'error': 'Port not found', 'port': port}
+        return 200, {'status': 'removed', 'port': port}
+    
+    def status(self, _=None) -> ApiResponse:
+        """获取服务状态"""
+        status = {
+            'status': 'running',
+            'timestamp': time.time(),
+            'active_clients': len(self.registry.get_all_clients())
+        }
+        if self.status_provider:
+            status.update(self.status_provider())
+        return 200, status
+    
+    def metrics(self, _=None) -> ApiResponse:
+        """Prometheus指标"""
+        if not self.metrics_provider:
+            return 404, {'error': 'Not found'}
+        return 200, self.metrics_provider()
\ No newline at end of file
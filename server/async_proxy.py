@@ -0,0 +1,368 @@
+import asyncio
+import socket
+import threading
+import logging
+import time
+from typing import Dict, List, Optional
+from common.logger import CONNECTION_LOGGER
+from .registry import ClientRegistry, ClientInfo
+from .utils import LocalListenerCache, raise_nofile_limit
+from .pool import UpstreamPoolManager
+from .balancer import Balancer, LeastConnectionsBalancer
+from .admission import AdmissionController
+from .circuit import CircuitBreaker
+from .tunnel import TunnelServer
+from .lifecycle import LifecycleManager
+from .tuning import SocketTuner
+from .metrics import (
+    ProxyMetrics, ProxySession, TrafficCounter, LOCAL_CLIENT, RESULT_ACCEPTED, RESULT_RATE_LIMITED,
+    RESULT_QUEUE_TIMEOUT, RESULT_NO_SERVICE, RESULT_UNAVAILABLE, RESULT_FAILED
+)
+
+# 每个连接的日志，参数在写入线程中才格式化，可通过LOG_CONNECTION_SAMPLE_RATE采样
+connection_log = logging.getLogger(CONNECTION_LOGGER)
+
+class AsyncTCPProxy:
+    """基于asyncio事件循环的代理引擎，单线程服务所有代理端口"""
+
+    # 单次读取的最大字节数，同时也是每个流的缓冲上限
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, registry: ClientRegistry, max_connections: int = 1000,
+                 listener_cache: Optional[LocalListenerCache] = None,
+                 upstream_pool: Optional[UpstreamPoolManager] = None,
+                 balancer: Optional[Balancer] = None,
+                 metrics: Optional[ProxyMetrics] = None,
+                 backlog: int = 4096,
+                 admission: Optional[AdmissionController] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 connect_timeout: float = 5,
+                 max_attempts: int = 3,
+                 tunnels: Optional[TunnelServer] = None,
+                 lifecycle: Optional[LifecycleManager] = None,
+                 tuning: Optional[SocketTuner] = None):
+        self.registry = registry
+        self.listener_cache = listener_cache or LocalListenerCache()
+        self.upstream_pool = upstream_pool
+        self.balancer = balancer or LeastConnectionsBalancer()
+        self.metrics = metrics or ProxyMetrics()
+        self.admission = admission or AdmissionController(max_connections)
+        self.max_connections = self.admission.max_connections
+        # 监听队列长度，同时也是每次就绪时事件循环连续accept的上限
+        self.backlog = backlog
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # 连接本地服务/客户端的超时，以及每个连接最多尝试的客户端数
+        self.connect_timeout = connect_timeout
+        self.max_attempts = max_attempts
+        # 客户端隧道，有隧道的客户端优先通过隧道转发
+        self.tunnels = tunnels
+        # 空闲超时和最长存活时间，回收卡住的会话
+        self.lifecycle = lifecycle or LifecycleManager()
+        self.lifecycle.on_reap = self.metrics.reaped_session
+        # 按端口的socket选项（TCP_NODELAY、keepalive、缓冲区、TFO等）
+        self.tuning = tuning or SocketTuner()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._servers: Dict[int, asyncio.AbstractServer] = {}
+        self._ready = threading.Event()
+
+    @property
+    def active_connections(self) -> int:
+        return self.admission.active
+
+    def start(self, ports: List[int], sockets: Optional[Dict[int, socket.socket]] = None):
+        """在后台线程中启动事件循环，可传入已创建的监听socket（多进程模式）"""
+        thread = threading.Thread(target=self.run, args=(ports, sockets), daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, ports: List[int], sockets: Optional[Dict[int, socket.socket]] = None):
+        """运行事件循环（阻塞）"""
+        raise_nofile_limit()
+
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._start_servers(ports, sockets or {}))
+            self._ready.set()
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def stop(self):
+        """停止事件循环"""
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def add_listener(self, port: int, server_socket: socket.socket):
+        """在运行中的事件循环上开始监听一个端口（可在任意线程调用）"""
+        if not self._ready.wait(self.connect_timeout):
+            raise RuntimeError('Async proxy engine is not running')
+        future = asyncio.run_coroutine_threadsafe(self._start_server(port, server_socket), self._loop)
+        future.result(self.connect_timeout)
+
+    def remove_listener(self, port: int) -> bool:
+        """停止监听一个端口，已建立的连接不受影响（可在任意线程调用）"""
+        if not self._ready.is_set():
+            return False
+        future = asyncio.run_coroutine_threadsafe(self._stop_server(port), self._loop)
+        return future.result(self.connect_timeout)
+
+    async def _start_servers(self, ports: List[int], sockets: Dict[int, socket.socket]):
+        """为所有端口创建监听"""
+        for port in ports:
+            try:
+                await self._start_server(port, sockets.get(port))
+            except Exception as e:
+                logging.error(f"Failed to start async proxy server on port {port}: {e}")
+
+    async def _start_server(self, port: int, server_socket: Optional[socket.socket] = None):
+        """创建一个端口的监听，可传入已创建的监听socket"""
+        handler = lambda reader, writer: self._handle_connection(reader, writer, port)
+        if server_socket is not None:
+            server = await asyncio.start_server(
+                handler, sock=server_socket, backlog=self.backlog, limit=self.READ_SIZE
+            )
+        else:
+            server = await asyncio.start_server(
+                handler,
+                host='0.0.0.0',
+                port=port,
+                reuse_address=True,
+                backlog=self.backlog,
+                limit=self.READ_SIZE
+            )
+        self._servers[port] = server
+        for sock in server.sockets:
+            self.listener_cache.ignore_socket(sock)
+            self.tuning.tune_listener(sock, port)
+        logging.info(f"Async proxy server started on port {port}")
+
+    async def _stop_server(self, port: int) -> bool:
+        """关闭一个端口的监听"""
+        server = self._servers.pop(port, None)
+        if server is None:
+            return False
+        server.close()
+        logging.info(f"Async proxy server stopped on port {port}")
+        return True
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, port: int):
+        """处理单个连接"""
+        client_addr = writer.get_extra_info('peername')
+
+        result = await self._admit(port, client_addr)
+        self.metrics.connection(port, result)
+        if result != RESULT_ACCEPTED:
+            if result == RESULT_RATE_LIMITED:
+                # 滥用的来源可能产生大量拒绝，不逐条告警
+                connection_log.debug('Rate limit exceeded on port %s, rejected %s', port, client_addr,
+                                     extra={'port': port, 'peer': client_addr, 'result': result})
+            else:
+                connection_log.warning('Max connections reached on port %s, rejected %s (%s)', port, client_addr, result,
+                                       extra={'port': port, 'peer': client_addr, 'result': result})
+            writer.close()
+            return
+
+        try:
+            # 检查是否有本地服务（无/proc时回退到ss，会阻塞，放到线程池中执行）
+            if self.listener_cache.available:
+                is_local = self.listener_cache.is_listening(port)
+            else:
+                loop = asyncio.get_running_loop()
+                is_local = await loop.run_in_executor(None, self.listener_cache.is_listening, port)
+            
+            if is_local:
+                connection_log.info('Forwarding to local service: %s -> 127.0.0.1:%s', client_addr, port,
+                                    extra={'port': port, 'peer': client_addr, 'backend': LOCAL_CLIENT})
+                await self._forward_to_local(reader, writer, port)
+            else:
+                await self._forward_to_backends(reader, writer, port, client_addr)
+
+        except Exception as e:
+            logging.error(f"Error handling connection: {e}")
+            writer.close()
+        finally:
+            self.admission.release(port)
+
+    async def _admit(self, port: int, client_addr) -> str:
+        """准入检查，达到并发上限时在队列中等待名额；返回RESULT_ACCEPTED或拒绝原因"""
+        granted = asyncio.get_running_loop().create_future()
+        # 名额只会在事件循环线程中释放，可以直接设置future
+        result, waiter = self.admission.admit(
+            port, client_addr[0] if client_addr else '', lambda: granted.done() or granted.set_result(True)
+        )
+        if waiter is None:
+            return result
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait([granted], timeout=self.admission.queue_timeout)
+        except asyncio.CancelledError:
+            if self.admission.finish_wait(waiter):
+                self.admission.release(port)
+            raise
+        admitted = self.admission.finish_wait(waiter)
+        self.metrics.queue_time(port, time.monotonic() - start)
+        return RESULT_ACCEPTED if admitted else RESULT_QUEUE_TIMEOUT
+
+    async def _forward_to_local(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, port: int):
+        """转发到本地服务"""
+        try:
+            start = time.monotonic()
+            target_reader, target_writer = await self._open_upstream(socket.AF_INET, ('127.0.0.1', port), port)
+            self.metrics.connect_time(port, LOCAL_CLIENT, time.monotonic() - start)
+        except Exception as e:
+            logging.error(f"Failed to connect to local service on port {port}: {e!r}")
+            self.metrics.upstream_failure(port, LOCAL_CLIENT)
+            self.metrics.connection(port, RESULT_FAILED)
+            self.listener_cache.invalidate(port)
+            writer.close()
+            return
+
+        session = self.metrics.open_session(port, LOCAL_CLIENT)
+        await self._start_forwarding(reader, writer, target_reader, target_writer, session)
+
+    async def _forward_to_backends(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                   port: int, client_addr):
+        """在端口的后端中选择一个转发，连接失败时换其他后端；所有后端都熔断时立即关闭"""
+        backends = self.registry.get_backends(port)
+        if not backends:
+            connection_log.warning('No service found for port %s, closing connection from %s', port, client_addr,
+                                   extra={'port': port, 'peer': client_addr, 'result': RESULT_NO_SERVICE})
+            self.metrics.connection(port, RESULT_NO_SERVICE)
+            writer.close()
+            return
+
+        tried = set()
+        failed = False
+        for _ in range(self.max_attempts):
+            candidates = [b for b in self.circuit_breaker.available(backends) if b.ipv6 not in tried]
+            client_info = self.balancer.acquire(port, candidates)
+            if client_info is None:
+                break
+            tried.add(client_info.ipv6)
+            try:
+                if not self.circuit_breaker.allow(client_info):
+                    continue
+                streams = await self._connect_client(client_info)
+                if streams is None:
+                    failed = True
+                    continue
+                connection_log.info('Forwarding to client: %s -> [%s]:%s', client_addr, client_info.ipv6, port,
+                                    extra={'port': port, 'peer': client_addr, 'backend': client_info.ipv6})
+                session = self.metrics.open_session(port, client_info.ipv6)
+                await self._start_forwarding(reader, writer, *streams, session)
+                return
+            finally:
+                self.balancer.release(client_info)
+
+        result = RESULT_FAILED if failed else RESULT_UNAVAILABLE
+        connection_log.warning('No reachable client for port %s, closing connection from %s', port, client_addr,
+                               extra={'port': port, 'peer': client_addr, 'result': result})
+        self.metrics.connection(port, result)
+        writer.close()
+
+    async def _connect_client(self, client_info: ClientInfo):
+        """连接客户端（优先使用隧道，其次是预连接池），结果计入熔断器，返回(reader, writer)，失败返回None"""
+        try:
+            pooled = None
+            if self.tunnels:
+                pooled = await self._open_tunnel_stream(client_info)
+            if pooled is None and self.upstream_pool:
+                pooled = self.upstream_pool.acquire(client_info.ipv6, client_info.port)
+            if pooled is not None:
+                streams = await asyncio.open_connection(sock=pooled, limit=self.READ_SIZE)
+            else:
+                start = time.monotonic()
+                streams = await self._open_upstream(socket.AF_INET6, (client_info.ipv6, client_info.port),
+                                                    client_info.port)
+                self.metrics.connect_time(client_info.port, client_info.ipv6, time.monotonic() - start)
+        except Exception as e:
+            logging.error(f"Failed to connect to client [{client_info.ipv6}]:{client_info.port}: {e!r}")
+            self.metrics.upstream_failure(client_info.port, client_info.ipv6)
+            self.circuit_breaker.record_failure(client_info)
+            return None
+        self.circuit_breaker.record_success(client_info)
+        return streams
+
+    async def _open_tunnel_stream(self, client_info: ClientInfo) -> Optional[socket.socket]:
+        """通过隧道打开流并等待客户端确认连接到本地服务；没有隧道时返回None，连接失败抛出ConnectionError"""
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+
+        def on_open(ok: bool):
+            # 在隧道线程中调用，等待可能已超时
+            loop.call_soon_threadsafe(lambda: opened.done() or opened.set_result(ok))
+
+        sock = self.tunnels.open_stream(client_info.ipv6, client_info.port, on_open)
+        if sock is None:
+            return None
+        try:
+            if not await asyncio.wait_for(opened, self.connect_timeout):
+                raise ConnectionError('tunnel stream refused')
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _open_upstream(self, family: int, address: tuple, port: int):
+        """按端口的调优配置创建socket并连接，返回(reader, writer)"""
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self.tuning.tune_upstream(sock, port)
+            sock.setblocking(False)
+            await asyncio.wait_for(asyncio.get_running_loop().sock_connect(sock, address), self.connect_timeout)
+        except BaseException:
+            sock.close()
+            raise
+        return await asyncio.open_connection(sock=sock, limit=self.READ_SIZE)
+
+    async def _start_forwarding(self, reader1: asyncio.StreamReader, writer1: asyncio.StreamWriter,
+                                reader2: asyncio.StreamReader, writer2: asyncio.StreamWriter,
+                                session: ProxySession):
+        """启动双向数据转发，reader1/writer1为访问者一侧
+
+        一个方向读到EOF时向另一侧write_eof，另一方向继续转发（半关闭）；
+        任一方向出错或会话被回收时立即关闭两端。
+        """
+        loop = asyncio.get_running_loop()
+
+        def abort():
+            writer1.transport.abort()
+            writer2.transport.abort()
+
+        self.lifecycle.track(session, lambda: loop.call_soon_threadsafe(abort))
+        pending = {
+            asyncio.ensure_future(self._pipe(reader1, writer2, session.bytes_in)),
+            asyncio.ensure_future(self._pipe(reader2, writer1, session.bytes_out))
+        }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if not all(task.result() for task in done):
+                    break
+        finally:
+            self.lifecycle.untrack(session)
+            for task in pending:
+                task.cancel()
+            writer1.close()
+            writer2.close()
+            self.metrics.close_session(session)
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                    counter: TrafficCounter) -> bool:
+        """单向转发，drain保证对端慢时不会无限缓冲；正常读到EOF返回True"""
+        try:
+            while True:
+                data = await reader.read(self.READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                counter.value += len(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+            return True
+        except Exception as e:
+            connection_log.debug('Forwarding ended: %s', e)
+            return False
\ No newline at end of file
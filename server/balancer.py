@@ -0,0 +1,86 @@
+import itertools
+import threading
+import logging
+from typing import Dict, Optional, Sequence
+from .registry import ClientInfo
+
+# 负载均衡策略
+BALANCE_LEAST_CONN = 'least_conn'
+BALANCE_WEIGHTED_ROUND_ROBIN = 'weighted_round_robin'
+
+class Balancer:
+    """从端口的多个后端中选择一个，并维护ClientInfo.connection_count"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+    
+    def acquire(self, port: int, backends: Sequence[ClientInfo]) -> Optional[ClientInfo]:
+        """选择后端并增加其连接计数，连接结束后需调用release"""
+        if not backends:
+            return None
+        with self._lock:
+            backend = backends[0] if len(backends) == 1 else self._select(port, backends)
+            backend.connection_count += 1
+        return backend
+    
+    def release(self, backend: ClientInfo):
+        """连接结束，减少后端的连接计数"""
+        with self._lock:
+            backend.connection_count -= 1
+    
+    def _select(self, port: int, backends: Sequence[ClientInfo]) -> ClientInfo:
+        raise NotImplementedError
+
+class LeastConnectionsBalancer(Balancer):
+    """最少连接：选择 活跃连接数/权重 最小的后端，相同时轮流选择"""
+    
+    def __init__(self):
+        super().__init__()
+        self._counter = itertools.count()
+    
+    def _select(self, port: int, backends: Sequence[ClientInfo]) -> ClientInfo:
+        offset = next(self._counter) % len(backends)
+        best = None
+        best_load = 0.0
+        for i in range(len(backends)):
+            backend = backends[(offset + i) % len(backends)]
+            load = backend.connection_count / max(backend.weight, 1)
+            if best is None or load < best_load:
+                best = backend
+                best_load = load
+        return best
+
+class WeightedRoundRobinBalancer(Balancer):
+    """平滑加权轮询（与nginx相同的算法）"""
+    
+    def __init__(self):
+        super().__init__()
+        # port -> {ipv6: 当前权重}
+        self._current: Dict[int, Dict[str, int]] = {}
+    
+    def _select(self, port: int, backends: Sequence[ClientInfo]) -> ClientInfo:
+        current = self._current.setdefault(port, {})
+        if len(current) > len(backends):
+            # 清理已下线后端的状态
+            live = {backend.ipv6 for backend in backends}
+            for ipv6 in [ipv6 for ipv6 in current if ipv6 not in live]:
+                del current[ipv6]
+        
+        total = 0
+        best = None
+        for backend in backends:
+            weight = max(backend.weight, 1)
+            current[backend.ipv6] = current.get(backend.ipv6, 0) + weight
+            total += weight
+            if best is None or current[backend.ipv6] > current[best.ipv6]:
+                best = backend
+        current[best.ipv6] -= total
+        return best
+
+def get_balancer(strategy: str) -> Balancer:
+    """按策略名称创建负载均衡器"""
+    if strategy == BALANCE_WEIGHTED_ROUND_ROBIN:
+        return WeightedRoundRobinBalancer()
+    if strategy != BALANCE_LEAST_CONN:
+        logging.warning(f"Unknown load balancing strategy '{strategy}', using least connections")
+    return LeastConnectionsBalancer()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import threading
+import time
+import logging
+from typing import List, Sequence
+from .registry import ClientInfo
+
+class CircuitBreaker:
+    """客户端后端的熔断器，状态保存在ClientInfo上（客户端重新注册时由注册表重置）
+    
+    - 关闭：正常转发，连续连接失败failure_threshold次后打开
+    - 打开：cooldown秒内不再选择该后端，请求转到其他后端或立即失败
+    - 半开：冷却结束后只放行一个探测连接，成功则关闭，失败则重新打开
+    """
+    
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+    
+    def available(self, backends: Sequence[ClientInfo]) -> List[ClientInfo]:
+        """过滤掉熔断中的后端（冷却结束且无探测进行中的后端保留）"""
+        if self.failure_threshold <= 0:
+            return list(backends)
+        now = time.monotonic()
+        return [
+            backend for backend in backends
+            if backend.circuit_open_until <= now and not backend.circuit_probing
+        ]
+    
+    def allow(self, backend: ClientInfo) -> bool:
+        """选中后端后调用：熔断中返回False；冷却结束时由第一个调用者发起探测"""
+        if self.failure_threshold <= 0 or not backend.circuit_open_until:
+            return True
+        with self._lock:
+            if not backend.circuit_open_until:
+                return True
+            if backend.circuit_probing or backend.circuit_open_until > time.monotonic():
+                return False
+            backend.circuit_probing = True
+            return True
+    
+    def record_success(self, backend: ClientInfo):
+        """连接成功，关闭熔断"""
+        if not backend.failures and not backend.circuit_open_until:
+            return
+        with self._lock:
+            if backend.circuit_open_until:
+                logging.info(f"Circuit closed for client [{backend.ipv6}]:{backend.port}")
+            backend.failures = 0
+            backend.circuit_open_until = 0.0
+            backend.circuit_probing = False
+    
+    def record_failure(self, backend: ClientInfo):
+        """连接失败，连续失败达到阈值或探测失败时打开熔断"""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            backend.failures += 1
+            if backend.circuit_probing or backend.failures >= self.failure_threshold:
+                if not backend.circuit_open_until:
+                    logging.warning(
+                        f"Circuit opened for client [{backend.ipv6}]:{backend.port} "
+                        f"after {backend.failures} consecutive failures"
+                    )
+                backend.circuit_open_until = time.monotonic() + self.cooldown
+                backend.circuit_probing = False
\ No newline at end of file
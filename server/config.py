@@ -5,20 +5,114 @@ class ServerConfig:
     # 服务端监听配置
     API_HOST = os.getenv('LAMBDALINK_API_HOST', '0.0.0.0')
     API_PORT = int(os.getenv('LAMBDALINK_API_PORT', '8000'))
+    # API服务: flask(Flask开发服务器，每请求一个线程) 或 asyncio(单事件循环，支持keep-alive)
+    API_SERVER = os.getenv('LAMBDALINK_API_SERVER', 'flask').lower()
+    API_BACKLOG = int(os.getenv('LAMBDALINK_API_BACKLOG', '1024'))
+    
+    # 控制通道（客户端长连接）
+    CONTROL_ENABLED = os.getenv('LAMBDALINK_CONTROL_ENABLED', 'true').lower() == 'true'
+    CONTROL_PORT = int(os.getenv('LAMBDALINK_CONTROL_PORT', '8001'))
+    CONTROL_TIMEOUT = int(os.getenv('LAMBDALINK_CONTROL_TIMEOUT', '15'))  # 无心跳即断开
+    
+    # 隧道（客户端主动建立的多路复用长连接，代理通过它访问客户端服务，需PROXY_WORKERS=0）
+    TUNNEL_ENABLED = os.getenv('LAMBDALINK_TUNNEL_ENABLED', 'false').lower() == 'true'
+    TUNNEL_PORT = int(os.getenv('LAMBDALINK_TUNNEL_PORT', '8002'))
     
     # 代理端口范围
     PROXY_PORTS = list(map(int, os.getenv('LAMBDALINK_PROXY_PORTS', '9000-9010').split('-')))
     if len(PROXY_PORTS) == 2:
         PROXY_PORTS = list(range(PROXY_PORTS[0], PROXY_PORTS[1] + 1))
+    # 代理端口监听: static(启动时绑定全部端口) 或 lazy(端口有客户端注册时才绑定，需PROXY_WORKERS=0)
+    # lazy模式下客户端只能注册上述范围内或通过/api/ports添加的端口
+    LISTENER_MODE = os.getenv('LAMBDALINK_LISTENER_MODE', 'static').lower()
+    # lazy模式下端口最后一个客户端过期后，保持监听的时间(秒)，避免客户端重连时反复绑定
+    LISTENER_LINGER = float(os.getenv('LAMBDALINK_LISTENER_LINGER', '30'))
+    
+    # UDP转发（游戏服务器、DNS、QUIC等），客户端上报时protocol为udp；端口格式同PROXY_PORTS
+    UDP_ENABLED = os.getenv('LAMBDALINK_UDP_ENABLED', 'false').lower() == 'true'
+    UDP_PORTS = list(map(int, os.getenv('LAMBDALINK_UDP_PORTS', '9000-9010').split('-')))
+    if len(UDP_PORTS) == 2:
+        UDP_PORTS = list(range(UDP_PORTS[0], UDP_PORTS[1] + 1))
+    # 访问者地址的流在该时间(秒)内没有数据报即被淘汰
+    UDP_FLOW_TIMEOUT = float(os.getenv('LAMBDALINK_UDP_FLOW_TIMEOUT', '60'))
+    UDP_MAX_FLOWS = int(os.getenv('LAMBDALINK_UDP_MAX_FLOWS', '10000'))
     
     # 客户端管理
     CLIENT_TIMEOUT = int(os.getenv('LAMBDALINK_CLIENT_TIMEOUT', '300'))  # 5分钟
     HEARTBEAT_INTERVAL = int(os.getenv('LAMBDALINK_HEARTBEAT_INTERVAL', '60'))  # 1分钟
     
+    # 注册表持久化目录（快照+日志），为空表示不持久化
+    REGISTRY_STATE_DIR = os.getenv('LAMBDALINK_REGISTRY_STATE_DIR', '/var/lib/lambdalink')
+    REGISTRY_SNAPSHOT_INTERVAL = float(os.getenv('LAMBDALINK_REGISTRY_SNAPSHOT_INTERVAL', '60'))
+    # 日志记录数超过该值时立即压缩，限制启动回放量
+    REGISTRY_JOURNAL_MAX_RECORDS = int(os.getenv('LAMBDALINK_REGISTRY_JOURNAL_MAX_RECORDS', '100000'))
+    
     # 安全配置
     API_KEY = os.getenv('LAMBDALINK_API_KEY', 'default-api-key-change-me')
     MAX_CONNECTIONS = int(os.getenv('LAMBDALINK_MAX_CONNECTIONS', '1000'))
     
+    # 准入控制：达到连接上限时新连接排队等待，队列已满或等待超时才关闭（多worker时按进程计算）
+    ADMISSION_QUEUE_SIZE = int(os.getenv('LAMBDALINK_ADMISSION_QUEUE_SIZE', '256'))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('LAMBDALINK_ADMISSION_QUEUE_TIMEOUT', '5'))
+    # 每个端口的并发连接上限，0表示不限制；PORT_CONNECTION_LIMITS按端口覆盖，如 9000=100,9001=50
+    MAX_CONNECTIONS_PER_PORT = int(os.getenv('LAMBDALINK_MAX_CONNECTIONS_PER_PORT', '0'))
+    PORT_CONNECTION_LIMITS = {
+        int(port): int(limit)
+        for port, limit in (item.split('=') for item in os.getenv('LAMBDALINK_PORT_CONNECTION_LIMITS', '').split(',') if item)
+    }
+    # 新建连接速率限制（令牌桶，每秒连接数，0表示不限制；突发量为0时等于速率）
+    PORT_RATE_LIMIT = float(os.getenv('LAMBDALINK_PORT_RATE_LIMIT', '0'))
+    PORT_RATE_BURST = float(os.getenv('LAMBDALINK_PORT_RATE_BURST', '0'))
+    SOURCE_RATE_LIMIT = float(os.getenv('LAMBDALINK_SOURCE_RATE_LIMIT', '0'))
+    SOURCE_RATE_BURST = float(os.getenv('LAMBDALINK_SOURCE_RATE_BURST', '0'))
+    
+    # 代理端口的监听队列长度（实际上限受net.core.somaxconn限制）
+    LISTEN_BACKLOG = int(os.getenv('LAMBDALINK_LISTEN_BACKLOG', '4096'))
+    # 代理端口和上游连接的socket调优: default(系统默认) / interactive(TCP_NODELAY、keepalive、TCP_USER_TIMEOUT)
+    # / bulk(4MB收发缓冲区) / fastopen(interactive+上游TFO，仅适用于访问者先发送数据的协议)
+    SOCKET_PROFILE = os.getenv('LAMBDALINK_SOCKET_PROFILE', 'default').lower()
+    # 按端口覆盖，如 9000=interactive,9001=bulk
+    PORT_SOCKET_PROFILES = {
+        int(port): profile.lower()
+        for port, profile in (item.split('=') for item in os.getenv('LAMBDALINK_PORT_SOCKET_PROFILES', '').split(',') if item)
+    }
+    
+    # 代理引擎: thread(每连接一个线程) 或 asyncio(单事件循环)
+    PROXY_ENGINE = os.getenv('LAMBDALINK_PROXY_ENGINE', 'thread').lower()
+    # 代理worker进程数，0表示在API进程内运行代理；>0时各进程以SO_REUSEPORT绑定代理端口
+    PROXY_WORKERS = int(os.getenv('LAMBDALINK_PROXY_WORKERS', '0'))
+    # 转发模式(thread引擎): copy / buffer(recv_into缓冲池) / splice(Linux零拷贝)
+    FORWARD_MODE = os.getenv('LAMBDALINK_FORWARD_MODE', 'copy').lower()
+    
+    # 连接本地服务/客户端的超时(秒)，失败时最多尝试的客户端数
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('LAMBDALINK_UPSTREAM_CONNECT_TIMEOUT', '5'))
+    UPSTREAM_MAX_ATTEMPTS = int(os.getenv('LAMBDALINK_UPSTREAM_MAX_ATTEMPTS', '3'))
+    # 转发中的连接两个方向都没有数据超过该时间(秒)即被回收；连接最长存活时间，0表示不限制
+    CONNECTION_IDLE_TIMEOUT = float(os.getenv('LAMBDALINK_CONNECTION_IDLE_TIMEOUT', '600'))
+    CONNECTION_MAX_LIFETIME = float(os.getenv('LAMBDALINK_CONNECTION_MAX_LIFETIME', '0'))
+    # 客户端熔断：连续失败次数达到阈值后停止转发，冷却后放行一个探测连接（阈值为0表示关闭熔断）
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LAMBDALINK_CIRCUIT_FAILURE_THRESHOLD', '3'))
+    CIRCUIT_COOLDOWN = float(os.getenv('LAMBDALINK_CIRCUIT_COOLDOWN', '30'))
+    
+    # 同一端口有多个客户端时的负载均衡策略: least_conn / weighted_round_robin
+    LOAD_BALANCING = os.getenv('LAMBDALINK_LOAD_BALANCING', 'least_conn').lower()
+    
+    # 本地监听表缓存有效期(秒)
+    LOCAL_LISTENER_TTL = float(os.getenv('LAMBDALINK_LOCAL_LISTENER_TTL', '1.0'))
+    
+    # 到客户端的预连接池(每个客户端的连接数，0表示关闭)
+    UPSTREAM_POOL_SIZE = int(os.getenv('LAMBDALINK_UPSTREAM_POOL_SIZE', '0'))
+    UPSTREAM_POOL_MAX_IDLE = float(os.getenv('LAMBDALINK_UPSTREAM_POOL_MAX_IDLE', '30'))
+    UPSTREAM_POOL_LIVENESS_CHECK = os.getenv('LAMBDALINK_UPSTREAM_POOL_LIVENESS_CHECK', 'true').lower() == 'true'
+    
     # 日志配置
     LOG_LEVEL = os.getenv('LAMBDALINK_LOG_LEVEL', 'INFO')
-    LOG_FILE = os.getenv('LAMBDALINK_LOG_FILE', '/var/log/lambdalink-server.log')
\ No newline at end of file
+    LOG_FILE = os.getenv('LAMBDALINK_LOG_FILE', '/var/log/lambdalink-server.log')
+    # queue: 日志由后台线程写入，不阻塞调用线程；sync: 直接写入
+    LOG_MODE = os.getenv('LAMBDALINK_LOG_MODE', 'queue').lower()
+    # text 或 json(每行一条JSON)
+    LOG_FORMAT = os.getenv('LAMBDALINK_LOG_FORMAT', 'text').lower()
+    # 每连接INFO/DEBUG日志的采样比例(0-1)，WARNING及以上不采样
+    LOG_CONNECTION_SAMPLE_RATE = float(os.getenv('LAMBDALINK_LOG_CONNECTION_SAMPLE_RATE', '1'))
+    # 日志队列长度，写入跟不上时丢弃新日志而不是阻塞
+    LOG_QUEUE_SIZE = int(os.getenv('LAMBDALINK_LOG_QUEUE_SIZE', '10000'))
\ No newline at end of file
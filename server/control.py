@@ -0,0 +1,214 @@
+import socket
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+from common.protocol import ControlMessage, ControlMessageType, read_control_message
+from .registry import ClientRegistry
+from .utils import validate_ipv6
+
+class ControlSession:
+    """单个客户端的控制连接"""
+
+    def __init__(self, sock: socket.socket, addr):
+        self.sock = sock
+        self.addr = addr
+        self.ipv6: Optional[str] = None
+        self.ports: List[int] = []
+        self._send_lock = threading.Lock()
+
+    def send(self, message: ControlMessage) -> bool:
+        """发送一帧，失败时返回False"""
+        try:
+            with self._send_lock:
+                self.sock.sendall(message.encode())
+            return True
+        except OSError as e:
+            logging.debug(f"Failed to send control message to {self.addr}: {e}")
+            return False
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except:
+            pass
+
+class ControlServer:
+    """客户端长连接控制通道，连接断开时立即注销该客户端的端口"""
+
+    def __init__(self, registry: ClientRegistry, api_key: str, host: str = '0.0.0.0',
+                 port: int = 8001, timeout: float = 15,
+                 port_filter: Optional[Callable[[int], bool]] = None):
+        self.registry = registry
+        self.api_key = api_key
+        # 客户端可以注册的端口（lazy监听模式下由ListenerManager.allows判断）
+        self.port_filter = port_filter
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sessions: Dict[str, ControlSession] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动控制通道监听线程"""
+        thread = threading.Thread(target=self._serve, daemon=True)
+        thread.start()
+        return thread
+
+    def send_to(self, ipv6: str, message: ControlMessage) -> bool:
+        """向指定客户端推送消息"""
+        session = self._sessions.get(ipv6)
+        if not session:
+            return False
+        return session.send(message)
+
+    def broadcast(self, message: ControlMessage) -> int:
+        """向所有在线客户端推送消息，返回成功数量"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(1 for session in sessions if session.send(message))
+
+    def get_sessions(self) -> Dict[str, List[int]]:
+        """在线客户端及其端口"""
+        with self._lock:
+            return {ipv6: list(session.ports) for ipv6, session in self._sessions.items()}
+
+    def _serve(self):
+        """接受控制连接"""
+        try:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind((self.host, self.port))
+            server_socket.listen(128)
+
+            logging.info(f"Control channel started on port {self.port}")
+
+            while True:
+                try:
+                    client_socket, client_addr = server_socket.accept()
+                    thread = threading.Thread(
+                        target=self._handle_session,
+                        args=(ControlSession(client_socket, client_addr),),
+                        daemon=True
+                    )
+                    thread.start()
+                except Exception as e:
+                    logging.error(f"Error accepting control connection: {e}")
+
+        except Exception as e:
+            logging.error(f"Failed to start control channel on port {self.port}: {e}")
+
+    def _handle_session(self, session: ControlSession):
+        """处理单个控制连接，直到连接关闭或超时"""
+        # 超过timeout没有任何帧（心跳）即认为客户端已失联
+        session.sock.settimeout(self.timeout)
+        session.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            while True:
+                message = read_control_message(session.sock)
+                if message is None:
+                    break
+                if not self._handle_message(session, message):
+                    break
+        except socket.timeout:
+            logging.warning(f"Control channel timed out: {session.addr}")
+        except Exception as e:
+            logging.debug(f"Control channel error from {session.addr}: {e}")
+        finally:
+            self._close_session(session)
+
+    def _handle_message(self, session: ControlSession, message: ControlMessage) -> bool:
+        """处理一条控制消息，返回False表示关闭连接"""
+        if message.type == ControlMessageType.REGISTER:
+            return self._handle_register(session, message)
+
+        if session.ipv6 is None:
+            session.send(ControlMessage(ControlMessageType.ERROR, {'message': 'Not registered'}))
+            return False
+
+        if message.type == ControlMessageType.HEARTBEAT:
+            missing = self.registry.update_heartbeats(session.ports, session.ipv6)
+            if missing:
+                # 注册已被清理（例如过期），要求客户端重新注册
+                session.send(ControlMessage(ControlMessageType.REREGISTER, {'ports': missing}))
+            else:
+                session.send(ControlMessage(ControlMessageType.ACK))
+        elif message.type == ControlMessageType.PING:
+            session.send(ControlMessage(ControlMessageType.PONG))
+        elif message.type == ControlMessageType.PONG:
+            pass
+        else:
+            logging.warning(f"Unknown control message type from {session.addr}: {message.type}")
+        return True
+
+    def _handle_register(self, session: ControlSession, message: ControlMessage) -> bool:
+        """处理注册消息，同一连接上可重复注册（例如IPv6地址变化）"""
+        data = message.data
+        if data.get('api_key') != self.api_key:
+            session.send(ControlMessage(ControlMessageType.ERROR, {'message': 'Invalid API key'}))
+            return False
+
+        ipv6 = data.get('ipv6')
+        ports = data.get('ports')
+        weight = data.get('weight', 1)
+        if not ipv6 or not validate_ipv6(ipv6):
+            session.send(ControlMessage(ControlMessageType.ERROR, {'message': 'Invalid IPv6 address'}))
+            return False
+        if not ports or not all(isinstance(port, int) and 1 <= port <= 65535 for port in ports):
+            session.send(ControlMessage(ControlMessageType.ERROR, {'message': 'Invalid port number'}))
+            return False
+        if not isinstance(weight, int) or not 1 <= weight <= 100:
+            session.send(ControlMessage(ControlMessageType.ERROR, {'message': 'Invalid weight'}))
+            return False
+        if self.port_filter:
+            rejected = [port for port in ports if not self.port_filter(port)]
+            if rejected:
+                session.send(ControlMessage(ControlMessageType.ERROR, {'message': f'Port not allowed: {rejected}'}))
+                return False
+
+        # 地址变化时注销旧地址
+        if session.ipv6 and session.ipv6 != ipv6:
+            self.registry.unregister_clients(session.ports, session.ipv6)
+            with self._lock:
+                if self._sessions.get(session.ipv6) is session:
+                    del self._sessions[session.ipv6]
+        elif session.ipv6:
+            dropped = [port for port in session.ports if port not in ports]
+            if dropped:
+                self.registry.unregister_clients(dropped, session.ipv6)
+
+        if not self.registry.register_clients(ports, ipv6, weight):
+            session.send(ControlMessage(ControlMessageType.ERROR, {'message': 'Registration failed'}))
+            return False
+
+        session.ipv6 = ipv6
+        session.ports = list(ports)
+        with self._lock:
+            previous = self._sessions.get(ipv6)
+            self._sessions[ipv6] = session
+        if previous and previous is not session:
+            # 同一客户端重连，旧连接作废
+            previous.close()
+
+        logging.info(f"Control channel registered: {session.addr} ipv6={ipv6} ports={ports}")
+        session.send(ControlMessage(ControlMessageType.ACK, {'ports': ports}))
+        return True
+
+    def _close_session(self, session: ControlSession):
+        """连接关闭：立即注销该连接注册的端口"""
+        session.close()
+        if session.ipv6 is None:
+            return
+        with self._lock:
+            is_current = self._sessions.get(session.ipv6) is session
+            if is_current:
+                del self._sessions[session.ipv6]
+        # 被同一客户端的新连接替换时不注销
+        if is_current:
+            self.registry.unregister_clients(session.ports, session.ipv6)
+            logging.info(f"Control channel closed, evicted client: ipv6={session.ipv6} ports={session.ports}")
+        else:
+            logging.info(f"Control channel closed: {session.addr}")
\ No newline at end of file
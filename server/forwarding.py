@@ -0,0 +1,118 @@
+import os
+import errno
+import socket
+import threading
+import logging
+from typing import Callable, List, Optional
+from .metrics import TrafficCounter
+
+# 转发模式
+FORWARD_COPY = 'copy'      # recv/sendall，每块分配一个bytes对象
+FORWARD_BUFFER = 'buffer'  # recv_into预分配缓冲区 + memoryview
+FORWARD_SPLICE = 'splice'  # Linux splice()经管道在内核中搬运数据
+
+FORWARD_MODES = (FORWARD_COPY, FORWARD_BUFFER, FORWARD_SPLICE)
+
+COPY_CHUNK_SIZE = 4096
+BUFFER_SIZE = 64 * 1024
+SPLICE_SIZE = 64 * 1024
+
+def splice_supported() -> bool:
+    """当前平台是否支持os.splice"""
+    return hasattr(os, 'splice')
+
+class BufferPool:
+    """预分配的转发缓冲池，避免每个连接/每块数据都分配内存"""
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE, max_buffers: int = 256):
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+        self._free: List[bytearray] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bytearray:
+        """取出一个缓冲区，池为空时新分配"""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buf: bytearray):
+        """归还缓冲区，超出上限的直接丢弃"""
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buf)
+
+def copy_forward(src: socket.socket, dst: socket.socket, counter: Optional[TrafficCounter] = None) -> int:
+    """原始的复制转发，返回转发的字节数；counter用于实时统计"""
+    counter = counter or TrafficCounter()
+    start = counter.value
+    while True:
+        data = src.recv(COPY_CHUNK_SIZE)
+        if not data:
+            break
+        dst.sendall(data)
+        counter.value += len(data)
+    return counter.value - start
+
+def buffer_forward(src: socket.socket, dst: socket.socket, pool: BufferPool,
+                   counter: Optional[TrafficCounter] = None) -> int:
+    """使用池化缓冲区转发，数据不会生成新的bytes对象"""
+    buf = pool.acquire()
+    view = memoryview(buf)
+    counter = counter or TrafficCounter()
+    start = counter.value
+    try:
+        while True:
+            n = src.recv_into(buf)
+            if not n:
+                break
+            dst.sendall(view[:n])
+            counter.value += n
+    finally:
+        view.release()
+        pool.release(buf)
+    return counter.value - start
+
+def splice_forward(src: socket.socket, dst: socket.socket, pool: Optional[BufferPool] = None,
+                   counter: Optional[TrafficCounter] = None) -> int:
+    """通过管道splice转发，数据不进入用户态；内核不支持时回退到缓冲区转发"""
+    read_fd, write_fd = os.pipe()
+    counter = counter or TrafficCounter()
+    start = counter.value
+    try:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        while True:
+            try:
+                n = os.splice(src_fd, write_fd, SPLICE_SIZE, flags=os.SPLICE_F_MOVE)
+            except OSError as e:
+                if counter.value == start and e.errno in (errno.EINVAL, errno.ENOSYS) and pool is not None:
+                    logging.debug(f"splice unsupported for socket ({e}), falling back to buffer forwarding")
+                    return buffer_forward(src, dst, pool, counter)
+                raise
+            if n == 0:
+                break
+
+            # 把管道中的数据全部写到目标socket
+            remaining = n
+            while remaining:
+                remaining -= os.splice(read_fd, dst_fd, remaining, flags=os.SPLICE_F_MOVE)
+            counter.value += n
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+    return counter.value - start
+
+def get_forwarder(mode: str, pool: BufferPool) -> Callable[..., int]:
+    """根据模式返回单向转发函数 forward(src, dst, counter=None)"""
+    if mode == FORWARD_SPLICE:
+        if splice_supported():
+            return lambda src, dst, counter=None: splice_forward(src, dst, pool, counter)
+        logging.warning("splice() is not available on this platform, using buffer forwarding")
+        mode = FORWARD_BUFFER
+    if mode == FORWARD_BUFFER:
+        return lambda src, dst, counter=None: buffer_forward(src, dst, pool, counter)
+    if mode != FORWARD_COPY:
+        logging.warning(f"Unknown forward mode '{mode}', using copy forwarding")
+    return copy_forward
\ No newline at end of file
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import logging
+from http import HTTPStatus
+from typing import Dict, Optional, Set
+from .api import ControlAPI
+
+class HTTPConnection(asyncio.Protocol):
+    """一个keep-alive连接：在data_received中直接解析请求并写入响应
+    
+    不经过StreamReader和每请求的任务切换；流水线请求按顺序应答。
+    """
+    
+    def __init__(self, server: 'AsyncHTTPServer'):
+        self.server = server
+        self.transport: Optional[asyncio.Transport] = None
+        self.last_active = time.monotonic()
+        self._buffer = bytearray()
+        self._closing = False
+    
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections.add(self)
+    
+    def connection_lost(self, exc: Optional[Exception]):
+        self.server.connections.discard(self)
+    
+    def pause_writing(self):
+        # 对端不读取响应时停止读取新请求
+        self.transport.pause_reading()
+    
+    def resume_writing(self):
+        if not self._closing:
+            self.transport.resume_reading()
+    
+    def data_received(self, data: bytes):
+        self.last_active = time.monotonic()
+        buffer = self._buffer
+        buffer += data
+        offset = 0
+        try:
+            while not self._closing:
+                end = buffer.find(b'\r\n\r\n', offset)
+                if end < 0:
+                    if len(buffer) - offset > self.server.MAX_HEADER_SIZE:
+                        self._error(431, 'Request header too large')
+                    break
+                consumed = self._handle_request(bytes(buffer[offset:end]), buffer, end + 4)
+                if consumed < 0:
+                    # 请求体尚未收全
+                    break
+                offset = consumed
+        except Exception as e:
+            logging.error(f"API connection error: {e}")
+            self._error(500, 'Internal server error')
+        del buffer[:offset]
+    
+    def _handle_request(self, head: bytes, buffer: bytearray, body_start: int) -> int:
+        """处理一个请求，返回请求结束的位置；请求体未收全时返回-1"""
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            self._error(400, 'Bad request')
+            return body_start
+        
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        
+        if 'transfer-encoding' in headers:
+            self._error(501, 'Transfer-Encoding not supported')
+            return body_start
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > self.server.MAX_BODY_SIZE:
+            self._error(413 if length > 0 else 400, 'Invalid Content-Length')
+            return body_start
+        body_end = body_start + length
+        if body_end > len(buffer):
+            return -1
+        
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+        
+        status, result = self.server.api.dispatch(
+            method, target.split('?', 1)[0], headers.get('x-api-key'), bytes(buffer[body_start:body_end])
+        )
+        self._respond(status, result, keep_alive, version == 'HTTP/1.0')
+        return body_end
+    
+    def _error(self, status: int, message: str):
+        """返回错误并关闭连接"""
+        self._respond(status, {'error': message}, False)
+    
+    def _respond(self, status: int, result, keep_alive: bool, http10: bool = False):
+        if isinstance(result, str):
+            payload = result.encode('utf-8')
+            content_type = b'text/plain; version=0.0.4'
+        else:
+            payload = json.dumps(result).encode('utf-8')
+            content_type = b'application/json'
+        self.transport.write(
+            (b'HTTP/1.0 ' if http10 else b'HTTP/1.1 ') + self.server.status_line(status) +
+            b'\r\nContent-Type: ' + content_type +
+            b'\r\nContent-Length: ' + str(len(payload)).encode('ascii') +
+            (b'\r\nConnection: keep-alive\r\n\r\n' if keep_alive else b'\r\nConnection: close\r\n\r\n') +
+            payload
+        )
+        if not keep_alive:
+            self.close()
+    
+    def close(self):
+        """发送完已写入的响应后关闭"""
+        self._closing = True
+        self.transport.close()
+
+class AsyncHTTPServer:
+    """单事件循环的HTTP/1.1服务，运行控制面接口
+    
+    支持keep-alive和流水线请求；只支持Content-Length请求体，不支持chunked。
+    请求在事件循环中同步处理（注册表操作只短暂加锁）。
+    """
+    
+    # 请求行+请求头的最大长度
+    MAX_HEADER_SIZE = 16 * 1024
+    MAX_BODY_SIZE = 1024 * 1024
+    
+    def __init__(self, api: ControlAPI, host: str = '0.0.0.0', port: int = 8000,
+                 backlog: int = 1024, idle_timeout: float = 75):
+        self.api = api
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        # keep-alive连接的空闲超时(秒)，由定期清理关闭，避免每个请求设置定时器
+        self.idle_timeout = idle_timeout
+        self.connections: Set[HTTPConnection] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._status_lines: Dict[int, bytes] = {}
+    
+    def start(self) -> threading.Thread:
+        """在后台线程中运行，监听成功后返回"""
+        ready = threading.Event()
+        thread = threading.Thread(target=self.serve_forever, args=(ready,), daemon=True)
+        thread.start()
+        ready.wait()
+        if self._server is None:
+            raise OSError(f"Failed to start API server on {self.host}:{self.port}")
+        return thread
+    
+    def serve_forever(self, ready: Optional[threading.Event] = None):
+        """运行事件循环（阻塞）"""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(self._loop.create_server(
+                lambda: HTTPConnection(self), self.host, self.port,
+                backlog=self.backlog, reuse_address=True
+            ))
+            # port为0时使用实际分配的端口
+            self.port = self._server.sockets[0].getsockname()[1]
+            logging.info(f"API server (asyncio) started on {self.host}:{self.port}")
+        finally:
+            if ready:
+                ready.set()
+        self._loop.call_later(self.idle_timeout / 2, self._close_idle)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for connection in list(self.connections):
+                connection.close()
+            self._loop.close()
+    
+    def stop(self):
+        """停止事件循环"""
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+    
+    def status_line(self, status: int) -> bytes:
+        line = self._status_lines.get(status)
+        if line is None:
+            line = self._status_lines[status] = f"{status} {HTTPStatus(status).phrase}".encode('ascii')
+        return line
+    
+    def _close_idle(self):
+        """关闭空闲超时的keep-alive连接"""
+        deadline = time.monotonic() - self.idle_timeout
+        for connection in [c for c in self.connections if c.last_active < deadline]:
+            connection.close()
+        self._loop.call_later(self.idle_timeout / 2, self._close_idle)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import json
+import threading
+import logging
+import time
+from typing import Dict, List, Tuple
+from .registry import (
+    ClientRegistry, EVENT_REGISTER, EVENT_HEARTBEAT, EVENT_UNREGISTER, EVENT_EXPIRE, EVENT_RESTORE
+)
+
+class RegistryJournal:
+    """注册表持久化：追加写日志 + 定期压缩快照
+    
+    - registry.snapshot: 某个序号时刻的完整状态（单个JSON文档，一次解析即可加载）
+    - registry.journal: 快照之后的注册/注销/过期记录，每行一条 [seq, event...]
+    心跳不写日志，只更新内存中的镜像状态，由下一次快照带上最新的last_seen。
+    启动时加载快照并回放序号更大的日志记录；日志条数超过上限时立即压缩，保证回放量有界。
+    """
+    
+    SNAPSHOT_FILE = 'registry.snapshot'
+    JOURNAL_FILE = 'registry.journal'
+    SNAPSHOT_VERSION = 1
+    
+    def __init__(self, registry: ClientRegistry, state_dir: str, snapshot_interval: float = 60,
+                 max_journal_records: int = 100000):
+        self.registry = registry
+        self.state_dir = state_dir
+        self.snapshot_interval = snapshot_interval
+        self.max_journal_records = max_journal_records
+        self.snapshot_path = os.path.join(state_dir, self.SNAPSHOT_FILE)
+        self.journal_path = os.path.join(state_dir, self.JOURNAL_FILE)
+        # 镜像状态: port -> {ipv6: [last_seen, weight]}
+        self._state: Dict[int, Dict[str, List]] = {}
+        self._seq = 0
+        self._journal_records = 0
+        self._journal = None
+        self._lock = threading.Lock()
+        self._compact_event = threading.Event()
+    
+    def load(self) -> int:
+        """加载快照并回放日志，把状态恢复到注册表，返回恢复的记录数"""
+        start = time.perf_counter()
+        try:
+            state, seq = self.read_state(self.snapshot_path, self.journal_path)
+        except Exception as e:
+            logging.error(f"Failed to load registry state from {self.state_dir}: {e}")
+            return 0
+        entries = self._entries(state)
+        self.registry.restore_clients(entries)
+        self._seq = seq
+        elapsed = time.perf_counter() - start
+        logging.info(f"Registry restored from {self.state_dir}: {len(entries)} clients in {elapsed * 1000:.1f} ms")
+        return len(entries)
+    
+    def start(self):
+        """订阅注册表变更，写入新的快照并启动后台压缩线程"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.registry.subscribe(self._on_event, replay=True)
+        self.compact()
+        thread = threading.Thread(target=self._compact_loop, daemon=True)
+        thread.start()
+    
+    @classmethod
+    def read_state(cls, snapshot_path: str, journal_path: str) -> Tuple[Dict[int, Dict[str, List]], int]:
+        """读取快照和日志，返回 (port -> {ipv6: [last_seen, weight]}, 最后序号)"""
+        state: Dict[int, Dict[str, List]] = {}
+        seq = 0
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != cls.SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version: {snapshot.get('version')}")
+            seq = snapshot['seq']
+            for entry in snapshot['clients']:
+                # 旧版本快照没有权重
+                port, ipv6, last_seen = entry[:3]
+                state.setdefault(port, {})[ipv6] = [last_seen, entry[3] if len(entry) > 3 else 1]
+        
+        # 压缩过程中崩溃时轮换出的旧日志还在，先回放它
+        for path in (journal_path + '.old', journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能只写了一半
+                        logging.warning(f"Skipping truncated journal record in {path}")
+                        break
+                    if record[0] <= seq:
+                        continue
+                    seq = record[0]
+                    cls._apply(state, tuple(record[1:]))
+        return state, seq
+    
+    def compact(self):
+        """把镜像状态写成新快照并清空日志"""
+        with self._lock:
+            seq = self._seq
+            clients = self._entries(self._state)
+            # 先轮换日志，之后的记录写入新文件；快照写入失败时旧日志仍可回放
+            rotated = self.journal_path + '.old'
+            if not os.path.exists(rotated):
+                if self._journal:
+                    self._journal.close()
+                if os.path.exists(self.journal_path):
+                    os.replace(self.journal_path, rotated)
+                self._journal = open(self.journal_path, 'a')
+            elif self._journal is None:
+                # 上次快照没有写成功，旧日志还未被快照覆盖，继续追加到当前日志
+                self._journal = open(self.journal_path, 'a')
+            self._journal_records = 0
+        
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': self.SNAPSHOT_VERSION,
+                'seq': seq,
+                'timestamp': time.time(),
+                'clients': clients
+            }, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(rotated):
+            os.remove(rotated)
+        logging.debug(f"Registry snapshot written: {len(clients)} clients, seq={seq}")
+    
+    def _on_event(self, event: tuple):
+        """注册表事件回调（在注册表锁内调用）"""
+        with self._lock:
+            self._apply(self._state, event)
+            if event[0] in (EVENT_HEARTBEAT, EVENT_RESTORE) or self._journal is None:
+                return
+            self._seq += 1
+            self._journal.write(json.dumps([self._seq] + list(event), separators=(',', ':')) + '\n')
+            self._journal.flush()
+            self._journal_records += 1
+            if self._journal_records >= self.max_journal_records:
+                self._compact_event.set()
+    
+    @staticmethod
+    def _entries(state: Dict[int, Dict[str, List]]) -> List[Tuple[int, str, float, int]]:
+        """镜像状态展开为 [(port, ipv6, last_seen, weight), ...]"""
+        return [
+            (port, ipv6, last_seen, weight)
+            for port, backends in state.items()
+            for ipv6, (last_seen, weight) in backends.items()
+        ]
+
+    @staticmethod
+    def _apply(state: Dict[int, Dict[str, List]], event: tuple):
+        """把事件应用到镜像状态"""
+        kind = event[0]
+        if kind == EVENT_REGISTER:
+            _, ipv6, ports, last_seen, weight = event
+            for port in ports:
+                state.setdefault(port, {})[ipv6] = [last_seen, weight]
+        elif kind == EVENT_RESTORE:
+            for port, ipv6, last_seen, weight in event[1]:
+                state.setdefault(port, {})[ipv6] = [last_seen, weight]
+        elif kind == EVENT_HEARTBEAT:
+            _, ports, last_seen, ipv6 = event
+            for port in ports:
+                for address, value in state.get(port, {}).items():
+                    if ipv6 is None or address == ipv6:
+                        value[0] = last_seen
+        elif kind == EVENT_UNREGISTER:
+            _, ipv6, ports = event
+            for port in ports:
+                RegistryJournal._discard(state, port, ipv6)
+        elif kind == EVENT_EXPIRE:
+            for port, ipv6 in event[1]:
+                RegistryJournal._discard(state, port, ipv6)
+
+    @staticmethod
+    def _discard(state: Dict[int, Dict[str, List]], port: int, ipv6: str):
+        backends = state.get(port)
+        if backends and ipv6 in backends:
+            del backends[ipv6]
+            if not backends:
+                del state[port]
+
+    def _compact_loop(self):
+        """定期压缩，日志过长时提前压缩"""
+        while True:
+            self._compact_event.wait(self.snapshot_interval)
+            self._compact_event.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error(f"Registry snapshot error: {e}")
\ No newline at end of file
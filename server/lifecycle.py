@@ -0,0 +1,104 @@
+import threading
+import time
+import logging
+from typing import Callable, Dict, Optional
+from common.logger import CONNECTION_LOGGER
+from .metrics import ProxySession
+
+connection_log = logging.getLogger(CONNECTION_LOGGER)
+
+# 会话被回收的原因
+REAP_IDLE = 'idle'          # 两个方向都没有数据超过idle_timeout
+REAP_LIFETIME = 'lifetime'  # 存活时间超过max_lifetime
+
+class _TrackedSession:
+    __slots__ = ('abort', 'last_bytes', 'last_active')
+    
+    def __init__(self, abort: Callable[[], None], now: float):
+        self.abort = abort
+        self.last_bytes = 0
+        self.last_active = now
+
+class LifecycleManager:
+    """正在转发的会话的生命周期：空闲超时、最长存活时间，以及回收卡住的会话
+    
+    转发路径上不记录时间；清理线程每轮比较会话的字节计数，计数不变即视为空闲，
+    空闲判断的精度为一个清理间隔。回收时调用会话登记的abort（关闭两侧的读写），
+    转发线程/任务随之结束并释放socket。超时为0表示不限制。
+    """
+    
+    # 清理间隔的上限(秒)
+    MAX_SWEEP_INTERVAL = 30
+    
+    def __init__(self, idle_timeout: float = 600, max_lifetime: float = 0):
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        # 会话被回收时调用（例如计入指标），由代理引擎设置
+        self.on_reap: Optional[Callable[[ProxySession, str], None]] = None
+        self.reaped: Dict[str, int] = {REAP_IDLE: 0, REAP_LIFETIME: 0}
+        self._sessions: Dict[ProxySession, _TrackedSession] = {}
+        self._lock = threading.Lock()
+        timeouts = [t for t in (idle_timeout, max_lifetime) if t > 0]
+        self.interval = min(max(min(timeouts) / 4, 0.1), self.MAX_SWEEP_INTERVAL) if timeouts else 0
+        if self.interval:
+            thread = threading.Thread(target=self._sweep_loop, name='lambdalink-reaper', daemon=True)
+            thread.start()
+    
+    @property
+    def active(self) -> int:
+        return len(self._sessions)
+    
+    def track(self, session: ProxySession, abort: Callable[[], None]):
+        """登记一个开始转发的会话；abort必须可在任意线程调用并使转发结束"""
+        with self._lock:
+            self._sessions[session] = _TrackedSession(abort, time.monotonic())
+    
+    def untrack(self, session: ProxySession):
+        """会话结束，需在关闭socket之前调用，保证之后不会再被abort"""
+        with self._lock:
+            self._sessions.pop(session, None)
+    
+    def sweep(self, now: Optional[float] = None) -> int:
+        """回收空闲或超过存活时间的会话，返回回收的数量"""
+        now = time.monotonic() if now is None else now
+        reaped = 0
+        with self._lock:
+            for session, tracked in list(self._sessions.items()):
+                total = session.bytes_in.value + session.bytes_out.value
+                if total != tracked.last_bytes:
+                    tracked.last_bytes = total
+                    tracked.last_active = now
+                if self.max_lifetime > 0 and now - session.start >= self.max_lifetime:
+                    reason = REAP_LIFETIME
+                elif self.idle_timeout > 0 and now - tracked.last_active >= self.idle_timeout:
+                    reason = REAP_IDLE
+                else:
+                    continue
+                del self._sessions[session]
+                self._reap(session, tracked, reason)
+                reaped += 1
+        return reaped
+    
+    def _reap(self, session: ProxySession, tracked: _TrackedSession, reason: str):
+        """需持有锁"""
+        port, client = session.labels
+        connection_log.info('Reaping %s session on port %s to %s after %.0fs', reason, port, client,
+                            time.monotonic() - session.start,
+                            extra={'port': port, 'backend': client, 'result': reason})
+        self.reaped[reason] += 1
+        try:
+            tracked.abort()
+        except Exception as e:
+            logging.error(f"Failed to abort session on port {port}: {e}")
+        if self.on_reap:
+            self.on_reap(session, reason)
+    
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                reaped = self.sweep()
+                if reaped:
+                    logging.info(f"Reaped {reaped} stuck sessions ({len(self._sessions)} active)")
+            except Exception as e:
+                logging.error(f"Session reaper error: {e}")
\ No newline at end of file
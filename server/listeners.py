@@ -0,0 +1,175 @@
+import threading
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+from .registry import ClientRegistry, EVENT_HEARTBEAT
+from .utils import create_listener
+
+# 监听模式
+LISTENER_STATIC = 'static'  # 启动时绑定全部配置端口
+LISTENER_LAZY = 'lazy'      # 端口有客户端注册时才绑定，最后一个客户端过期后解绑
+
+class ListenerManager:
+    """按需管理代理端口的监听socket
+    
+    lazy模式下，允许范围内的端口在第一个客户端注册时绑定，最后一个客户端注销/过期并经过linger秒后解绑；
+    通过add固定的端口不依赖注册一直监听。static模式下启动时固定全部配置端口。
+    绑定和解绑在后台线程中进行，注册表回调只负责唤醒该线程。
+    """
+    
+    # 绑定失败（例如端口被占用）后的重试间隔
+    RETRY_INTERVAL = 30
+    
+    def __init__(self, registry: ClientRegistry, proxy, ports: Iterable[int], mode: str = LISTENER_STATIC,
+                 host: str = '0.0.0.0', backlog: int = 4096, linger: float = 30):
+        self.registry = registry
+        # 代理引擎，需提供add_listener(port, sock)、remove_listener(port)和tuning
+        self.proxy = proxy
+        if mode not in (LISTENER_STATIC, LISTENER_LAZY):
+            logging.warning(f"Unknown listener mode: {mode}, using {LISTENER_STATIC}")
+            mode = LISTENER_STATIC
+        self.mode = mode
+        self.host = host
+        self.backlog = backlog
+        self.linger = linger
+        # 允许客户端注册的端口；固定端口不依赖注册一直监听
+        self._allowed: Set[int] = set(ports)
+        self._pinned: Set[int] = set(self._allowed) if mode == LISTENER_STATIC else set()
+        self._listening: Set[int] = set()
+        # 端口 -> 失去最后一个客户端的时间 / 上次绑定失败的时间(monotonic)
+        self._idle_since: Dict[int, float] = {}
+        self._failed: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+    
+    @property
+    def ports(self) -> List[int]:
+        """当前监听的端口"""
+        with self._lock:
+            return sorted(self._listening)
+    
+    def allows(self, port: int) -> bool:
+        """客户端是否可以注册该端口（static模式不限制，与之前的行为一致）"""
+        return self.mode != LISTENER_LAZY or port in self._allowed
+    
+    def start(self):
+        """绑定当前需要的端口，并开始跟随注册表变化"""
+        self.registry.subscribe(self._on_registry_event)
+        delay = self.reconcile()
+        thread = threading.Thread(target=self._run, args=(delay,), name='lambdalink-listeners', daemon=True)
+        thread.start()
+        logging.info(f"Listener manager started ({self.mode}): {len(self._listening)} ports listening")
+        return thread
+    
+    def add(self, port: int) -> bool:
+        """固定一个端口（可不在配置范围内），立即绑定；返回是否正在监听"""
+        with self._lock:
+            self._allowed.add(port)
+            self._pinned.add(port)
+            self._failed.pop(port, None)
+        self.proxy.listener_cache.watch(port)
+        self.reconcile()
+        self._wakeup.set()
+        with self._lock:
+            return port in self._listening
+    
+    def remove(self, port: int) -> bool:
+        """停止代理一个端口并立即解绑，之后客户端不能再注册该端口；端口未知时返回False"""
+        with self._lock:
+            if port not in self._allowed and port not in self._listening:
+                return False
+            self._allowed.discard(port)
+            self._pinned.discard(port)
+            self._failed.pop(port, None)
+            self._idle_since.pop(port, None)
+            if port in self._listening:
+                self._unbind(port)
+        return True
+    
+    def list(self) -> List[Dict[str, Any]]:
+        """固定的端口和当前监听的端口"""
+        clients = self.registry.get_all_clients()
+        with self._lock:
+            return [
+                {
+                    'port': port,
+                    'pinned': port in self._pinned,
+                    'listening': port in self._listening,
+                    'backends': len(clients.get(port, ())),
+                    'idle_since': self._idle_since.get(port),
+                    'socket_profile': self.proxy.tuning.profile_for(port).name
+                }
+                for port in sorted(self._pinned | self._listening)
+            ]
+    
+    def reconcile(self) -> Optional[float]:
+        """使监听端口与注册表一致，返回下一次需要检查的等待时间"""
+        now = time.monotonic()
+        registered = self.registry.get_all_clients()
+        delay = None
+        with self._lock:
+            wanted = self._pinned | {port for port in registered if port in self._allowed}
+            for port in wanted:
+                self._idle_since.pop(port, None)
+                if port in self._listening:
+                    continue
+                failed = self._failed.get(port)
+                if failed is not None and now - failed < self.RETRY_INTERVAL:
+                    remaining = self.RETRY_INTERVAL - (now - failed)
+                else:
+                    remaining = None if self._bind(port, now) else self.RETRY_INTERVAL
+                if remaining is not None:
+                    delay = remaining if delay is None else min(delay, remaining)
+            
+            for port in list(self._listening - wanted):
+                idle_since = self._idle_since.setdefault(port, now)
+                remaining = self.linger - (now - idle_since)
+                if remaining <= 0:
+                    del self._idle_since[port]
+                    self._unbind(port)
+                else:
+                    delay = remaining if delay is None else min(delay, remaining)
+        return delay
+    
+    def _bind(self, port: int, now: float) -> bool:
+        """创建监听socket并交给代理引擎，需持有锁"""
+        try:
+            sock = create_listener(self.host, port, self.backlog)
+        except Exception as e:
+            self._failed[port] = now
+            logging.error(f"Failed to start proxy server on port {port}: {e}")
+            return False
+        try:
+            self.proxy.add_listener(port, sock)
+        except Exception as e:
+            sock.close()
+            self._failed[port] = now
+            logging.error(f"Failed to start proxy server on port {port}: {e}")
+            return False
+        self._failed.pop(port, None)
+        self._listening.add(port)
+        return True
+    
+    def _unbind(self, port: int):
+        """关闭端口的监听，已建立的连接不受影响；需持有锁"""
+        self._listening.discard(port)
+        try:
+            self.proxy.remove_listener(port)
+        except Exception as e:
+            logging.error(f"Failed to stop proxy server on port {port}: {e}")
+    
+    def _on_registry_event(self, event: tuple):
+        # 在注册表锁内调用；心跳不改变端口集合
+        if event[0] != EVENT_HEARTBEAT:
+            self._wakeup.set()
+    
+    def _run(self, delay: Optional[float] = None):
+        """跟随注册表变化绑定/解绑端口"""
+        while True:
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            try:
+                delay = self.reconcile()
+            except Exception as e:
+                logging.error(f"Listener manager error: {e}")
+                delay = self.RETRY_INTERVAL
\ No newline at end of file
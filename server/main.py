@@ -1,146 +1,322 @@
 #!/usr/bin/env python3
 import logging
-import threading
-import time
-from flask import Flask, request, jsonify
+import socket
+from typing import Dict, List, Optional
+from flask import Flask, Response, request, jsonify
 from .config import ServerConfig
 from .registry import ClientRegistry
 from .proxy import TCPProxy
-from .utils import validate_ipv6
-from common.logger import setup_logger
+from .async_proxy import AsyncTCPProxy
+from .udp_proxy import UDPProxy
+from .pool import UpstreamPoolManager
+from .control import ControlServer
+from .api import ControlAPI
+from .http_server import AsyncHTTPServer
+from .tunnel import TunnelServer
+from .listeners import ListenerManager, LISTENER_LAZY
+from .workers import ProxyWorkerPool
+from .journal import RegistryJournal
+from .balancer import get_balancer
+from .admission import AdmissionController
+from .circuit import CircuitBreaker
+from .lifecycle import LifecycleManager
+from .tuning import SocketTuner
+from .metrics import MetricsRegistry, render_metrics
+from .utils import create_listener, LocalListenerCache
+from common.logger import setup_logger, dropped_records
 
 # 初始化日志
-setup_logger(ServerConfig.LOG_LEVEL, ServerConfig.LOG_FILE)
+setup_logger(
+    ServerConfig.LOG_LEVEL,
+    ServerConfig.LOG_FILE,
+    ServerConfig.LOG_MODE,
+    ServerConfig.LOG_FORMAT,
+    ServerConfig.LOG_CONNECTION_SAMPLE_RATE,
+    ServerConfig.LOG_QUEUE_SIZE
+)
+
+def build_proxy(proxy_registry: ClientRegistry, tunnels: Optional[TunnelServer] = None):
+    """创建代理引擎（含本地监听缓存和预连接池）"""
+    listener_cache = LocalListenerCache(ServerConfig.PROXY_PORTS, ServerConfig.LOCAL_LISTENER_TTL)
+    tuning = SocketTuner(ServerConfig.SOCKET_PROFILE, ServerConfig.PORT_SOCKET_PROFILES)
+    upstream_pool = None
+    if ServerConfig.UPSTREAM_POOL_SIZE > 0:
+        upstream_pool = UpstreamPoolManager(
+            proxy_registry,
+            ServerConfig.UPSTREAM_POOL_SIZE,
+            ServerConfig.UPSTREAM_POOL_MAX_IDLE,
+            ServerConfig.UPSTREAM_POOL_LIVENESS_CHECK,
+            connect_timeout=ServerConfig.UPSTREAM_CONNECT_TIMEOUT,
+            tuning=tuning
+        )
+    balancer = get_balancer(ServerConfig.LOAD_BALANCING)
+    admission = AdmissionController(
+        ServerConfig.MAX_CONNECTIONS,
+        ServerConfig.MAX_CONNECTIONS_PER_PORT,
+        ServerConfig.PORT_CONNECTION_LIMITS,
+        ServerConfig.ADMISSION_QUEUE_SIZE,
+        ServerConfig.ADMISSION_QUEUE_TIMEOUT,
+        ServerConfig.PORT_RATE_LIMIT,
+        ServerConfig.PORT_RATE_BURST,
+        ServerConfig.SOURCE_RATE_LIMIT,
+        ServerConfig.SOURCE_RATE_BURST
+    )
+    options = dict(
+        backlog=ServerConfig.LISTEN_BACKLOG,
+        admission=admission,
+        circuit_breaker=CircuitBreaker(ServerConfig.CIRCUIT_FAILURE_THRESHOLD, ServerConfig.CIRCUIT_COOLDOWN),
+        connect_timeout=ServerConfig.UPSTREAM_CONNECT_TIMEOUT,
+        max_attempts=ServerConfig.UPSTREAM_MAX_ATTEMPTS,
+        tunnels=tunnels,
+        lifecycle=LifecycleManager(ServerConfig.CONNECTION_IDLE_TIMEOUT, ServerConfig.CONNECTION_MAX_LIFETIME),
+        tuning=tuning
+    )
+    if ServerConfig.PROXY_ENGINE == 'asyncio':
+        return AsyncTCPProxy(proxy_registry, ServerConfig.MAX_CONNECTIONS, listener_cache, upstream_pool,
+                             balancer, **options)
+    return TCPProxy(proxy_registry, ServerConfig.MAX_CONNECTIONS, ServerConfig.FORWARD_MODE,
+                    listener_cache, upstream_pool, balancer, **options)
+
+def run_proxy(proxy_engine, sockets: Optional[Dict[int, socket.socket]] = None, ports: Optional[List[int]] = None):
+    """启动代理引擎，可传入已创建的监听socket；ports默认为全部配置端口，为空时由ListenerManager绑定"""
+    sockets = dict(sockets or {})
+    if ports is None:
+        ports = ServerConfig.PROXY_PORTS
+    proxy_engine.listener_cache.start()
+    
+    if isinstance(proxy_engine, AsyncTCPProxy):
+        proxy_engine.start(ports, sockets)
+        logging.info(f"Started async proxy engine for {len(ports)} ports")
+        return
+    
+    # thread引擎：所有端口由一个接受线程服务，每个连接一个处理线程
+    for port in ports:
+        if port in sockets:
+            continue
+        try:
+            sockets[port] = create_listener('0.0.0.0', port, ServerConfig.LISTEN_BACKLOG)
+        except Exception as e:
+            logging.error(f"Failed to start proxy server on port {port}: {e}")
+    proxy_engine.serve(sockets)
+    logging.info(f"Started proxy acceptor for {len(sockets)} ports")
 
 # 初始化组件
 registry = ClientRegistry(ServerConfig.CLIENT_TIMEOUT)
-proxy = TCPProxy(registry, ServerConfig.MAX_CONNECTIONS)
+journal = None
+if ServerConfig.REGISTRY_STATE_DIR:
+    journal = RegistryJournal(
+        registry,
+        ServerConfig.REGISTRY_STATE_DIR,
+        ServerConfig.REGISTRY_SNAPSHOT_INTERVAL,
+        ServerConfig.REGISTRY_JOURNAL_MAX_RECORDS
+    )
+proxy = None
+worker_pool = None
+udp_registry = None
+udp_proxy = None
+tunnel_server = None
+listener_manager = None
+if ServerConfig.TUNNEL_ENABLED:
+    if ServerConfig.PROXY_WORKERS > 0:
+        # 隧道连接只存在于一个进程中，无法被worker进程使用
+        logging.warning("Tunnel mode is not supported with proxy workers, disabled")
+    else:
+        tunnel_server = TunnelServer(ServerConfig.API_KEY, ServerConfig.API_HOST, ServerConfig.TUNNEL_PORT)
+if ServerConfig.PROXY_WORKERS > 0 and ServerConfig.LISTENER_MODE == LISTENER_LAZY:
+    # worker进程的监听socket由主进程在启动worker前创建，无法按需增减
+    logging.warning("Lazy listener mode is not supported with proxy workers, binding all ports")
+if ServerConfig.PROXY_WORKERS > 0:
+    # 多进程模式：代理运行在worker进程中，本进程只负责API和注册表
+    worker_pool = ProxyWorkerPool(
+        registry,
+        ServerConfig.PROXY_WORKERS,
+        ServerConfig.PROXY_PORTS,
+        build_proxy,
+        run_proxy,
+        ServerConfig.CLIENT_TIMEOUT,
+        backlog=ServerConfig.LISTEN_BACKLOG
+    )
+else:
+    proxy = build_proxy(registry, tunnel_server)
+    listener_manager = ListenerManager(
+        registry,
+        proxy,
+        ServerConfig.PROXY_PORTS,
+        ServerConfig.LISTENER_MODE,
+        backlog=ServerConfig.LISTEN_BACKLOG,
+        linger=ServerConfig.LISTENER_LINGER
+    )
+if ServerConfig.UDP_ENABLED:
+    # UDP端口单独注册（上报时protocol为udp），由一个事件循环转发
+    udp_registry = ClientRegistry(ServerConfig.CLIENT_TIMEOUT)
+    udp_proxy = UDPProxy(
+        udp_registry,
+        get_balancer(ServerConfig.LOAD_BALANCING),
+        circuit_breaker=CircuitBreaker(ServerConfig.CIRCUIT_FAILURE_THRESHOLD, ServerConfig.CIRCUIT_COOLDOWN),
+        idle_timeout=ServerConfig.UDP_FLOW_TIMEOUT,
+        max_flows=ServerConfig.UDP_MAX_FLOWS
+    )
+control_server = None
+if ServerConfig.CONTROL_ENABLED:
+    control_server = ControlServer(
+        registry,
+        ServerConfig.API_KEY,
+        ServerConfig.API_HOST,
+        ServerConfig.CONTROL_PORT,
+        ServerConfig.CONTROL_TIMEOUT,
+        port_filter=listener_manager.allows if listener_manager else None
+    )
 
-# Flask应用
-app = Flask(__name__)
+# API进程自身的指标
+api_metrics = MetricsRegistry()
+api_metrics.gauge(
+    'lambdalink_registered_backends',
+    'Registered client backends per proxy port',
+    ('port',),
+    lambda: {(str(port),): len(backends) for port, backends in registry.get_all_clients().items()}
+)
+api_metrics.gauge(
+    'lambdalink_active_connections',
+    'Active proxy connections',
+    (),
+    lambda: {(): worker_pool.active_connections if worker_pool else proxy.active_connections}
+)
+api_metrics.gauge(
+    'lambdalink_log_dropped_records',
+    'Log records dropped because the log queue was full',
+    (),
+    lambda: {(): dropped_records()}
+)
+if listener_manager:
+    api_metrics.gauge(
+        'lambdalink_proxy_listeners',
+        'Proxy ports currently listening',
+        (),
+        lambda: {(): len(listener_manager.ports)}
+    )
+if control_server:
+    api_metrics.gauge(
+        'lambdalink_control_sessions',
+        'Connected control channel sessions',
+        (),
+        lambda: {(): len(control_server.get_sessions())}
+    )
+if tunnel_server:
+    api_metrics.gauge(
+        'lambdalink_tunnel_sessions',
+        'Connected client tunnels',
+        (),
+        lambda: {(): sum(tunnel_server.get_sessions().values())}
+    )
 
-def verify_api_key():
-    """验证API密钥"""
-    api_key = request.headers.get('X-API-Key')
-    if api_key != ServerConfig.API_KEY:
-        return False
-    return True
+def service_status() -> dict:
+    """/api/status中注册表以外的字段"""
+    status = {
+        'proxy_ports': listener_manager.ports if listener_manager else ServerConfig.PROXY_PORTS,
+        'active_connections': worker_pool.active_connections if worker_pool else proxy.active_connections
+    }
+    if worker_pool:
+        status['proxy_workers'] = worker_pool.num_workers
+    if listener_manager:
+        status['listener_mode'] = listener_manager.mode
+    if udp_proxy:
+        status['udp_ports'] = udp_proxy.ports
+        status['active_udp_clients'] = len(udp_registry.get_all_clients())
+        status['udp_flows'] = udp_proxy.active_flows
+    if proxy:
+        status['reaped_sessions'] = dict(proxy.lifecycle.reaped)
+    if proxy and proxy.upstream_pool:
+        status['upstream_pool'] = proxy.upstream_pool.get_stats()
+    if control_server:
+        status['control_sessions'] = len(control_server.get_sessions())
+    if tunnel_server:
+        status['tunnel_sessions'] = sum(tunnel_server.get_sessions().values())
+    return status
 
-@app.route('/api/report', methods=['POST'])
-def report_client():
-    """客户端上报接口"""
-    if not verify_api_key():
-        return jsonify({'error': 'Invalid API key'}), 401
-    
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'Invalid JSON'}), 400
-        
-        ipv6 = data.get('ipv6')
-        port = data.get('port')
-        
-        if not ipv6 or not port:
-            return jsonify({'error': 'Missing ipv6 or port'}), 400
-        
-        if not validate_ipv6(ipv6):
-            return jsonify({'error': 'Invalid IPv6 address'}), 400
-        
-        if not (1 <= port <= 65535):
-            return jsonify({'error': 'Invalid port number'}), 400
-        
-        # 注册客户端
-        success = registry.register_client(port, ipv6)
-        if success:
-            return jsonify({'status': 'registered', 'timestamp': time.time()})
-        else:
-            return jsonify({'error': 'Registration failed'}), 500
-            
-    except Exception as e:
-        logging.error(f"Report error: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+def service_metrics() -> str:
+    """Prometheus指标"""
+    collections = [api_metrics.collect()]
+    if worker_pool:
+        collections.extend(worker_pool.collect_metrics())
+    else:
+        collections.append(proxy.metrics.collect())
+    if udp_proxy:
+        collections.append(udp_proxy.metrics.collect())
+    return render_metrics(collections)
 
-@app.route('/api/heartbeat', methods=['POST'])
-def heartbeat():
-    """心跳接口"""
-    if not verify_api_key():
-        return jsonify({'error': 'Invalid API key'}), 401
-    
-    try:
-        data = request.get_json()
-        port = data.get('port')
-        
-        if not port:
-            return jsonify({'error': 'Missing port'}), 400
-        
-        success = registry.update_heartbeat(port)
-        if success:
-            return jsonify({'status': 'ok', 'timestamp': time.time()})
-        else:
-            return jsonify({'error': 'Client not found'}), 404
-            
-    except Exception as e:
-        logging.error(f"Heartbeat error: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+# 控制面接口（Flask应用和asyncio服务共用）
+api = ControlAPI(
+    registry,
+    ServerConfig.API_KEY,
+    service_status,
+    service_metrics,
+    listener_manager,
+    udp_registry,
+    worker_pool.connection_counts if worker_pool else None
+)
 
-@app.route('/api/clients', methods=['GET'])
-def get_clients():
-    """获取客户端列表"""
-    if not verify_api_key():
-        return jsonify({'error': 'Invalid API key'}), 401
-    
-    try:
-        clients = registry.get_all_clients()
-        result = {}
-        for port, client in clients.items():
-            result[port] = {
-                'ipv6': client.ipv6,
-                'port': client.port,
-                'last_seen': client.last_seen,
-                'connection_count': client.connection_count
-            }
-        return jsonify(result)
-    except Exception as e:
-        logging.error(f"Get clients error: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+# Flask应用
+app = Flask(__name__)
 
-@app.route('/api/status', methods=['GET'])
-def get_status():
-    """获取服务状态"""
+def flask_view(method: str, path: str):
+    """把Flask请求交给ControlAPI处理"""
+    def view():
+        status, result = api.dispatch(method, path, request.headers.get('X-API-Key'), request.get_data())
+        if isinstance(result, str):
+            return Response(result, status=status, mimetype='text/plain; version=0.0.4')
+        return jsonify(result), status
+    return view
+
+for method, path in api.routes:
+    app.add_url_rule(path, f'{method} {path}', flask_view(method, path), methods=[method])
+
+def start_journal():
+    """从快照和日志恢复注册表，并开始记录变更"""
+    if not journal:
+        return
     try:
-        clients = registry.get_all_clients()
-        return jsonify({
-            'status': 'running',
-            'timestamp': time.time(),
-            'active_clients': len(clients),
-            'proxy_ports': ServerConfig.PROXY_PORTS,
-            'active_connections': proxy.active_connections
-        })
+        journal.load()
+        journal.start()
     except Exception as e:
-        logging.error(f"Status error: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        logging.warning(f"Registry persistence disabled: {e}")
 
 def start_proxy_servers():
     """启动所有代理服务器"""
-    for port in ServerConfig.PROXY_PORTS:
-        thread = threading.Thread(
-            target=proxy.start_proxy_server,
-            args=(port,),
-            daemon=True
-        )
-        thread.start()
-        logging.info(f"Started proxy server thread for port {port}")
+    if worker_pool:
+        worker_pool.start()
+    else:
+        # 监听socket由ListenerManager按配置的模式绑定
+        run_proxy(proxy, ports=[])
+        listener_manager.start()
+    if udp_proxy:
+        udp_proxy.start(ServerConfig.UDP_PORTS)
 
 if __name__ == '__main__':
     logging.info("Starting LambdaLink Server v1.0")
     
+    # 恢复注册表（需在启动代理worker之前完成）
+    start_journal()
+    
     # 启动代理服务器
     start_proxy_servers()
     
+    # 启动控制通道
+    if control_server:
+        control_server.start()
+    
+    # 启动隧道服务
+    if tunnel_server:
+        tunnel_server.start()
+    
     # 启动API服务器
-    app.run(
-        host=ServerConfig.API_HOST,
-        port=ServerConfig.API_PORT,
-        debug=False,
-        threaded=True
-    )
\ No newline at end of file
+    if ServerConfig.API_SERVER == 'asyncio':
+        AsyncHTTPServer(api, ServerConfig.API_HOST, ServerConfig.API_PORT, ServerConfig.API_BACKLOG).serve_forever()
+    else:
+        if ServerConfig.API_SERVER != 'flask':
+            logging.warning(f"Unknown API server: {ServerConfig.API_SERVER}, using flask")
+        app.run(
+            host=ServerConfig.API_HOST,
+            port=ServerConfig.API_PORT,
+            debug=False,
+            threaded=True
+        )
\ No newline at end of file
@@ -0,0 +1,436 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# 直方图分桶(秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 14400.0)
+
+# 连接结果
+RESULT_ACCEPTED = 'accepted'
+RESULT_REJECTED = 'rejected'      # 超过最大连接数且等待队列已满
+RESULT_RATE_LIMITED = 'rate_limited'  # 端口或来源IP的新建连接速率超限
+RESULT_QUEUE_TIMEOUT = 'queue_timeout'  # 在等待队列中超时
+RESULT_NO_SERVICE = 'no_service'  # 既没有本地服务也没有注册的客户端
+RESULT_UNAVAILABLE = 'unavailable'  # 端口的所有客户端都处于熔断中
+RESULT_FAILED = 'failed'          # 连接本地服务或客户端失败（已尝试其他客户端）
+
+# 字节方向：in为访问者发往服务，out为服务返回访问者
+DIRECTION_IN = 'in'
+DIRECTION_OUT = 'out'
+
+# 本地服务在client标签中的取值
+LOCAL_CLIENT = 'local'
+
+# 按 (port, client) 统计的进行中会话数
+ACTIVE_SESSIONS = 'lambdalink_proxy_active_sessions'
+
+class _ShardedMetric:
+    """按线程分片的指标：每个线程只写自己的分片，热路径无锁；读取时合并所有分片"""
+    
+    kind = ''
+    # 分片数的初始合并阈值
+    MIN_PRUNE_AT = 64
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        # 已结束线程的分片合并到这里
+        self._retired: dict = {}
+        # 分片数超过该值时在登记新分片时合并已结束线程的分片（每连接一个线程时不依赖抓取来释放）
+        self._prune_at = self.MIN_PRUNE_AT
+        self._lock = threading.Lock()
+    
+    def _shard(self) -> dict:
+        """当前线程的分片，首次使用时登记"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > self._prune_at:
+                    self._retire_dead()
+                    # 按存活分片数放宽阈值，合并的开销分摊到每次登记上
+                    self._prune_at = max(self.MIN_PRUNE_AT, 2 * len(self._shards))
+        return shard
+    
+    def samples(self) -> dict:
+        """合并所有分片，返回 labels -> 值"""
+        with self._lock:
+            self._retire_dead()
+            result = self._merge({}, self._retired)
+            for _, shard in self._shards:
+                self._merge(result, shard)
+        return result
+    
+    def _retire_dead(self):
+        """把已结束线程的分片合并到_retired，需持有锁"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = alive
+    
+    def describe(self) -> dict:
+        return {'type': self.kind, 'help': self.documentation, 'labels': self.labelnames}
+    
+    @staticmethod
+    def _merge(target: dict, source: dict) -> dict:
+        raise NotImplementedError
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+    
+    def inc(self, labels: tuple = (), amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+    
+    @staticmethod
+    def _merge(target: dict, source: dict) -> dict:
+        # list()在C层一次完成，其他线程同时插入新键也不会出错
+        for labels, value in list(source.items()):
+            target[labels] = target.get(labels, 0) + value
+        return target
+
+class Histogram(_ShardedMetric):
+    """直方图，每组标签的值为 [各桶计数..., +Inf桶计数, 总和]"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, labels: tuple, value: float):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+    
+    def describe(self) -> dict:
+        description = super().describe()
+        description['buckets'] = self.buckets
+        return description
+    
+    @staticmethod
+    def _merge(target: dict, source: dict) -> dict:
+        for labels, entry in list(source.items()):
+            current = target.get(labels)
+            if current is None:
+                target[labels] = list(entry)
+            else:
+                for i, value in enumerate(entry):
+                    current[i] += value
+        return target
+
+class Gauge:
+    """读取时通过回调计算的指标，回调返回 labels -> 值"""
+    
+    kind = 'gauge'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[tuple, float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+    
+    def samples(self) -> dict:
+        return dict(self.callback())
+    
+    def describe(self) -> dict:
+        return {'type': self.kind, 'help': self.documentation, 'labels': self.labelnames}
+
+class MetricsRegistry:
+    """一组指标；collect()的结果可跨进程传递并与其他进程的结果合并"""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str],
+              callback: Callable[[], Dict[tuple, float]]) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames, callback))
+    
+    def collect(self) -> Dict[str, dict]:
+        """name -> {type, help, labels, [buckets], samples}"""
+        result = {}
+        for metric in self._metrics:
+            description = metric.describe()
+            description['samples'] = metric.samples()
+            result[metric.name] = description
+        return result
+    
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+class TrafficCounter:
+    """单个连接单方向的字节计数，只由该方向的转发线程写入，无需加锁"""
+    
+    __slots__ = ('value',)
+    
+    def __init__(self):
+        self.value = 0
+
+class ProxySession:
+    """一个正在转发的连接"""
+    
+    __slots__ = ('labels', 'start', 'bytes_in', 'bytes_out')
+    
+    def __init__(self, port: int, client: str):
+        self.labels = (str(port), client)
+        self.start = time.monotonic()
+        self.bytes_in = TrafficCounter()
+        self.bytes_out = TrafficCounter()
+
+class ProxyMetrics:
+    """代理引擎的指标，按代理端口和客户端地址分组"""
+    
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        self.connections = self.registry.counter(
+            'lambdalink_proxy_connections_total',
+            'Proxy connections by result '
+            '(accepted, rejected, rate_limited, queue_timeout, no_service, unavailable, failed)',
+            ('port', 'result')
+        )
+        self.bytes = self.registry.counter(
+            'lambdalink_proxy_bytes_total',
+            'Bytes forwarded (in: visitor to service, out: service to visitor)',
+            ('port', 'client', 'direction')
+        )
+        self.upstream_connect = self.registry.histogram(
+            'lambdalink_proxy_upstream_connect_seconds',
+            'Time to connect to the local service or client',
+            ('port', 'client'),
+            LATENCY_BUCKETS
+        )
+        self.upstream_failures = self.registry.counter(
+            'lambdalink_proxy_upstream_failures_total',
+            'Failed connection attempts to the local service or a client',
+            ('port', 'client')
+        )
+        self.admission_wait = self.registry.histogram(
+            'lambdalink_proxy_admission_wait_seconds',
+            'Time connections spent in the admission queue',
+            ('port',),
+            LATENCY_BUCKETS
+        )
+        self.session_duration = self.registry.histogram(
+            'lambdalink_proxy_session_duration_seconds',
+            'Duration of forwarded sessions',
+            ('port', 'client'),
+            DURATION_BUCKETS
+        )
+        self.reaped = self.registry.counter(
+            'lambdalink_proxy_reaped_sessions_total',
+            'Sessions closed by the reaper (idle: no traffic within the idle timeout, lifetime: max lifetime exceeded)',
+            ('port', 'reason')
+        )
+        self.registry.gauge(
+            ACTIVE_SESSIONS,
+            'Sessions currently being forwarded',
+            ('port', 'client'),
+            self._active_sessions
+        )
+        self._sessions: Set[ProxySession] = set()
+        self._lock = threading.Lock()
+    
+    def connection(self, port: int, result: str):
+        """记录一次连接结果"""
+        self.connections.inc((str(port), result))
+    
+    def connect_time(self, port: int, client: str, seconds: float):
+        """记录一次到上游的连接耗时"""
+        self.upstream_connect.observe((str(port), client), seconds)
+    
+    def upstream_failure(self, port: int, client: str):
+        """记录一次到上游的连接失败"""
+        self.upstream_failures.inc((str(port), client))
+    
+    def queue_time(self, port: int, seconds: float):
+        """记录一次在准入队列中的等待时间"""
+        self.admission_wait.observe((str(port),), seconds)
+    
+    def open_session(self, port: int, client: str) -> ProxySession:
+        """开始转发，返回的会话中的字节计数由转发线程直接累加"""
+        session = ProxySession(port, client)
+        with self._lock:
+            self._sessions.add(session)
+        return session
+    
+    def reaped_session(self, session: ProxySession, reason: str):
+        """记录一个被回收的会话"""
+        self.reaped.inc((session.labels[0], reason))
+    
+    def close_session(self, session: ProxySession):
+        """结束转发，把字节数并入计数器"""
+        with self._lock:
+            self._sessions.discard(session)
+        port, client = session.labels
+        self.bytes.inc((port, client, DIRECTION_IN), session.bytes_in.value)
+        self.bytes.inc((port, client, DIRECTION_OUT), session.bytes_out.value)
+        self.session_duration.observe(session.labels, time.monotonic() - session.start)
+    
+    def collect(self) -> Dict[str, dict]:
+        """收集所有指标，字节计数包含进行中会话已转发的部分"""
+        result = self.registry.collect()
+        samples = result[self.bytes.name]['samples']
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            port, client = session.labels
+            for direction, counter in ((DIRECTION_IN, session.bytes_in), (DIRECTION_OUT, session.bytes_out)):
+                key = (port, client, direction)
+                samples[key] = samples.get(key, 0) + counter.value
+        return result
+    
+    def _active_sessions(self) -> Dict[tuple, float]:
+        counts: Dict[tuple, float] = {}
+        with self._lock:
+            for session in self._sessions:
+                counts[session.labels] = counts.get(session.labels, 0) + 1
+        return counts
+
+class UDPMetrics:
+    """UDP转发引擎的指标；每个流的计数由事件循环累加在流对象上，流结束时并入计数器"""
+    
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        self.flows = self.registry.counter(
+            'lambdalink_udp_flows_total',
+            'UDP flows by result (accepted, no_service, unavailable, rejected)',
+            ('port', 'result')
+        )
+        self.datagrams = self.registry.counter(
+            'lambdalink_udp_datagrams_total',
+            'Datagrams forwarded (in: visitor to service, out: service to visitor)',
+            ('port', 'client', 'direction')
+        )
+        self.bytes = self.registry.counter(
+            'lambdalink_udp_bytes_total',
+            'UDP payload bytes forwarded (in: visitor to service, out: service to visitor)',
+            ('port', 'client', 'direction')
+        )
+        self.dropped = self.registry.counter(
+            'lambdalink_udp_dropped_datagrams_total',
+            'Datagrams dropped (no_service, overflow, send_error, refused)',
+            ('port', 'reason')
+        )
+        self.registry.gauge(
+            'lambdalink_udp_active_flows',
+            'UDP flows in the flow table',
+            ('port', 'client'),
+            self._active_flows
+        )
+        # 返回当前所有流的回调，由UDP引擎设置
+        self.live_flows: Callable[[], Iterable] = list
+    
+    def flow(self, port: int, result: str):
+        """记录一次新建流的结果"""
+        self.flows.inc((str(port), result))
+    
+    def drop(self, port: int, reason: str):
+        """记录一个被丢弃的数据报"""
+        self.dropped.inc((str(port), reason))
+    
+    def close_flow(self, flow):
+        """流被淘汰，把计数并入计数器"""
+        port, client = flow.labels
+        self.datagrams.inc((port, client, DIRECTION_IN), flow.datagrams_in)
+        self.datagrams.inc((port, client, DIRECTION_OUT), flow.datagrams_out)
+        self.bytes.inc((port, client, DIRECTION_IN), flow.bytes_in)
+        self.bytes.inc((port, client, DIRECTION_OUT), flow.bytes_out)
+    
+    def collect(self) -> Dict[str, dict]:
+        """收集所有指标，计数包含仍在流表中的流"""
+        result = self.registry.collect()
+        datagrams = result[self.datagrams.name]['samples']
+        traffic = result[self.bytes.name]['samples']
+        for flow in self.live_flows():
+            port, client = flow.labels
+            for direction, count, size in ((DIRECTION_IN, flow.datagrams_in, flow.bytes_in),
+                                           (DIRECTION_OUT, flow.datagrams_out, flow.bytes_out)):
+                key = (port, client, direction)
+                datagrams[key] = datagrams.get(key, 0) + count
+                traffic[key] = traffic.get(key, 0) + size
+        return result
+    
+    def _active_flows(self) -> Dict[tuple, float]:
+        counts: Dict[tuple, float] = {}
+        for flow in self.live_flows():
+            counts[flow.labels] = counts.get(flow.labels, 0) + 1
+        return counts
+
+def merge_metrics(collections: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+    """合并多个collect()结果（例如多个worker进程），同名指标的样本相加"""
+    merged: Dict[str, dict] = {}
+    for collection in collections:
+        for name, metric in collection.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(metric, samples={})
+            samples = target['samples']
+            for labels, value in metric['samples'].items():
+                current = samples.get(labels)
+                if current is None:
+                    samples[labels] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    for i, item in enumerate(value):
+                        current[i] += item
+                else:
+                    samples[labels] = current + value
+    return merged
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def render_metrics(collections: Iterable[Dict[str, dict]]) -> str:
+    """以Prometheus文本格式输出"""
+    lines = []
+    for name, metric in merge_metrics(collections).items():
+        labelnames = metric['labels']
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric['samples'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
\ No newline at end of file
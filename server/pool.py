@@ -0,0 +1,189 @@
+import socket
+import threading
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from .registry import ClientRegistry
+from .tuning import SocketTuner
+
+class UpstreamPool:
+    """单个客户端地址的预连接池"""
+
+    def __init__(self, ipv6: str, port: int, size: int, max_idle: float,
+                 liveness_check: bool = True, connect_timeout: float = 10,
+                 tuning: Optional[SocketTuner] = None):
+        self.ipv6 = ipv6
+        self.port = port
+        self.size = size
+        self.max_idle = max_idle
+        self.liveness_check = liveness_check
+        self.connect_timeout = connect_timeout
+        self.tuning = tuning
+        self.hits = 0
+        self.misses = 0
+        self._idle: Deque[Tuple[socket.socket, float]] = deque()
+        self._lock = threading.Lock()
+        self._filling = False
+        self._closed = False
+
+    def checkout(self) -> Optional[socket.socket]:
+        """取出一个可用的预连接socket，没有时返回None；取出后异步补充"""
+        sock = None
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                candidate, created = self._idle.popleft()
+                if now - created < self.max_idle and self._is_alive(candidate):
+                    sock = candidate
+                    break
+                self._close(candidate)
+            if sock:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        self.replenish()
+        return sock
+
+    def replenish(self):
+        """后台补满连接池"""
+        with self._lock:
+            if self._filling or self._closed or len(self._idle) >= self.size:
+                return
+            self._filling = True
+        thread = threading.Thread(target=self._fill, daemon=True)
+        thread.start()
+
+    def evict_stale(self):
+        """丢弃超过最大空闲时间或已断开的连接"""
+        now = time.monotonic()
+        with self._lock:
+            alive = deque()
+            for sock, created in self._idle:
+                if now - created < self.max_idle and self._is_alive(sock):
+                    alive.append((sock, created))
+                else:
+                    self._close(sock)
+            self._idle = alive
+
+    def close(self):
+        """关闭连接池"""
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._close(self._idle.popleft()[0])
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    def _fill(self):
+        """建立连接直到池满"""
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or len(self._idle) >= self.size:
+                        return
+                sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+                try:
+                    if self.tuning:
+                        # 预连接建立后不会立即发送数据，不使用TFO
+                        self.tuning.tune_upstream(sock, self.port, fastopen_connect=False)
+                    sock.settimeout(self.connect_timeout)
+                    sock.connect((self.ipv6, self.port))
+                    sock.settimeout(None)
+                except Exception as e:
+                    sock.close()
+                    logging.debug(f"Failed to pre-connect to [{self.ipv6}]:{self.port}: {e}")
+                    return
+                with self._lock:
+                    if self._closed:
+                        sock.close()
+                        return
+                    self._idle.append((sock, time.monotonic()))
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def _is_alive(self, sock: socket.socket) -> bool:
+        """非阻塞窥探socket：对端已关闭时recv返回空"""
+        if not self.liveness_check:
+            return True
+        try:
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(sock: socket.socket):
+        try:
+            sock.close()
+        except:
+            pass
+
+class UpstreamPoolManager:
+    """按客户端地址管理预连接池"""
+
+    def __init__(self, registry: ClientRegistry, size: int, max_idle: float = 30,
+                 liveness_check: bool = True, maintenance_interval: float = 5,
+                 connect_timeout: float = 10, tuning: Optional[SocketTuner] = None):
+        self.registry = registry
+        self.size = size
+        self.max_idle = max_idle
+        self.liveness_check = liveness_check
+        self.connect_timeout = connect_timeout
+        self.tuning = tuning
+        self.maintenance_interval = maintenance_interval
+        self._pools: Dict[Tuple[str, int], UpstreamPool] = {}
+        self._lock = threading.Lock()
+        # 已关闭连接池的累计命中数
+        self._retired_hits = 0
+        self._retired_misses = 0
+        self._maintenance_thread = threading.Thread(target=self._maintenance_loop, daemon=True)
+        self._maintenance_thread.start()
+
+    def acquire(self, ipv6: str, port: int) -> Optional[socket.socket]:
+        """获取到客户端的预连接socket，未命中返回None"""
+        key = (ipv6, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = UpstreamPool(ipv6, port, self.size, self.max_idle, self.liveness_check,
+                                        self.connect_timeout, self.tuning)
+                    self._pools[key] = pool
+        return pool.checkout()
+
+    def get_stats(self) -> Dict[str, int]:
+        """连接池命中统计"""
+        pools = list(self._pools.values())
+        return {
+            'pools': len(pools),
+            'idle': sum(pool.idle_count for pool in pools),
+            'hits': self._retired_hits + sum(pool.hits for pool in pools),
+            'misses': self._retired_misses + sum(pool.misses for pool in pools)
+        }
+
+    def _maintenance_loop(self):
+        """定期清理过期连接、补充连接，并关闭已注销客户端的连接池"""
+        while True:
+            try:
+                time.sleep(self.maintenance_interval)
+                for key, pool in list(self._pools.items()):
+                    ipv6, port = key
+                    if not self.registry.get_backend(port, ipv6):
+                        with self._lock:
+                            self._pools.pop(key, None)
+                            self._retired_hits += pool.hits
+                            self._retired_misses += pool.misses
+                        pool.close()
+                        logging.debug(f"Closed upstream pool for [{ipv6}]:{port}")
+                        continue
+                    pool.evict_stale()
+                    pool.replenish()
+            except Exception as e:
+                logging.error(f"Upstream pool maintenance error: {e}")
\ No newline at end of file
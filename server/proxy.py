@@ -2,125 +2,300 @@ import socket
 import threading
 import logging
 import time
-from typing import Optional
+from typing import Dict, Optional
+from common.logger import CONNECTION_LOGGER
 from .registry import ClientRegistry, ClientInfo
-from .utils import is_port_listening
+from .utils import LocalListenerCache, create_listener, raise_nofile_limit
+from .acceptor import Acceptor
+from .forwarding import BufferPool, get_forwarder, FORWARD_COPY
+from .pool import UpstreamPoolManager
+from .balancer import Balancer, LeastConnectionsBalancer
+from .admission import AdmissionController, Waiter
+from .circuit import CircuitBreaker
+from .tunnel import TunnelServer
+from .lifecycle import LifecycleManager
+from .tuning import SocketTuner
+from .metrics import (
+    ProxyMetrics, ProxySession, LOCAL_CLIENT, RESULT_ACCEPTED, RESULT_RATE_LIMITED,
+    RESULT_QUEUE_TIMEOUT, RESULT_NO_SERVICE, RESULT_UNAVAILABLE, RESULT_FAILED
+)
+
+# 每个连接的日志，参数在写入线程中才格式化，可通过LOG_CONNECTION_SAMPLE_RATE采样
+connection_log = logging.getLogger(CONNECTION_LOGGER)
 
 class TCPProxy:
-    def __init__(self, registry: ClientRegistry, max_connections: int = 1000):
+    def __init__(self, registry: ClientRegistry, max_connections: int = 1000,
+                 forward_mode: str = FORWARD_COPY,
+                 listener_cache: Optional[LocalListenerCache] = None,
+                 upstream_pool: Optional[UpstreamPoolManager] = None,
+                 balancer: Optional[Balancer] = None,
+                 metrics: Optional[ProxyMetrics] = None,
+                 backlog: int = 4096,
+                 admission: Optional[AdmissionController] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 connect_timeout: float = 5,
+                 max_attempts: int = 3,
+                 tunnels: Optional[TunnelServer] = None,
+                 lifecycle: Optional[LifecycleManager] = None,
+                 tuning: Optional[SocketTuner] = None):
         self.registry = registry
-        self.max_connections = max_connections
-        self.active_connections = 0
-        self._lock = threading.Lock()
-        
-    def start_proxy_server(self, port: int):
-        """启动指定端口的代理服务"""
+        self.listener_cache = listener_cache or LocalListenerCache()
+        self.upstream_pool = upstream_pool
+        self.balancer = balancer or LeastConnectionsBalancer()
+        self.metrics = metrics or ProxyMetrics()
+        self.admission = admission or AdmissionController(max_connections)
+        self.max_connections = self.admission.max_connections
+        self.backlog = backlog
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # 连接本地服务/客户端的超时，以及每个连接最多尝试的客户端数
+        self.connect_timeout = connect_timeout
+        self.max_attempts = max_attempts
+        # 客户端隧道，有隧道的客户端优先通过隧道转发
+        self.tunnels = tunnels
+        # 空闲超时和最长存活时间，回收卡住的会话
+        self.lifecycle = lifecycle or LifecycleManager()
+        self.lifecycle.on_reap = self.metrics.reaped_session
+        # 按端口的socket选项（TCP_NODELAY、keepalive、缓冲区、TFO等）
+        self.tuning = tuning or SocketTuner()
+        self.acceptor: Optional[Acceptor] = None
+        self._buffer_pool = BufferPool()
+        self._forwarder = get_forwarder(forward_mode, self._buffer_pool)
+    
+    @property
+    def active_connections(self) -> int:
+        return self.admission.active
+    
+    def serve(self, sockets: Dict[int, socket.socket]):
+        """由单个接受线程服务所有端口的监听socket"""
+        raise_nofile_limit()
+        if self.acceptor is None:
+            self.acceptor = Acceptor(self.handle_accepted)
+            self.acceptor.start()
+        for port, server_socket in sockets.items():
+            self.add_listener(port, server_socket)
+    
+    def add_listener(self, port: int, server_socket: socket.socket):
+        """把监听socket加入接受线程"""
+        self.listener_cache.ignore_socket(server_socket)
+        self.tuning.tune_listener(server_socket, port)
+        self.acceptor.add(port, server_socket)
+    
+    def remove_listener(self, port: int) -> bool:
+        """停止接受该端口的连接，已建立的连接不受影响"""
+        return self.acceptor is not None and self.acceptor.remove(port)
+    
+    def start_proxy_server(self, port: int, server_socket: Optional[socket.socket] = None):
+        """以独立线程阻塞accept指定端口（单端口场景），可传入已创建的监听socket"""
         try:
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.bind(('0.0.0.0', port))
-            server_socket.listen(10)
+            if server_socket is None:
+                server_socket = create_listener('0.0.0.0', port, self.backlog)
+            self.listener_cache.ignore_socket(server_socket)
+            self.tuning.tune_listener(server_socket, port)
             
             logging.info(f"Proxy server started on port {port}")
             
             while True:
                 try:
                     client_socket, client_addr = server_socket.accept()
-                    
-                    with self._lock:
-                        if self.active_connections >= self.max_connections:
-                            client_socket.close()
-                            logging.warning(f"Max connections reached, rejected {client_addr}")
-                            continue
-                        self.active_connections += 1
-                    
-                    # 创建处理线程
-                    thread = threading.Thread(
-                        target=self._handle_connection,
-                        args=(client_socket, port, client_addr),
-                        daemon=True
-                    )
-                    thread.start()
-                    
+                    self.handle_accepted(client_socket, client_addr, port)
                 except Exception as e:
                     logging.error(f"Error accepting connection on port {port}: {e}")
                     
         except Exception as e:
             logging.error(f"Failed to start proxy server on port {port}: {e}")
     
-    def _handle_connection(self, client_socket: socket.socket, port: int, client_addr):
+    def handle_accepted(self, client_socket: socket.socket, client_addr, port: int):
+        """准入检查后为新连接创建处理线程，排队的连接在处理线程中等待"""
+        granted = threading.Event()
+        result, waiter = self.admission.admit(port, client_addr[0], granted.set)
+        if waiter is None:
+            if result != RESULT_ACCEPTED:
+                self._reject(client_socket, client_addr, port, result)
+                return
+            self.metrics.connection(port, RESULT_ACCEPTED)
+        
+        # 创建处理线程
+        thread = threading.Thread(
+            target=self._handle_connection,
+            args=(client_socket, port, client_addr, waiter, granted),
+            daemon=True
+        )
+        thread.start()
+    
+    def _wait_admission(self, waiter: Waiter, granted: threading.Event) -> bool:
+        """在等待队列中等待名额"""
+        start = time.monotonic()
+        granted.wait(self.admission.queue_timeout)
+        admitted = self.admission.finish_wait(waiter)
+        self.metrics.queue_time(waiter.port, time.monotonic() - start)
+        return admitted
+    
+    def _reject(self, client_socket: socket.socket, client_addr, port: int, result: str):
+        """关闭未通过准入检查的连接"""
+        client_socket.close()
+        self.metrics.connection(port, result)
+        if result == RESULT_RATE_LIMITED:
+            # 滥用的来源可能产生大量拒绝，不逐条告警
+            connection_log.debug('Rate limit exceeded on port %s, rejected %s', port, client_addr,
+                                 extra={'port': port, 'peer': client_addr, 'result': result})
+        else:
+            connection_log.warning('Max connections reached on port %s, rejected %s (%s)', port, client_addr, result,
+                                   extra={'port': port, 'peer': client_addr, 'result': result})
+    
+    def _handle_connection(self, client_socket: socket.socket, port: int, client_addr,
+                           waiter: Optional[Waiter] = None, granted: Optional[threading.Event] = None):
         """处理单个连接"""
+        if waiter is not None:
+            if not self._wait_admission(waiter, granted):
+                self._reject(client_socket, client_addr, port, RESULT_QUEUE_TIMEOUT)
+                return
+            self.metrics.connection(port, RESULT_ACCEPTED)
+        
         try:
             # 检查是否有本地服务
-            if is_port_listening(port):
-                logging.info(f"Forwarding to local service: {client_addr} -> 127.0.0.1:{port}")
+            if self.listener_cache.is_listening(port):
+                connection_log.info('Forwarding to local service: %s -> 127.0.0.1:%s', client_addr, port,
+                                    extra={'port': port, 'peer': client_addr, 'backend': LOCAL_CLIENT})
                 self._forward_to_local(client_socket, port)
             else:
-                # 查找客户端
-                client_info = self.registry.get_client(port)
-                if client_info:
-                    logging.info(f"Forwarding to client: {client_addr} -> [{client_info.ipv6}]:{port}")
-                    self._forward_to_client(client_socket, client_info)
-                else:
-                    logging.warning(f"No service found for port {port}, closing connection from {client_addr}")
-                    client_socket.close()
+                self._forward_to_backends(client_socket, port, client_addr)
                     
         except Exception as e:
             logging.error(f"Error handling connection: {e}")
         finally:
-            with self._lock:
-                self.active_connections -= 1
+            self.admission.release(port)
     
     def _forward_to_local(self, client_socket: socket.socket, port: int):
         """转发到本地服务"""
+        target_socket = None
         try:
-            target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            target_socket.connect(('127.0.0.1', port))
+            start = time.monotonic()
+            target_socket = self._connect_upstream(socket.AF_INET, ('127.0.0.1', port), port)
+            self.metrics.connect_time(port, LOCAL_CLIENT, time.monotonic() - start)
             
             # 启动双向转发
-            self._start_forwarding(client_socket, target_socket)
+            self._start_forwarding(client_socket, target_socket, self.metrics.open_session(port, LOCAL_CLIENT))
             
         except Exception as e:
             logging.error(f"Failed to connect to local service on port {port}: {e}")
+            if target_socket is not None:
+                target_socket.close()
+            self.metrics.upstream_failure(port, LOCAL_CLIENT)
+            self.metrics.connection(port, RESULT_FAILED)
+            self.listener_cache.invalidate(port)
             client_socket.close()
     
-    def _forward_to_client(self, client_socket: socket.socket, client_info: ClientInfo):
-        """转发到客户端"""
+    def _forward_to_backends(self, client_socket: socket.socket, port: int, client_addr):
+        """在端口的后端中选择一个转发，连接失败时换其他后端；所有后端都熔断时立即关闭"""
+        backends = self.registry.get_backends(port)
+        if not backends:
+            connection_log.warning('No service found for port %s, closing connection from %s', port, client_addr,
+                                   extra={'port': port, 'peer': client_addr, 'result': RESULT_NO_SERVICE})
+            self.metrics.connection(port, RESULT_NO_SERVICE)
+            client_socket.close()
+            return
+        
+        tried = set()
+        failed = False
+        for _ in range(self.max_attempts):
+            candidates = [b for b in self.circuit_breaker.available(backends) if b.ipv6 not in tried]
+            client_info = self.balancer.acquire(port, candidates)
+            if client_info is None:
+                break
+            tried.add(client_info.ipv6)
+            try:
+                if not self.circuit_breaker.allow(client_info):
+                    continue
+                target_socket = self._connect_client(client_info)
+                if target_socket is None:
+                    failed = True
+                    continue
+                connection_log.info('Forwarding to client: %s -> [%s]:%s', client_addr, client_info.ipv6, port,
+                                    extra={'port': port, 'peer': client_addr, 'backend': client_info.ipv6})
+                session = self.metrics.open_session(port, client_info.ipv6)
+                self._start_forwarding(client_socket, target_socket, session)
+                return
+            finally:
+                self.balancer.release(client_info)
+        
+        result = RESULT_FAILED if failed else RESULT_UNAVAILABLE
+        connection_log.warning('No reachable client for port %s, closing connection from %s', port, client_addr,
+                               extra={'port': port, 'peer': client_addr, 'result': result})
+        self.metrics.connection(port, result)
+        client_socket.close()
+    
+    def _connect_client(self, client_info: ClientInfo) -> Optional[socket.socket]:
+        """连接客户端（优先使用隧道，其次是预连接池），结果计入熔断器，失败返回None"""
+        target_socket = None
         try:
-            target_socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-            target_socket.connect((client_info.ipv6, client_info.port))
-            
-            # 启动双向转发
-            self._start_forwarding(client_socket, target_socket)
-            
+            if self.tunnels:
+                # 等待客户端确认连接到本地服务，失败时与直连失败一样计入熔断器并换其他客户端
+                target_socket = self.tunnels.connect_stream(client_info.ipv6, client_info.port, self.connect_timeout)
+            if target_socket is None and self.upstream_pool:
+                target_socket = self.upstream_pool.acquire(client_info.ipv6, client_info.port)
+            if target_socket is None:
+                start = time.monotonic()
+                target_socket = self._connect_upstream(socket.AF_INET6, (client_info.ipv6, client_info.port),
+                                                       client_info.port)
+                self.metrics.connect_time(client_info.port, client_info.ipv6, time.monotonic() - start)
         except Exception as e:
             logging.error(f"Failed to connect to client [{client_info.ipv6}]:{client_info.port}: {e}")
-            client_socket.close()
+            if target_socket is not None:
+                target_socket.close()
+            self.metrics.upstream_failure(client_info.port, client_info.ipv6)
+            self.circuit_breaker.record_failure(client_info)
+            return None
+        self.circuit_breaker.record_success(client_info)
+        return target_socket
     
-    def _start_forwarding(self, sock1: socket.socket, sock2: socket.socket):
-        """启动双向数据转发"""
-        def forward(src: socket.socket, dst: socket.socket):
-            try:
-                while True:
-                    data = src.recv(4096)
-                    if not data:
-                        break
-                    dst.sendall(data)
-            except Exception as e:
-                logging.debug(f"Forwarding ended: {e}")
-            finally:
+    def _connect_upstream(self, family: int, address: tuple, port: int) -> socket.socket:
+        """按端口的调优配置创建socket并连接，失败时关闭socket并抛出异常"""
+        target_socket = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self.tuning.tune_upstream(target_socket, port)
+            target_socket.settimeout(self.connect_timeout)
+            target_socket.connect(address)
+            target_socket.settimeout(None)
+        except Exception:
+            target_socket.close()
+            raise
+        return target_socket
+    
+    def _start_forwarding(self, sock1: socket.socket, sock2: socket.socket, session: ProxySession):
+        """启动双向数据转发，sock1为访问者一侧
+        
+        一个方向读到EOF时只向另一侧传递shutdown(SHUT_WR)，另一方向继续转发（半关闭）；
+        出错或被回收时关闭两侧的读写，两个方向都结束后才关闭socket。
+        """
+        def abort():
+            for sock in (sock1, sock2):
                 try:
-                    src.close()
-                    dst.close()
-                except:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
                     pass
         
+        def forward(src: socket.socket, dst: socket.socket, counter):
+            try:
+                self._forwarder(src, dst, counter)
+                dst.shutdown(socket.SHUT_WR)
+            except Exception as e:
+                connection_log.debug('Forwarding ended: %s', e)
+                abort()
+        
+        self.lifecycle.track(session, abort)
+        
         # 启动两个转发线程
-        t1 = threading.Thread(target=forward, args=(sock1, sock2), daemon=True)
-        t2 = threading.Thread(target=forward, args=(sock2, sock1), daemon=True)
+        t1 = threading.Thread(target=forward, args=(sock1, sock2, session.bytes_in), daemon=True)
+        t2 = threading.Thread(target=forward, args=(sock2, sock1, session.bytes_out), daemon=True)
         
         t1.start()
         t2.start()
         
-        t1.join()
-        t2.join()
\ No newline at end of file
+        try:
+            t1.join()
+            t2.join()
+        finally:
+            self.lifecycle.untrack(session)
+            sock1.close()
+            sock2.close()
+            self.metrics.close_session(session)
\ No newline at end of file
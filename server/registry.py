@@ -1,84 +1,321 @@
 import time
+import heapq
+import itertools
 import threading
-from typing import Dict, Tuple, Optional
+from typing import Callable, Dict, Tuple, Optional, List, Mapping
 from dataclasses import dataclass
 import logging
 
+# 注册表变更事件，用于多进程副本同步等
+EVENT_REGISTER = 'register'      # (EVENT_REGISTER, ipv6, ports, last_seen, weight)
+EVENT_HEARTBEAT = 'heartbeat'    # (EVENT_HEARTBEAT, ports, last_seen, ipv6)，ipv6为None表示端口的所有后端
+EVENT_UNREGISTER = 'unregister'  # (EVENT_UNREGISTER, ipv6, ports)
+EVENT_EXPIRE = 'expire'          # (EVENT_EXPIRE, [(port, ipv6), ...])
+EVENT_RESTORE = 'restore'        # (EVENT_RESTORE, [(port, ipv6, last_seen, weight), ...])
+
 @dataclass
 class ClientInfo:
     ipv6: str
     port: int
     last_seen: float
     connection_count: int = 0
+    weight: int = 1
+    # 熔断状态（见circuit.CircuitBreaker）：连续连接失败次数、熔断结束时间(monotonic)、是否有探测连接
+    failures: int = 0
+    circuit_open_until: float = 0.0
+    circuit_probing: bool = False
 
 class ClientRegistry:
+    """客户端注册表，同一端口可由多个客户端（按IPv6地址区分）共同提供服务"""
+    
+    # 清理线程的最长休眠时间
+    MAX_CLEANUP_INTERVAL = 60
+    
     def __init__(self, timeout: int = 300):
-        self._clients: Dict[int, ClientInfo] = {}
+        # port -> {ipv6: ClientInfo}
+        self._clients: Dict[int, Dict[str, ClientInfo]] = {}
         self._lock = threading.RLock()
         self._timeout = timeout
+        # 过期最小堆: (到期时间, 序号, 端口, 客户端)
+        # 心跳只更新last_seen(O(1))，到期出堆时若已续期再按真实到期时间重新入堆
+        self._expiry: List[Tuple[float, int, int, ClientInfo]] = []
+        self._sequence = itertools.count()
+        # 只读路由快照 port -> (ClientInfo, ...)：写操作在锁内修改_clients后整体替换，读操作无需加锁
+        # 心跳只修改ClientInfo.last_seen，快照与_clients共享同一对象，无需重新发布
+        # _routes为增量维护的后端元组，发布时只需浅拷贝
+        self._routes: Dict[int, Tuple[ClientInfo, ...]] = {}
+        self._snapshot: Mapping[int, Tuple[ClientInfo, ...]] = {}
+        # 变更事件订阅者，在锁内按顺序调用，回调必须快速返回
+        self._listeners: List[Callable[[tuple], None]] = []
+        self._wakeup = threading.Event()
         self._cleanup_thread = threading.Thread(target=self._cleanup_expired, daemon=True)
         self._cleanup_thread.start()
-        
-    def register_client(self, port: int, ipv6: str) -> bool:
-        """注册客户端"""
+    
+    def register_client(self, port: int, ipv6: str, weight: int = 1) -> bool:
+        """注册客户端（作为该端口的一个后端）"""
         try:
             with self._lock:
-                self._clients[port] = ClientInfo(
-                    ipv6=ipv6,
-                    port=port,
-                    last_seen=time.time()
-                )
+                now = time.time()
+                self._add_client(port, ipv6, now, weight)
+                self._publish()
+                self._emit((EVENT_REGISTER, ipv6, [port], now, weight))
                 logging.info(f"Client registered: port={port}, ipv6={ipv6}")
                 return True
         except Exception as e:
             logging.error(f"Failed to register client: {e}")
             return False
     
-    def get_client(self, port: int) -> Optional[ClientInfo]:
-        """获取客户端信息"""
-        with self._lock:
-            client = self._clients.get(port)
-            if client and time.time() - client.last_seen < self._timeout:
-                return client
-            elif client:
-                # 客户端已过期
-                del self._clients[port]
-                logging.info(f"Client expired: port={port}")
-            return None
-    
-    def update_heartbeat(self, port: int) -> bool:
-        """更新客户端心跳"""
-        with self._lock:
-            if port in self._clients:
-                self._clients[port].last_seen = time.time()
+    def register_clients(self, ports: List[int], ipv6: str, weight: int = 1) -> bool:
+        """批量注册同一客户端的多个端口（一次加锁）"""
+        try:
+            with self._lock:
+                now = time.time()
+                for port in ports:
+                    self._add_client(port, ipv6, now, weight)
+                self._publish()
+                self._emit((EVENT_REGISTER, ipv6, list(ports), now, weight))
+                logging.info(f"Client registered: ports={ports}, ipv6={ipv6}")
                 return True
+        except Exception as e:
+            logging.error(f"Failed to register client: {e}")
             return False
     
-    def get_all_clients(self) -> Dict[int, ClientInfo]:
-        """获取所有活跃客户端"""
+    def get_client(self, port: int) -> Optional[ClientInfo]:
+        """获取端口的第一个有效后端（读取快照，不加锁）"""
+        backends = self.get_backends(port)
+        return backends[0] if backends else None
+    
+    def get_backends(self, port: int) -> Tuple[ClientInfo, ...]:
+        """获取端口的所有有效后端（读取快照，不加锁）"""
+        backends = self._snapshot.get(port, ())
+        # 过期记录由清理线程按到期时间删除，这里只过滤
+        now = time.time()
+        for client in backends:
+            if now - client.last_seen >= self._timeout:
+                return tuple(client for client in backends if now - client.last_seen < self._timeout)
+        return backends
+    
+    def get_backend(self, port: int, ipv6: str) -> Optional[ClientInfo]:
+        """获取端口上指定地址的后端"""
+        for client in self.get_backends(port):
+            if client.ipv6 == ipv6:
+                return client
+        return None
+    
+    def update_heartbeat(self, port: int, ipv6: Optional[str] = None) -> bool:
+        """更新客户端心跳，未指定ipv6时更新该端口的所有后端"""
+        return not self.update_heartbeats([port], ipv6)
+    
+    def update_heartbeats(self, ports: List[int], ipv6: Optional[str] = None) -> List[int]:
+        """批量更新心跳（一次加锁），返回未注册的端口"""
+        missing = []
         with self._lock:
             now = time.time()
-            active_clients = {}
-            for port, client in self._clients.items():
-                if now - client.last_seen < self._timeout:
-                    active_clients[port] = client
-            return active_clients
+            for port in ports:
+                if not self._touch(port, ipv6, now):
+                    missing.append(port)
+            if self._listeners and len(missing) < len(ports):
+                self._emit((EVENT_HEARTBEAT, [port for port in ports if port not in missing], now, ipv6))
+        return missing
+    
+    def unregister_clients(self, ports: List[int], ipv6: str) -> int:
+        """注销客户端端口（仅删除仍指向该地址的记录），返回删除数量"""
+        with self._lock:
+            removed = self._remove_clients(ports, ipv6)
+            if removed:
+                self._emit((EVENT_UNREGISTER, ipv6, removed))
+        if removed:
+            logging.info(f"Client unregistered: ports={removed}, ipv6={ipv6}")
+        return len(removed)
+    
+    def get_all_clients(self) -> Mapping[int, Tuple[ClientInfo, ...]]:
+        """获取所有端口及其后端（返回只读快照，不加锁）"""
+        return self._snapshot
+    
+    def subscribe(self, callback: Callable[[tuple], None], replay: bool = False):
+        """订阅变更事件；replay时先在同一锁内推送当前状态，保证不会漏掉事件"""
+        with self._lock:
+            if replay:
+                for event in self.snapshot_events():
+                    callback(event)
+            self._listeners.append(callback)
+    
+    def unsubscribe(self, callback: Callable[[tuple], None]):
+        """取消订阅"""
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+    
+    def snapshot_events(self) -> List[tuple]:
+        """把当前所有记录表示为一个批量恢复事件"""
+        with self._lock:
+            return [(EVENT_RESTORE, self.export_clients())]
+    
+    def export_clients(self) -> List[Tuple[int, str, float, int]]:
+        """导出所有记录: [(port, ipv6, last_seen, weight), ...]"""
+        with self._lock:
+            return [
+                (port, client.ipv6, client.last_seen, client.weight)
+                for port, backends in self._clients.items()
+                for client in backends.values()
+            ]
+    
+    def restore_clients(self, entries: List[Tuple[int, str, float, int]]):
+        """批量恢复记录（保留原last_seen，已过期的记录由清理线程删除），只发布一次快照"""
+        self.apply_event((EVENT_RESTORE, [tuple(entry) for entry in entries]))
+    
+    def apply_event(self, event: tuple):
+        """应用其他注册表产生的变更事件（多进程副本同步、状态恢复）"""
+        kind = event[0]
+        with self._lock:
+            if kind == EVENT_REGISTER:
+                _, ipv6, ports, last_seen, weight = event
+                for port in ports:
+                    self._add_client(port, ipv6, last_seen, weight)
+                self._publish()
+            elif kind == EVENT_RESTORE:
+                _, entries = event
+                # 大批量恢复时整体建堆(O(n))，避免逐条入堆
+                for port, ipv6, last_seen, weight in entries:
+                    client = ClientInfo(ipv6=ipv6, port=port, last_seen=last_seen, weight=weight)
+                    self._clients.setdefault(port, {})[ipv6] = client
+                    self._expiry.append((last_seen + self._timeout, next(self._sequence), port, client))
+                for port in {entry[0] for entry in entries}:
+                    self._update_route(port)
+                heapq.heapify(self._expiry)
+                self._wakeup.set()
+                self._publish()
+            elif kind == EVENT_HEARTBEAT:
+                _, ports, last_seen, ipv6 = event
+                for port in ports:
+                    self._touch(port, ipv6, last_seen)
+            elif kind == EVENT_UNREGISTER:
+                _, ipv6, ports = event
+                self._remove_clients(ports, ipv6)
+            elif kind == EVENT_EXPIRE:
+                _, backends = event
+                for port, ipv6 in backends:
+                    self._discard(port, ipv6)
+                self._publish()
+            else:
+                logging.warning(f"Unknown registry event: {kind}")
+                return
+            self._emit(event)
+    
+    def _emit(self, event: tuple):
+        """通知订阅者，需持有锁"""
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logging.error(f"Registry listener error: {e}")
+    
+    def _remove_clients(self, ports: List[int], ipv6: str) -> List[int]:
+        """删除各端口上该地址的后端并发布快照，需持有锁"""
+        removed = [port for port in ports if self._discard(port, ipv6)]
+        if removed:
+            self._publish()
+        return removed
+    
+    def _discard(self, port: int, ipv6: str) -> bool:
+        """删除单个后端，需持有锁，调用方负责发布快照"""
+        backends = self._clients.get(port)
+        if not backends or ipv6 not in backends:
+            return False
+        del backends[ipv6]
+        if not backends:
+            del self._clients[port]
+        self._update_route(port)
+        return True
+    
+    def _touch(self, port: int, ipv6: Optional[str], now: float) -> bool:
+        """更新后端的last_seen（ipv6为None时更新端口的所有后端），需持有锁"""
+        backends = self._clients.get(port)
+        if not backends:
+            return False
+        if ipv6 is None:
+            for client in backends.values():
+                client.last_seen = max(client.last_seen, now)
+            return True
+        client = backends.get(ipv6)
+        if client is None:
+            return False
+        client.last_seen = max(client.last_seen, now)
+        return True
+    
+    def _update_route(self, port: int):
+        """重建端口的后端元组，需持有锁"""
+        backends = self._clients.get(port)
+        if backends:
+            self._routes[port] = tuple(backends.values())
+        else:
+            self._routes.pop(port, None)
+    
+    def _publish(self):
+        """发布新的路由快照，需持有锁"""
+        self._snapshot = dict(self._routes)
+    
+    def _add_client(self, port: int, ipv6: str, now: float, weight: int = 1):
+        """写入后端记录并加入过期堆，需持有锁，调用方负责发布快照"""
+        backends = self._clients.setdefault(port, {})
+        client = backends.get(ipv6)
+        if client is not None:
+            # 重复注册视为心跳，保留原对象以保持连接计数；客户端重新上线，重置熔断状态
+            client.last_seen = max(client.last_seen, now)
+            client.weight = weight
+            client.failures = 0
+            client.circuit_open_until = 0.0
+            client.circuit_probing = False
+            return
+        client = ClientInfo(
+            ipv6=ipv6,
+            port=port,
+            last_seen=now,
+            weight=weight
+        )
+        backends[ipv6] = client
+        self._update_route(port)
+        deadline = now + self._timeout
+        if not self._expiry or deadline < self._expiry[0][0]:
+            # 清理线程可能正休眠到更晚的时间
+            self._wakeup.set()
+        heapq.heappush(self._expiry, (deadline, next(self._sequence), port, client))
+    
+    def _expire_due(self, now: float) -> List[Tuple[int, str]]:
+        """处理所有已到期的堆顶记录，返回被清理的(端口, 地址)；需持有锁"""
+        expired = []
+        while self._expiry and self._expiry[0][0] <= now:
+            _, _, port, client = heapq.heappop(self._expiry)
+            if self._clients.get(port, {}).get(client.ipv6) is not client:
+                # 已被注销或删除后重新注册，丢弃旧记录
+                continue
+            deadline = client.last_seen + self._timeout
+            if deadline > now:
+                # 期间有心跳，按新的到期时间重新入堆
+                heapq.heappush(self._expiry, (deadline, next(self._sequence), port, client))
+                continue
+            self._discard(port, client.ipv6)
+            expired.append((port, client.ipv6))
+        if expired:
+            self._publish()
+            self._emit((EVENT_EXPIRE, expired))
+        return expired
     
     def _cleanup_expired(self):
-        """清理过期客户端"""
+        """清理过期客户端，休眠到下一个到期时间"""
         while True:
             try:
                 with self._lock:
                     now = time.time()
-                    expired_ports = [
-                        port for port, client in self._clients.items()
-                        if now - client.last_seen >= self._timeout
-                    ]
-                    for port in expired_ports:
-                        del self._clients[port]
-                        logging.info(f"Cleaned up expired client: port={port}")
+                    for port, ipv6 in self._expire_due(now):
+                        logging.info(f"Cleaned up expired client: port={port}, ipv6={ipv6}")
+                    if self._expiry:
+                        delay = self._expiry[0][0] - now
+                    else:
+                        delay = self.MAX_CLEANUP_INTERVAL
                 
-                time.sleep(60)  # 每分钟清理一次
+                self._wakeup.wait(min(max(delay, 0.01), self.MAX_CLEANUP_INTERVAL))
+                self._wakeup.clear()
             except Exception as e:
                 logging.error(f"Cleanup error: {e}")
-                time.sleep(60)
\ No newline at end of file
+                time.sleep(self.MAX_CLEANUP_INTERVAL)
\ No newline at end of file
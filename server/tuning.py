@@ -0,0 +1,124 @@
+import socket
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+# 调优配置名称
+PROFILE_DEFAULT = 'default'          # 不设置任何选项，使用系统默认
+PROFILE_INTERACTIVE = 'interactive'  # 小包交互（SSH、游戏、RPC）：关闭Nagle，尽快发现断开的对端
+PROFILE_BULK = 'bulk'                # 大块传输：大缓冲区
+PROFILE_FASTOPEN = 'fastopen'        # interactive + 上游TFO，仅适用于访问者先发送数据的协议（如HTTP）
+
+# Linux 4.11+，socket模块未导出该常量
+TCP_FASTOPEN_CONNECT = getattr(socket, 'TCP_FASTOPEN_CONNECT', 30)
+
+@dataclass(frozen=True)
+class SocketProfile:
+    """一组TCP socket选项，0/False表示保持系统默认"""
+    name: str
+    nodelay: bool = False
+    # keepalive_idle>0时开启SO_KEEPALIVE：空闲多少秒后开始探测、探测间隔(秒)、连续失败多少次断开
+    keepalive_idle: int = 0
+    keepalive_interval: int = 0
+    keepalive_count: int = 0
+    # SO_SNDBUF/SO_RCVBUF(字节)，设置后内核不再自动调整，上限为net.core.wmem_max/rmem_max
+    send_buffer: int = 0
+    recv_buffer: int = 0
+    # 监听socket的TCP_FASTOPEN队列长度，需net.ipv4.tcp_fastopen开启服务端(位2)
+    fastopen_queue: int = 0
+    # 上游连接使用TCP_FASTOPEN_CONNECT：SYN推迟到第一次写并携带数据，
+    # 连接失败要到第一次写时才发现，不会换其他客户端重试；服务端先发送数据的协议会一直等待
+    fastopen_connect: bool = False
+    # 已发送的数据超过该时间(毫秒)未被确认即断开
+    user_timeout: int = 0
+    
+    def options(self, listener: bool = False, fastopen_connect: bool = True) -> List[Tuple[str, int, int, int]]:
+        """需要设置的(名称, level, option, value)；监听socket上的选项在accept时由新连接继承"""
+        options = []
+        if self.send_buffer:
+            options.append(('SO_SNDBUF', socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer))
+        if self.recv_buffer:
+            options.append(('SO_RCVBUF', socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer))
+        if self.nodelay:
+            options.append(('TCP_NODELAY', socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+        if self.keepalive_idle:
+            options.append(('SO_KEEPALIVE', socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            for name, value in (('TCP_KEEPIDLE', self.keepalive_idle),
+                                ('TCP_KEEPINTVL', self.keepalive_interval),
+                                ('TCP_KEEPCNT', self.keepalive_count)):
+                if value and hasattr(socket, name):
+                    options.append((name, socket.IPPROTO_TCP, getattr(socket, name), value))
+        if self.user_timeout and hasattr(socket, 'TCP_USER_TIMEOUT'):
+            options.append(('TCP_USER_TIMEOUT', socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, self.user_timeout))
+        if listener:
+            if self.fastopen_queue and hasattr(socket, 'TCP_FASTOPEN'):
+                options.append(('TCP_FASTOPEN', socket.IPPROTO_TCP, socket.TCP_FASTOPEN, self.fastopen_queue))
+        elif self.fastopen_connect and fastopen_connect:
+            options.append(('TCP_FASTOPEN_CONNECT', socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1))
+        return options
+
+PROFILES: Dict[str, SocketProfile] = {
+    PROFILE_DEFAULT: SocketProfile(PROFILE_DEFAULT),
+    PROFILE_INTERACTIVE: SocketProfile(
+        PROFILE_INTERACTIVE, nodelay=True, keepalive_idle=60, keepalive_interval=10, keepalive_count=6,
+        fastopen_queue=256, user_timeout=30000
+    ),
+    PROFILE_BULK: SocketProfile(
+        PROFILE_BULK, keepalive_idle=60, keepalive_interval=10, keepalive_count=6,
+        send_buffer=4 * 1024 * 1024, recv_buffer=4 * 1024 * 1024, fastopen_queue=256, user_timeout=120000
+    ),
+    PROFILE_FASTOPEN: SocketProfile(
+        PROFILE_FASTOPEN, nodelay=True, keepalive_idle=60, keepalive_interval=10, keepalive_count=6,
+        fastopen_queue=256, fastopen_connect=True, user_timeout=30000
+    ),
+}
+
+class SocketTuner:
+    """按代理端口选择socket调优配置
+    
+    访问者一侧的选项设置在监听socket上，由accept的连接继承；上游socket在connect之前设置，
+    缓冲区大小才会影响窗口扩大因子，TCP_FASTOPEN_CONNECT才会生效。不支持的选项只告警一次。
+    """
+    
+    def __init__(self, default: str = PROFILE_DEFAULT, port_profiles: Optional[Dict[int, str]] = None):
+        self._unsupported: Set[str] = set()
+        self._options: Dict[Tuple[str, bool, bool], List[Tuple[str, int, int, int]]] = {}
+        self._ports: Dict[int, SocketProfile] = {}
+        self.default = self._lookup(default)
+        for port, name in (port_profiles or {}).items():
+            self.assign(port, name)
+    
+    def assign(self, port: int, name: str):
+        """为端口指定调优配置，对之后创建的监听和上游连接生效"""
+        self._ports[port] = self._lookup(name)
+    
+    def profile_for(self, port: int) -> SocketProfile:
+        return self._ports.get(port, self.default)
+    
+    def tune_listener(self, sock: socket.socket, port: int):
+        """设置代理端口的监听socket"""
+        self._apply(sock, self.profile_for(port), True, False)
+    
+    def tune_upstream(self, sock: socket.socket, port: int, fastopen_connect: bool = True):
+        """设置到本地服务/客户端的socket，需在connect之前调用；预连接不使用TFO"""
+        self._apply(sock, self.profile_for(port), False, fastopen_connect)
+    
+    def _lookup(self, name: str) -> SocketProfile:
+        profile = PROFILES.get(name)
+        if profile is None:
+            logging.warning(f"Unknown socket profile '{name}', using {PROFILE_DEFAULT}")
+            profile = PROFILES[PROFILE_DEFAULT]
+        return profile
+    
+    def _apply(self, sock: socket.socket, profile: SocketProfile, listener: bool, fastopen_connect: bool):
+        key = (profile.name, listener, fastopen_connect)
+        options = self._options.get(key)
+        if options is None:
+            options = self._options[key] = profile.options(listener, fastopen_connect)
+        for name, level, option, value in options:
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError as e:
+                if name not in self._unsupported:
+                    self._unsupported.add(name)
+                    logging.warning(f"Failed to set socket option {name} ({profile.name} profile): {e}")
\ No newline at end of file
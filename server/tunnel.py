@@ -0,0 +1,145 @@
+import json
+import socket
+import threading
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from common.mux import MuxSession
+from common.protocol import TunnelFrameType, encode_tunnel_frame, read_tunnel_frame
+from .utils import validate_ipv6
+
+class TunnelServer:
+    """接受客户端主动建立的隧道连接，代理通过隧道中的流访问客户端服务
+    
+    客户端无需接受入站连接，也省去了每个访问者一次到客户端的TCP握手。
+    同一客户端可以建立多条隧道，新流分配到流最少的隧道。
+    """
+    
+    # 握手超时(秒)
+    HANDSHAKE_TIMEOUT = 10
+    
+    def __init__(self, api_key: str, host: str = '0.0.0.0', port: int = 8002):
+        self.api_key = api_key
+        self.host = host
+        self.port = port
+        # ipv6 -> [(会话, 端口)]
+        self._sessions: Dict[str, List[Tuple[MuxSession, List[int]]]] = {}
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """启动隧道监听线程"""
+        thread = threading.Thread(target=self._serve, daemon=True)
+        thread.start()
+        return thread
+    
+    def open_stream(self, ipv6: str, port: int,
+                    on_open: Optional[Callable[[bool], None]] = None) -> Optional[socket.socket]:
+        """通过客户端的隧道打开到端口的流，返回本端socket；没有可用隧道时返回None
+        
+        on_open(ok)在客户端连接本地服务成功(True)或失败(False)后于隧道线程中调用；
+        不确认OPEN的旧客户端在发出OPEN时即以True调用
+        """
+        with self._lock:
+            candidates = [session for session, ports in self._sessions.get(ipv6, ()) if port in ports]
+        # 隧道可能刚刚断开，依次尝试
+        for session in sorted(candidates, key=lambda session: session.stream_count):
+            try:
+                return session.open_stream(port, on_open)
+            except ConnectionError:
+                continue
+        return None
+    
+    def connect_stream(self, ipv6: str, port: int, timeout: float) -> Optional[socket.socket]:
+        """打开流并等待客户端连接本地服务；没有可用隧道时返回None，客户端连接失败或超时抛出ConnectionError"""
+        opened = threading.Event()
+        result = []
+        
+        def on_open(ok: bool):
+            result.append(ok)
+            opened.set()
+        
+        sock = self.open_stream(ipv6, port, on_open)
+        if sock is None:
+            return None
+        if not opened.wait(timeout) or not result[0]:
+            sock.close()
+            raise ConnectionError('tunnel stream refused' if result else 'tunnel stream timed out')
+        return sock
+    
+    def get_sessions(self) -> Dict[str, int]:
+        """在线客户端及其隧道数"""
+        with self._lock:
+            return {ipv6: len(sessions) for ipv6, sessions in self._sessions.items()}
+    
+    def _serve(self):
+        """接受隧道连接"""
+        try:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind((self.host, self.port))
+            server_socket.listen(128)
+            
+            logging.info(f"Tunnel server started on port {self.port}")
+            
+            while True:
+                try:
+                    client_socket, client_addr = server_socket.accept()
+                    thread = threading.Thread(
+                        target=self._handshake,
+                        args=(client_socket, client_addr),
+                        daemon=True
+                    )
+                    thread.start()
+                except Exception as e:
+                    logging.error(f"Error accepting tunnel connection: {e}")
+        
+        except Exception as e:
+            logging.error(f"Failed to start tunnel server on port {self.port}: {e}")
+    
+    def _handshake(self, sock: socket.socket, addr):
+        """验证HELLO帧，成功后把连接交给多路复用会话"""
+        try:
+            sock.settimeout(self.HANDSHAKE_TIMEOUT)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            frame = read_tunnel_frame(sock)
+            if frame is None:
+                sock.close()
+                return
+            frame_type, _, payload = frame
+            error = None
+            data = json.loads(payload.decode('utf-8')) if frame_type == TunnelFrameType.HELLO else {}
+            ipv6 = data.get('ipv6')
+            ports = data.get('ports')
+            if frame_type != TunnelFrameType.HELLO:
+                error = 'Expected HELLO'
+            elif data.get('api_key') != self.api_key:
+                error = 'Invalid API key'
+            elif not ipv6 or not validate_ipv6(ipv6):
+                error = 'Invalid IPv6 address'
+            elif not ports or not all(isinstance(port, int) and 1 <= port <= 65535 for port in ports):
+                error = 'Invalid port number'
+            if error:
+                sock.sendall(encode_tunnel_frame(TunnelFrameType.ERROR, 0, json.dumps({'message': error}).encode('utf-8')))
+                sock.close()
+                return
+            sock.sendall(encode_tunnel_frame(TunnelFrameType.HELLO_ACK, 0, b'{}'))
+        except Exception as e:
+            logging.debug(f"Tunnel handshake failed from {addr}: {e}")
+            sock.close()
+            return
+        
+        session = MuxSession(sock, on_close=lambda session: self._remove(ipv6, session), name=f'{addr[0]}:{addr[1]}',
+                             open_ack=data.get('open_ack') is True)
+        with self._lock:
+            self._sessions.setdefault(ipv6, []).append((session, list(ports)))
+        session.start()
+        logging.info(f"Tunnel connected: {addr} ipv6={ipv6} ports={ports}")
+    
+    def _remove(self, ipv6: str, session: MuxSession):
+        """隧道断开"""
+        with self._lock:
+            sessions = [entry for entry in self._sessions.get(ipv6, ()) if entry[0] is not session]
+            if sessions:
+                self._sessions[ipv6] = sessions
+            else:
+                self._sessions.pop(ipv6, None)
+        logging.info(f"Tunnel closed: ipv6={ipv6}")
\ No newline at end of file
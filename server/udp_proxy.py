@@ -0,0 +1,269 @@
+import errno
+import selectors
+import socket
+import threading
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from common.logger import CONNECTION_LOGGER
+from .registry import ClientRegistry, ClientInfo
+from .balancer import Balancer, LeastConnectionsBalancer
+from .circuit import CircuitBreaker
+from .metrics import UDPMetrics, RESULT_ACCEPTED, RESULT_NO_SERVICE, RESULT_UNAVAILABLE, RESULT_REJECTED
+
+# 每个流的日志，参数在写入线程中才格式化，可通过LOG_CONNECTION_SAMPLE_RATE采样
+connection_log = logging.getLogger(CONNECTION_LOGGER)
+
+# 数据报丢弃原因
+DROP_NO_SERVICE = 'no_service'
+DROP_SEND_ERROR = 'send_error'
+DROP_REFUSED = 'refused'
+DROP_OVERFLOW = 'overflow'
+
+# 上游socket上表示客户端不可达的错误（ICMPv6不可达，客户端的IPv6地址已失效），与端口不可达同样处理
+UNREACHABLE_ERRNOS = frozenset((errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN, errno.ENETDOWN))
+
+class UDPFlow:
+    """一个访问者地址到客户端的转发流，上游socket已connect到客户端"""
+    
+    __slots__ = ('port', 'peer', 'listener', 'upstream', 'client', 'labels', 'last_active',
+                 'replied', 'datagrams_in', 'datagrams_out', 'bytes_in', 'bytes_out')
+    
+    def __init__(self, port: int, peer, listener: socket.socket, upstream: socket.socket, client: ClientInfo):
+        self.port = port
+        self.peer = peer
+        self.listener = listener
+        self.upstream = upstream
+        self.client = client
+        self.labels = (str(port), client.ipv6)
+        self.last_active = time.monotonic()
+        # 是否收到过客户端的回复（用于熔断器记录成功）
+        self.replied = False
+        self.datagrams_in = 0
+        self.datagrams_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+class UDPProxy:
+    """UDP转发引擎，单线程事件循环服务所有端口的所有流
+    
+    流表按(代理端口, 访问者地址)为每个访问者创建一个connect到客户端的AF_INET6 socket，
+    客户端的回复从该socket读出后由代理端口发回访问者；空闲超过idle_timeout的流被淘汰。
+    每次就绪最多连续收发batch个数据报，使用预分配的缓冲区，不为每个数据报分配内存。
+    """
+    
+    # UDP数据报的最大长度
+    MAX_DATAGRAM = 65535
+    BATCH = 64
+    
+    def __init__(self, registry: ClientRegistry,
+                 balancer: Optional[Balancer] = None,
+                 metrics: Optional[UDPMetrics] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 idle_timeout: float = 60,
+                 max_flows: int = 10000,
+                 batch: int = BATCH,
+                 host: str = '0.0.0.0'):
+        self.registry = registry
+        self.balancer = balancer or LeastConnectionsBalancer()
+        self.metrics = metrics or UDPMetrics()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.batch = batch
+        self.host = host
+        self._selector = selectors.DefaultSelector()
+        self._listeners: Dict[int, socket.socket] = {}
+        # port -> {访问者地址: 流}
+        self._flows: Dict[int, Dict[Tuple, UDPFlow]] = {}
+        self._flow_count = 0
+        self._buffer = bytearray(self.MAX_DATAGRAM)
+        self._view = memoryview(self._buffer)
+        self.metrics.live_flows = self._live_flows
+    
+    @property
+    def active_flows(self) -> int:
+        return self._flow_count
+    
+    @property
+    def ports(self) -> List[int]:
+        return list(self._listeners)
+    
+    def start(self, ports: List[int]):
+        """绑定所有端口并在后台线程中运行事件循环"""
+        for port in ports:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((self.host, port))
+                sock.setblocking(False)
+            except Exception as e:
+                logging.error(f"Failed to start UDP proxy on port {port}: {e}")
+                continue
+            self._listeners[port] = sock
+            self._flows[port] = {}
+            self._selector.register(sock, selectors.EVENT_READ, port)
+        thread = threading.Thread(target=self.run, name='lambdalink-udp', daemon=True)
+        thread.start()
+        logging.info(f"Started UDP proxy for {len(self._listeners)} ports")
+        return thread
+    
+    def run(self):
+        """事件循环（阻塞）"""
+        sweep_interval = max(min(self.idle_timeout / 4, 5), 0.05)
+        next_sweep = time.monotonic() + sweep_interval
+        while True:
+            try:
+                events = self._selector.select(max(next_sweep - time.monotonic(), 0))
+                for key, _ in events:
+                    if isinstance(key.data, UDPFlow):
+                        self._from_client(key.data)
+                    else:
+                        self._from_visitors(key.fileobj, key.data)
+                now = time.monotonic()
+                if now >= next_sweep:
+                    self._evict_idle(now)
+                    next_sweep = now + sweep_interval
+            except Exception as e:
+                logging.error(f"UDP proxy loop error: {e}")
+    
+    def _from_visitors(self, listener: socket.socket, port: int):
+        """读取代理端口上访问者发来的数据报，按流表转发给客户端"""
+        flows = self._flows[port]
+        buffer, view = self._buffer, self._view
+        now = time.monotonic()
+        for _ in range(self.batch):
+            try:
+                size, peer = listener.recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logging.debug(f"UDP receive error on port {port}: {e}")
+                continue
+            flow = flows.get(peer)
+            if flow is None:
+                flow = self._open_flow(port, peer, listener)
+                if flow is None:
+                    continue
+            try:
+                flow.upstream.send(view[:size])
+            except (BlockingIOError, InterruptedError):
+                self.metrics.drop(port, DROP_SEND_ERROR)
+                continue
+            except OSError as e:
+                if isinstance(e, ConnectionRefusedError) or e.errno in UNREACHABLE_ERRNOS:
+                    # 之前的数据报触发了ICMP端口/主机/网络不可达
+                    self._refused(flow)
+                    continue
+                logging.debug(f"UDP send error to [{flow.client.ipv6}]:{port}: {e}")
+                self.metrics.drop(port, DROP_SEND_ERROR)
+                continue
+            flow.last_active = now
+            flow.datagrams_in += 1
+            flow.bytes_in += size
+    
+    def _from_client(self, flow: UDPFlow):
+        """读取客户端的回复并发回访问者"""
+        buffer, view = self._buffer, self._view
+        upstream, listener, peer = flow.upstream, flow.listener, flow.peer
+        received = 0
+        for _ in range(self.batch):
+            try:
+                size = upstream.recv_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if isinstance(e, ConnectionRefusedError) or e.errno in UNREACHABLE_ERRNOS:
+                    self._refused(flow)
+                    return
+                logging.debug(f"UDP receive error from [{flow.client.ipv6}]:{flow.port}: {e}")
+                break
+            received += 1
+            try:
+                listener.sendto(view[:size], peer)
+            except OSError:
+                self.metrics.drop(flow.port, DROP_SEND_ERROR)
+                continue
+            flow.datagrams_out += 1
+            flow.bytes_out += size
+        if not received:
+            return
+        flow.last_active = time.monotonic()
+        if not flow.replied:
+            flow.replied = True
+            self.circuit_breaker.record_success(flow.client)
+    
+    def _open_flow(self, port: int, peer, listener: socket.socket) -> Optional[UDPFlow]:
+        """为新的访问者选择客户端并创建上游socket，失败时丢弃该数据报"""
+        backends = self.registry.get_backends(port)
+        if not backends:
+            self.metrics.drop(port, DROP_NO_SERVICE)
+            self.metrics.flow(port, RESULT_NO_SERVICE)
+            return None
+        if self._flow_count >= self.max_flows:
+            self.metrics.drop(port, DROP_OVERFLOW)
+            self.metrics.flow(port, RESULT_REJECTED)
+            connection_log.warning('UDP flow table full, dropping datagram from %s on port %s', peer, port,
+                                   extra={'port': port, 'peer': peer, 'result': RESULT_REJECTED})
+            return None
+        client = self.balancer.acquire(port, self.circuit_breaker.available(backends))
+        if client is None:
+            self.metrics.drop(port, DROP_NO_SERVICE)
+            self.metrics.flow(port, RESULT_UNAVAILABLE)
+            return None
+        upstream = None
+        try:
+            upstream = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            upstream.setblocking(False)
+            upstream.connect((client.ipv6, port))
+        except OSError as e:
+            logging.error(f"Failed to open UDP flow to [{client.ipv6}]:{port}: {e}")
+            if upstream is not None:
+                upstream.close()
+            self.balancer.release(client)
+            self.circuit_breaker.record_failure(client)
+            self.metrics.drop(port, DROP_SEND_ERROR)
+            return None
+        
+        flow = UDPFlow(port, peer, listener, upstream, client)
+        self._flows[port][peer] = flow
+        self._flow_count += 1
+        self._selector.register(upstream, selectors.EVENT_READ, flow)
+        self.metrics.flow(port, RESULT_ACCEPTED)
+        connection_log.info('UDP flow: %s -> [%s]:%s', peer, client.ipv6, port,
+                            extra={'port': port, 'peer': peer, 'backend': client.ipv6})
+        return flow
+    
+    def _refused(self, flow: UDPFlow):
+        """客户端端口/主机不可达：记录失败并淘汰该流，下一个数据报重新选择客户端"""
+        self.metrics.drop(flow.port, DROP_REFUSED)
+        self.circuit_breaker.record_failure(flow.client)
+        self._close_flow(flow)
+    
+    def _close_flow(self, flow: UDPFlow):
+        flows = self._flows[flow.port]
+        if flows.get(flow.peer) is not flow:
+            return
+        del flows[flow.peer]
+        self._flow_count -= 1
+        try:
+            self._selector.unregister(flow.upstream)
+        except (KeyError, ValueError):
+            pass
+        flow.upstream.close()
+        self.balancer.release(flow.client)
+        self.metrics.close_flow(flow)
+    
+    def _evict_idle(self, now: float):
+        """淘汰空闲超时的流，以及客户端已注销或过期的流"""
+        deadline = now - self.idle_timeout
+        for port, flows in self._flows.items():
+            if not flows:
+                continue
+            live = {id(backend) for backend in self.registry.get_backends(port)}
+            for flow in [f for f in flows.values() if f.last_active < deadline or id(f.client) not in live]:
+                self._close_flow(flow)
+    
+    def _live_flows(self) -> List[UDPFlow]:
+        # 可能在其他线程调用；list()在C层一次完成，事件循环同时修改流表也不会出错
+        return [flow for flows in list(self._flows.values()) for flow in list(flows.values())]
\ No newline at end of file
@@ -1,7 +1,11 @@
 import subprocess
 import socket
 import logging
-from typing import Optional
+import resource
+import os
+import threading
+import time
+from typing import Optional, Iterable, FrozenSet, Set
 
 def is_port_listening(port: int, host: str = '127.0.0.1') -> bool:
     """检查指定端口是否被本地服务监听"""
@@ -26,6 +30,129 @@ def is_port_listening(port: int, host: str = '127.0.0.1') -> bool:
         except:
             return False
 
+class LocalListenerCache:
+    """本地监听端口缓存
+
+    后台线程定期批量解析/proc/net/tcp和/proc/net/tcp6，
+    每个连接的路由判断只需一次集合查找。
+    """
+
+    PROC_FILES = ('/proc/net/tcp', '/proc/net/tcp6')
+    TCP_LISTEN = '0A'
+
+    def __init__(self, ports: Optional[Iterable[int]] = None, ttl: float = 1.0):
+        self._ports: Optional[FrozenSet[int]] = frozenset(ports) if ports is not None else None
+        self._ttl = ttl
+        self._listening: FrozenSet[int] = frozenset()
+        self._ignored_inodes: Set[int] = set()
+        self._updated = 0.0
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self.available = all(os.path.exists(path) for path in self.PROC_FILES)
+        if not self.available:
+            logging.warning("/proc/net/tcp not available, falling back to per-connection ss checks")
+
+    def start(self):
+        """启动后台刷新线程"""
+        if not self.available or self._running:
+            return
+        self._running = True
+        self.refresh()
+        thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        thread.start()
+
+    def stop(self):
+        """停止后台刷新"""
+        self._running = False
+        self._wakeup.set()
+
+    def is_listening(self, port: int) -> bool:
+        """检查端口是否有本地服务监听"""
+        if not self.available:
+            return is_port_listening(port)
+        if not self._running and time.monotonic() - self._updated > self._ttl:
+            # 后台线程未运行，同步刷新；运行时总是返回上一次的结果，不在调用方（可能是事件循环）中解析监听表
+            self.refresh()
+        return port in self._listening
+
+    def invalidate(self, port: Optional[int] = None):
+        """使缓存失效：后台线程运行时唤醒它立即重新读取，否则下一次查询时同步读取"""
+        if self._running:
+            self._wakeup.set()
+        else:
+            self._updated = 0.0
+        if port is not None:
+            logging.debug(f"Local listener cache invalidated for port {port}")
+
+    def watch(self, port: int):
+        """把端口加入检查范围（运行时新增的代理端口）"""
+        if self._ports is not None and port not in self._ports:
+            self._ports = self._ports | {port}
+            self.invalidate(port)
+
+    def ignore_socket(self, sock: socket.socket):
+        """忽略代理自身的监听socket，避免把自己当作本地服务"""
+        try:
+            self.ignore_inode(os.fstat(sock.fileno()).st_ino)
+        except OSError as e:
+            logging.warning(f"Failed to ignore listening socket: {e}")
+
+    def ignore_inode(self, inode: int):
+        """按inode忽略监听socket（socket属于其他进程时使用）"""
+        self._ignored_inodes.add(inode)
+        self.invalidate()
+
+    def refresh(self):
+        """批量读取监听表"""
+        with self._refresh_lock:
+            listening = set()
+            for path in self.PROC_FILES:
+                try:
+                    with open(path, 'r') as f:
+                        lines = f.readlines()
+                except OSError as e:
+                    logging.warning(f"Failed to read {path}: {e}")
+                    continue
+
+                for line in lines[1:]:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[3] != self.TCP_LISTEN:
+                        continue
+                    port = int(fields[1].rsplit(':', 1)[1], 16)
+                    if self._ports is not None and port not in self._ports:
+                        continue
+                    if int(fields[9]) in self._ignored_inodes:
+                        continue
+                    listening.add(port)
+
+            self._listening = frozenset(listening)
+            self._updated = time.monotonic()
+
+    def _refresh_loop(self):
+        """后台刷新循环"""
+        while self._running:
+            self._wakeup.wait(self._ttl / 2)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Local listener refresh error: {e}")
+
+def create_listener(host: str, port: int, backlog: int = 10, reuse_port: bool = False) -> socket.socket:
+    """创建TCP监听socket；reuse_port时多个进程可绑定同一端口，由内核分配连接"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
 def validate_ipv6(address: str) -> bool:
     """验证IPv6地址格式"""
     try:
@@ -43,4 +170,18 @@ def get_local_ip() -> str:
         s.close()
         return ip
     except:
-        return "127.0.0.1"
\ No newline at end of file
+        return "127.0.0.1"
+
+def raise_nofile_limit() -> int:
+    """将文件描述符软限制提升到硬限制，返回新的软限制"""
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            target = hard if hard != resource.RLIM_INFINITY else max(soft, 1048576)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            logging.info(f"Raised open file limit: {soft} -> {target}")
+            return target
+        return soft
+    except Exception as e:
+        logging.warning(f"Failed to raise open file limit: {e}")
+        return -1
\ No newline at end of file
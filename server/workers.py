@@ -0,0 +1,203 @@
+import multiprocessing
+import os
+import socket
+import threading
+import logging
+import time
+from multiprocessing.reduction import recv_handle, send_handle
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .registry import ClientRegistry
+from .utils import create_listener
+from .metrics import ACTIVE_SESSIONS, LOCAL_CLIENT, merge_metrics
+
+class ProxyWorkerPool:
+    """多进程代理
+    
+    每个worker进程持有全部代理端口的一组SO_REUSEPORT监听socket，由内核在进程间分配连接；
+    API进程中的ClientRegistry是唯一的写入方，变更事件通过队列推送给各worker的注册表副本。
+    
+    主进程在创建worker时已有日志、注册表清理、API等线程，直接fork可能让子进程继承被其他线程持有的锁，
+    因此worker由forkserver进程创建：它在第一次启动worker时由全新的解释器启动且不导入主模块，始终是单线程的。
+    worker会重新导入主模块（不执行__main__部分），build_proxy/run_proxy必须是模块级函数；
+    监听socket在worker启动后逐个通过Unix socket传递，不受单条消息可传递的描述符数量限制。
+    """
+    
+    # worker异常退出后的检查间隔
+    MONITOR_INTERVAL = 5
+    # worker上报指标的间隔
+    METRICS_INTERVAL = 5
+    
+    def __init__(self, registry: ClientRegistry, num_workers: int, ports: List[int],
+                 build_proxy: Callable[[ClientRegistry], Any],
+                 run_proxy: Callable[[Any, Dict[int, socket.socket]], None],
+                 timeout: int = 300, host: str = '0.0.0.0', backlog: int = 4096):
+        self.registry = registry
+        self.num_workers = num_workers
+        self.ports = ports
+        self.build_proxy = build_proxy
+        self.run_proxy = run_proxy
+        self.timeout = timeout
+        self.host = host
+        self.backlog = backlog
+        self._ctx = multiprocessing.get_context('forkserver')
+        # 只预加载代理模块，不导入主模块（导入时会启动线程）
+        self._ctx.set_forkserver_preload(['server.proxy', 'server.async_proxy'])
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * num_workers
+        self._feeds: List[Optional[Callable[[tuple], None]]] = [None] * num_workers
+        self._active = [self._ctx.Value('i', 0, lock=False) for _ in range(num_workers)]
+        # 各worker最近一次上报的指标；已退出worker的最后一次上报合并到_retired_metrics
+        self._metrics_queue = self._ctx.Queue()
+        self._metrics: List[Optional[dict]] = [None] * num_workers
+        self._retired_metrics: Optional[dict] = None
+        self._metrics_lock = threading.Lock()
+        # sockets[port][i]为第i个worker使用的监听socket
+        # 由主进程创建并一直持有，重启的worker继续使用同一socket，不丢失已排队的连接
+        self._sockets: Dict[int, List[socket.socket]] = {}
+        # 所有监听socket的inode，worker的本地监听检查据此忽略代理自身
+        self._inodes: List[int] = []
+    
+    @property
+    def active_connections(self) -> int:
+        """所有worker的活跃连接数之和"""
+        return sum(value.value for value in self._active)
+    
+    def start(self):
+        """创建监听socket并启动所有worker"""
+        for port in self.ports:
+            try:
+                self._sockets[port] = [
+                    create_listener(self.host, port, self.backlog, reuse_port=True)
+                    for _ in range(self.num_workers)
+                ]
+            except Exception as e:
+                logging.error(f"Failed to start proxy server on port {port}: {e}")
+        self._inodes = [os.fstat(sock.fileno()).st_ino for sockets in self._sockets.values() for sock in sockets]
+        
+        for index in range(self.num_workers):
+            self._spawn(index)
+        
+        monitor_thread = threading.Thread(target=self._monitor, daemon=True)
+        monitor_thread.start()
+        metrics_thread = threading.Thread(target=self._receive_metrics, daemon=True)
+        metrics_thread.start()
+        logging.info(f"Started {self.num_workers} proxy workers for {len(self._sockets)} ports")
+    
+    def collect_metrics(self) -> List[dict]:
+        """所有worker的指标（含已退出worker的累计值），供render_metrics合并输出"""
+        with self._metrics_lock:
+            collections = [metrics for metrics in self._metrics if metrics]
+            if self._retired_metrics:
+                collections.append(self._retired_metrics)
+        return collections
+    
+    def connection_counts(self) -> Dict[Tuple[int, str], int]:
+        """各worker最近一次上报的 (端口, 客户端地址) -> 进行中的会话数，最多滞后METRICS_INTERVAL秒"""
+        with self._metrics_lock:
+            collections = [metrics for metrics in self._metrics if metrics]
+        counts: Dict[Tuple[int, str], int] = {}
+        for metrics in collections:
+            for (port, client), value in metrics.get(ACTIVE_SESSIONS, {}).get('samples', {}).items():
+                if client != LOCAL_CLIENT:
+                    key = (int(port), client)
+                    counts[key] = counts.get(key, 0) + value
+        return counts
+    
+    def _spawn(self, index: int):
+        """启动第index个worker，并把注册表的当前状态和后续变更推送给它"""
+        events = self._ctx.Queue()
+        feed = events.put
+        self.registry.subscribe(feed, replay=True)
+        self._feeds[index] = feed
+        
+        ports = list(self._sockets)
+        handles, worker_handles = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=self._worker_main,
+            args=(index, ports, worker_handles, self._inodes, events, self._active[index], self._metrics_queue,
+                  self.build_proxy, self.run_proxy, self.timeout),
+            name=f"lambdalink-proxy-{index}",
+            daemon=True
+        )
+        process.start()
+        worker_handles.close()
+        try:
+            for port in ports:
+                send_handle(handles, self._sockets[port][index].fileno(), process.pid)
+        except OSError as e:
+            # worker在接收完之前退出，由_monitor重启
+            logging.error(f"Failed to pass listening sockets to proxy worker {index}: {e}")
+        finally:
+            handles.close()
+        self._processes[index] = process
+        logging.info(f"Proxy worker {index} started: pid={process.pid}")
+    
+    def _monitor(self):
+        """重启异常退出的worker"""
+        while True:
+            time.sleep(self.MONITOR_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process is None or process.is_alive():
+                    continue
+                logging.error(f"Proxy worker {index} exited with code {process.exitcode}, restarting")
+                self.registry.unsubscribe(self._feeds[index])
+                self._active[index].value = 0
+                with self._metrics_lock:
+                    if self._metrics[index]:
+                        # 已退出的worker没有进行中的会话，只保留累计值
+                        retired = [{
+                            name: metric for name, metric in self._metrics[index].items()
+                            if metric['type'] != 'gauge'
+                        }]
+                        if self._retired_metrics:
+                            retired.append(self._retired_metrics)
+                        self._retired_metrics = merge_metrics(retired)
+                    self._metrics[index] = None
+                self._spawn(index)
+    
+    @staticmethod
+    def _worker_main(index: int, ports: List[int], handles, inodes: List[int], events, active, metrics_queue,
+                     build_proxy: Callable[[ClientRegistry], Any],
+                     run_proxy: Callable[[Any, Dict[int, socket.socket]], None], timeout: int):
+        """worker进程入口"""
+        own_sockets = {port: socket.socket(fileno=recv_handle(handles)) for port in ports}
+        handles.close()
+        
+        replica = ClientRegistry(timeout)
+        proxy = build_proxy(replica)
+        
+        # 所有worker的监听socket都属于代理自身，不能被当作本地服务
+        for inode in inodes:
+            proxy.listener_cache.ignore_inode(inode)
+        
+        feed_thread = threading.Thread(target=ProxyWorkerPool._apply_events, args=(replica, events), daemon=True)
+        feed_thread.start()
+        
+        run_proxy(proxy, own_sockets)
+        
+        last_report = 0.0
+        while True:
+            active.value = proxy.active_connections
+            now = time.monotonic()
+            if now - last_report >= ProxyWorkerPool.METRICS_INTERVAL:
+                metrics_queue.put((index, proxy.metrics.collect()))
+                last_report = now
+            time.sleep(1)
+    
+    def _receive_metrics(self):
+        """接收worker上报的指标"""
+        while True:
+            try:
+                index, metrics = self._metrics_queue.get()
+                with self._metrics_lock:
+                    self._metrics[index] = metrics
+            except Exception as e:
+                logging.error(f"Failed to receive worker metrics: {e}")
+    
+    @staticmethod
+    def _apply_events(replica: ClientRegistry, events):
+        """把主进程推送的注册表变更应用到副本"""
+        while True:
+            try:
+                replica.apply_event(events.get())
+            except Exception as e:
+                logging.error(f"Failed to apply registry event: {e}")
\ No newline at end of file